@@ -3,45 +3,106 @@
 #   Created by Saleh (github.com/2saleh1)
 # ==========================================================
 
+import time
+STARTUP_STARTED = time.perf_counter()   # --profile-startup measures from here
 import json
 import sys
 import shlex
-import ttkbootstrap as tb
+import importlib
 import tkinter as tk
 from tkinter import messagebox, Listbox, Scrollbar, OptionMenu, StringVar, simpledialog, Entry, filedialog,ttk
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import subprocess
 import os
 import json
 import urllib.parse
-import time
 import threading
 import queue
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import pickle
 import hashlib
 import random
 import re
 from datetime import datetime
 
 
+PROFILE_STARTUP = "--profile-startup" in sys.argv[1:]
+STARTUP_PHASES = []     # (phase, seconds since start) - only filled with --profile-startup
+LAZY_IMPORTS = []       # (module, import seconds, seconds since start)
+
+
+def startup_phase(name):
+    """Record a startup milestone for --profile-startup"""
+    if PROFILE_STARTUP:
+        STARTUP_PHASES.append((name, time.perf_counter() - STARTUP_STARTED))
+
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access.
+    Keeps the theme engine, HTTP stack and pickle off the path to the user selection screen."""
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            started = time.perf_counter()
+            self._module = importlib.import_module(self._name)
+            if PROFILE_STARTUP:
+                LAZY_IMPORTS.append((self._name, time.perf_counter() - started, started - STARTUP_STARTED))
+        return getattr(self._module, attribute)
+
+
+tb = LazyModule("ttkbootstrap")
+requests = LazyModule("requests")
+pickle = LazyModule("pickle")
+startup_phase("core imports")
+
+
+def report_startup_profile():
+    """Print the --profile-startup report to stderr and save it as cache/startup_profile.json"""
+    if not PROFILE_STARTUP:
+        return
+    startup_phase("interactive")
+    print("⏱️ Startup profile (ms since launch, + since previous phase):", file=sys.stderr)
+    previous = 0.0
+    for name, at in STARTUP_PHASES:
+        print(f"   {at * 1000:8.1f}  +{(at - previous) * 1000:7.1f}  {name}", file=sys.stderr)
+        previous = at
+    for name, seconds, at in LAZY_IMPORTS:
+        print(f"   lazy import {name}: {seconds * 1000:.1f} ms (at {at * 1000:.1f})", file=sys.stderr)
+    print("   Per-module import detail: python -X importtime player.py", file=sys.stderr)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(os.path.join(CACHE_DIR, "startup_profile.json"), "w", encoding="utf-8") as f:
+            json.dump({"phases": STARTUP_PHASES, "lazy_imports": LAZY_IMPORTS}, f, indent=2)
+    except Exception as e:
+        print(f"Startup profile save error: {e}", file=sys.stderr)
+
+
 THEME_CONFIG_FILE = "config.json"
 THEME_LIST = [
     "superhero", "darkly", "cyborg", "solar", "vapor", "flatly", "journal", "minty", "litera", "default"
 ]
 
-def load_theme():
+def load_config():
     try:
         with open(THEME_CONFIG_FILE, "r") as f:
-            return json.load(f).get("theme", "superhero")
+            config = json.load(f)
+            return config if isinstance(config, dict) else {}
     except:
-        return "superhero"
+        return {}
 
-def save_theme(theme):
+def save_config(**updates):
+    # Merge so saving one option never drops the others
+    config = load_config()
+    config.update(updates)
     with open(THEME_CONFIG_FILE, "w") as f:
-        json.dump({"theme": theme}, f)
+        json.dump(config, f)
+
+def load_theme():
+    return load_config().get("theme", "superhero")
+
+def save_theme(theme):
+    save_config(theme=theme)
         
 
 
@@ -56,6 +117,249 @@ def center_window(window, width=400, height=250):
 
 CREDENTIALS_DIR = "credentials"
 CACHE_DIR = "cache"
+MAX_ANALYSIS_FILES = 30   # cache/html_analysis keeps this many newest files
+TOOLS_CACHE_FILE = os.path.join(CACHE_DIR, "tools.json")
+
+
+def get_profile_id(portal_url, mac_address):
+    """Unique ID for a portal/MAC profile (used for favorites and learned state)"""
+    key = f"{portal_url}|{mac_address}"
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def get_channel_id(channel):
+    """Stable across refreshes as long as the channel's name and cmd stay the same"""
+    key = channel[2] if len(channel) > 2 else channel[1]
+    return hashlib.sha1(f"{channel[0]}|{key}".encode("utf-8")).hexdigest()[:12]
+
+
+# Name parts that describe a feed rather than the channel: quality, codec and backup tags, bracketed notes
+CHANNEL_TAG_RE = re.compile(
+    r'[\[\(\{][^\]\)\}]*[\]\)\}]'
+    r'|\b(?:[fu]?hd|sd|[48]k|hevc|h\.?26[45]|\d{3,4}[pi]|50fps|60fps|raw|backup|alt|low|multi)\b', re.IGNORECASE)
+
+
+def channel_identity(name):
+    """Normalized channel name - "AR: beIN Sports 1 ᴴᴰ" and "ar | bein sports 1 (backup)" give the same identity.
+    Country prefixes and numbers are kept: "UK: X" and "DE: X", or "Sport 1" and "Sport 2", stay different."""
+    import unicodedata
+    text = unicodedata.normalize("NFKC", name).casefold()    # Superscript ᴴᴰ -> hd
+    text = CHANNEL_TAG_RE.sub(" ", text)
+    identity = " ".join(re.sub(r'[^\w+]+', " ", text).split())
+    return identity or name.casefold().strip()
+
+
+def probe_tools(tools=("ffmpeg", "ffplay", "ffprobe", "mpv"), cache_path=TOOLS_CACHE_FILE):
+    """Locate external tools - {name: {"path", "version", "mtime"}}. `tool -version` only runs
+    when a binary is new or changed, so after the first run this is a PATH lookup per tool."""
+    import shutil
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except:
+        cached = {}
+
+    results = {}
+    for tool in tools:
+        path = shutil.which(tool)
+        if not path:
+            results[tool] = {"path": None, "version": None, "mtime": None}
+            continue
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        known = cached.get(tool) or {}
+        if known.get("path") == path and known.get("mtime") == mtime and mtime is not None:
+            results[tool] = known
+            continue
+        try:
+            flag = "--version" if tool == "mpv" else "-version"
+            output = subprocess.run([path, flag], capture_output=True, text=True, timeout=5).stdout
+            version = output.splitlines()[0].strip() if output else None
+        except Exception:
+            version = None
+        results[tool] = {"path": path, "version": version, "mtime": mtime}
+
+    if results != {tool: cached.get(tool) for tool in tools}:
+        try:
+            os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump(dict(cached, **results), f)
+        except Exception as e:
+            print(f"Tools cache save error: {e}")
+    return results
+
+
+PROFILE_INDEX_FILE = "profiles.index"   # JSON - not *.json, so builds that list credentials/*.json never see it
+
+
+class ProfileStore:
+    """All saved profiles in one JSON index (credentials/profiles.index) - portal, MAC, status colour
+    and cached channel count, loaded with a single read. Per-profile <name>.json files are only an
+    import path: new or changed ones are merged into the index the next time it loads."""
+    IMPORT_WORKERS = 8
+
+    def __init__(self, credentials_dir=CREDENTIALS_DIR):
+        self.credentials_dir = credentials_dir
+        self.index_path = os.path.join(credentials_dir, PROFILE_INDEX_FILE)
+        self.lock = threading.Lock()
+        self.profiles = {}      # name -> {"portal_url", "mac_address", "color", "channel_count", ...}
+        self.imported = {}      # legacy filename -> mtime it was imported at
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            self.profiles = index.get("profiles", {})
+            self.imported = index.get("imported", {})
+        except:
+            self.profiles, self.imported = {}, {}
+        self._import_legacy()
+        return self.profiles
+
+    @staticmethod
+    def _read_legacy(path):
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+                return data if isinstance(data, dict) else None
+        except:
+            return None
+
+    def _import_legacy(self):
+        """Merge <name>.json files that are new or changed since they were last imported"""
+        if not os.path.isdir(self.credentials_dir):
+            return
+        pending = []
+        for filename in os.listdir(self.credentials_dir):
+            # Only profile files - favorites live in the same directory
+            if not filename.endswith(".json") or "_favorites" in filename:
+                continue
+            try:
+                mtime = os.path.getmtime(os.path.join(self.credentials_dir, filename))
+            except OSError:
+                continue
+            if self.imported.get(filename) != mtime:
+                pending.append((filename, mtime))
+        if not pending:
+            return
+
+        paths = [os.path.join(self.credentials_dir, filename) for filename, _ in pending]
+        with ThreadPoolExecutor(max_workers=min(self.IMPORT_WORKERS, len(paths))) as executor:
+            loaded = list(executor.map(self._read_legacy, paths))
+        with self.lock:
+            for (filename, mtime), data in zip(pending, loaded):
+                if data is None:
+                    continue
+                name = filename[:-len(".json")]
+                self.profiles[name] = dict(self.profiles.get(name, {}), **data)
+                self.imported[filename] = mtime
+        print(f"📇 Imported {len(pending)} profile file(s) into the profile index")
+        self.save()
+
+    def save(self):
+        """Write the index atomically"""
+        try:
+            with self.lock:
+                payload = json.dumps({"profiles": self.profiles, "imported": self.imported})
+            os.makedirs(self.credentials_dir, exist_ok=True)
+            temp_path = self.index_path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(temp_path, self.index_path)
+        except Exception as e:
+            print(f"Profile index save error: {e}")
+
+    def add(self, name, portal_url, mac_address):
+        with self.lock:
+            self.profiles[name] = {"portal_url": portal_url, "mac_address": mac_address}
+        self.save()
+
+    def update(self, name, **fields):
+        """Set metadata fields on a profile - None removes the field"""
+        return bool(self.update_many({name: fields}))
+
+    def update_many(self, updates):
+        """{name: fields} in one write - returns how many profiles were updated"""
+        updated = 0
+        with self.lock:
+            for name, fields in updates.items():
+                profile = self.profiles.get(name)
+                if profile is None:
+                    continue
+                for key, value in fields.items():
+                    if value is None:
+                        profile.pop(key, None)
+                    else:
+                        profile[key] = value
+                updated += 1
+        if updated:
+            self.save()
+        return updated
+
+    def delete(self, name):
+        """Remove a profile and its legacy file so it is not imported again"""
+        filename = f"{name}.json"
+        with self.lock:
+            self.profiles.pop(name, None)
+            self.imported.pop(filename, None)
+        try:
+            os.remove(os.path.join(self.credentials_dir, filename))
+        except OSError:
+            pass
+        self.save()
+
+    def record_channel_count(self, portal_url, mac_address, count):
+        """Store the channel count on every profile using this portal/MAC"""
+        with self.lock:
+            names = [name for name, profile in self.profiles.items()
+                     if profile.get("portal_url") == portal_url and profile.get("mac_address") == mac_address]
+        for name in names:
+            self.update(name, channel_count=count, channels_updated=time.time())
+
+
+def load_profiles(credentials_dir=CREDENTIALS_DIR):
+    """All saved user profiles - {name: {"portal_url", "mac_address", ...}}"""
+    return ProfileStore(credentials_dir).profiles
+
+
+def build_m3u(entries):
+    """(name, url) pairs -> M3U playlist text"""
+    lines = ["#EXTM3U"]
+    for channel_name, stream_url in entries:
+        clean_name = channel_name.replace('\n', ' ').replace('\r', ' ')
+        lines.append(f"#EXTINF:-1,{clean_name}")
+        lines.append(stream_url)
+    return "\n".join(lines) + "\n"
+
+
+# Known portal API styles, in discovery order (fallbacks are (api_base, flavor) pairs)
+MAG_API_BASES = ["server/load.php", "stalker_portal/server/load.php", "portal.php"]
+FALLBACK_API_BASES = [("c/", "cdn"), ("player_api.php", "xtream")]
+
+
+def build_portal_endpoints(portal_url, mac_address, api_base):
+    """Build the auth/channels endpoint pair for one API style"""
+    if api_base == "c/":
+        return {
+            "api_base": api_base, "flavor": "cdn",
+            "auth": f"{portal_url}c/",
+            "channels": f"{portal_url}c/?get=channels&mac={mac_address}"
+        }
+    if api_base == "player_api.php":
+        # Xtream Codes API style
+        return {
+            "api_base": api_base, "flavor": "xtream",
+            "auth": f"{portal_url}player_api.php?username={mac_address}&password=&action=get_live_categories",
+            "channels": f"{portal_url}player_api.php?username={mac_address}&password=&action=get_live_streams"
+        }
+    return {
+        "api_base": api_base, "flavor": "mag",
+        "auth": f"{portal_url}{api_base}?type=stb&action=handshake&mac={mac_address}",
+        "channels": f"{portal_url}{api_base}?type=itv&action=get_all_channels&mac={mac_address}&JsHttpRequest=1-xml"
+    }
 
 
 
@@ -67,8 +371,8 @@ class ConnectionManager:
         self.retry_count = 3
         self.retry_delay = 2
 
-    def get_stream_with_retry(self, cmd, max_retries=3):
-        """Get stream with automatic retry and session refresh"""
+    def get_stream_with_retry(self, cmd, max_retries=3, strict=False):
+        """Get stream with automatic retry and session refresh (strict: None unless create_link answered)"""
         original_stream_id = None
 
         # Extract stream ID from original command for preservation
@@ -84,7 +388,7 @@ class ConnectionManager:
 
         for attempt in range(max_retries):
             try:
-                stream_url = self.parent.get_stream_link(cmd)
+                stream_url = self.parent.get_stream_link(cmd, strict=strict)
                 if stream_url:
                     clean_url = stream_url.replace("ffmpeg ", "").strip()
 
@@ -115,7 +419,7 @@ class ConnectionManager:
                     # If this is not the last attempt, try refreshing session
                     if attempt < max_retries - 1:
                         print("🔄 Trying session refresh...")
-                        refreshed_url = self.parent.refresh_session_and_retry(cmd)
+                        refreshed_url = self.parent.refresh_session_and_retry(cmd, strict=strict)
                         if refreshed_url:
                             clean_url = refreshed_url.replace("ffmpeg ", "").strip()
 
@@ -154,7 +458,7 @@ class TokenCache:
             if time.time() - timestamp < self.ttl:
                 return token
             else:
-                del self.cache[stream_id]
+                self.cache.pop(stream_id, None)
         return None
     
     def set(self, stream_id, token):
@@ -165,12 +469,40 @@ class TokenCache:
         """Clear all cached tokens"""
         self.cache.clear()
 
+class TokenBucket:
+    """Thread-safe token bucket - refills `rate` tokens per second up to `capacity`"""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def take(self, tokens=1):
+        """Spend tokens if available - returns False (spending nothing) when the bucket is short"""
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < tokens:
+                return False
+            self.tokens -= tokens
+            return True
+
+
 class OptimizedRequests:
     """Optimized HTTP session with connection pooling and retry logic"""
-    def __init__(self):
+    HEDGE_RATE = 0.5        # Hedge requests per second the portal may receive from us on average
+    HEDGE_BURST = 5
+    HEDGE_MIN_DELAY = 0.2   # Never hedge sooner than this, however fast the host usually is
+
+    def __init__(self, latency_tracker=None):
         self.session = requests.Session()
-        
+        self.latency_tracker = latency_tracker
+        self.hedge_budget = TokenBucket(self.HEDGE_RATE, self.HEDGE_BURST)
+
         # Configure retry strategy
+        from urllib3.util.retry import Retry
         retry_strategy = Retry(
             total=3,                    # Retry failed requests 3 times
             backoff_factor=1,           # Wait 1s, then 2s, then 4s between retries
@@ -179,7 +511,7 @@ class OptimizedRequests:
         )
         
         # Configure connection pooling
-        adapter = HTTPAdapter(
+        adapter = requests.adapters.HTTPAdapter(
             pool_connections=10,        # Keep connections to 10 different hosts
             pool_maxsize=20,           # Max 20 connections per host
             max_retries=retry_strategy
@@ -188,6 +520,15 @@ class OptimizedRequests:
         # Apply adapter to both HTTP and HTTPS
         self.session.mount("http://", adapter)
         self.session.mount("https://", adapter)
+
+        # Same headers and cookies, but no adapter-level retries - callers that count their own
+        # requests (hedged_get) would otherwise send up to 4x as many during a 503 storm
+        self.no_retry_session = requests.Session()
+        self.no_retry_session.headers = self.session.headers
+        self.no_retry_session.cookies = self.session.cookies
+        no_retry_adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=0)
+        self.no_retry_session.mount("http://", no_retry_adapter)
+        self.no_retry_session.mount("https://", no_retry_adapter)
         
         # Set default headers (applied to all requests)
         # ✅ UPDATED: Use Browser UA and Connection: close to avoid 10054 errors
@@ -202,10 +543,91 @@ class OptimizedRequests:
         """Optimized GET request with connection pooling"""
         kwargs.setdefault('timeout', 15)
         return self.session.get(url, **kwargs)
-    
+
+    def adaptive_timeout(self, url, kind, default):
+        """Timeout learned from this host's latency history (or the default)"""
+        if self.latency_tracker:
+            return self.latency_tracker.timeout(url, kind, default)
+        return default
+
+    def timed_get(self, url, kind, default_timeout, session=None, **kwargs):
+        """GET with an adaptive timeout that also records latency for the host"""
+        timeout = kwargs.pop('timeout', None) or self.adaptive_timeout(url, kind, default_timeout)
+        start_time = time.time()
+        try:
+            response = (session or self.session).get(url, timeout=timeout, **kwargs)
+        except requests.exceptions.ReadTimeout:
+            # Host answered the connect but was slow - let the read budget grow
+            if self.latency_tracker:
+                self.latency_tracker.record_timeout(url, kind, timeout)
+            raise
+
+        if self.latency_tracker:
+            self.latency_tracker.record(url, kind,
+                                        ttfb=response.elapsed.total_seconds(),
+                                        total=time.time() - start_time)
+        return response
+
+    def hedged_get(self, url, kind, default_timeout, **kwargs):
+        """timed_get that sends a second copy when the host has not answered within its p95 for this kind.
+        The first 200 wins; every other response is closed, including ones that arrive late.
+        Hedges are drawn from a token bucket and go out on the no-retry session, so a struggling portal
+        sees at most one extra request per hedge - never the adapter's hidden 503 retries."""
+        hedge_delay = self.latency_tracker.percentile(url, f"ttfb:{kind}", 95) if self.latency_tracker else None
+        if hedge_delay is None:
+            return self.timed_get(url, kind, default_timeout, session=self.no_retry_session, **kwargs)
+        hedge_delay = max(self.HEDGE_MIN_DELAY, hedge_delay)
+
+        results = queue.Queue()
+        lock = threading.Lock()
+        finished = False
+
+        def attempt():
+            try:
+                outcome = (self.timed_get(url, kind, default_timeout, session=self.no_retry_session, **kwargs), None)
+            except Exception as e:
+                outcome = (None, e)
+            with lock:
+                if not finished:
+                    results.put(outcome)
+                    return
+            if outcome[0] is not None:
+                outcome[0].close()      # Lost the race
+
+        threading.Thread(target=attempt, daemon=True).start()
+        running = 1
+        hedged = False
+        while True:
+            try:
+                response, error = results.get(timeout=None if hedged else hedge_delay)
+            except queue.Empty:
+                hedged = True
+                if self.hedge_budget.take():
+                    print(f"🪁 No {kind} answer within p95 ({hedge_delay:.2f}s) - sending a hedge request")
+                    threading.Thread(target=attempt, daemon=True).start()
+                    running += 1
+                continue
+            running -= 1
+            # Return the first success, or the last answer once nothing else is in flight
+            if (response is not None and response.status_code == 200) or not running:
+                break
+            if response is not None:
+                response.close()        # Non-200 while the other copy may still succeed
+
+        with lock:
+            finished = True
+        while not results.empty():
+            late_response, _ = results.get()
+            if late_response is not None:
+                late_response.close()
+        if error:
+            raise error
+        return response
+
     def close(self):
         """Close the session and all connections"""
         self.session.close()
+        self.no_retry_session.close()
 
 class CacheManager:
     """Intelligent caching system for channel data - PERMANENT CACHE"""
@@ -294,23 +716,3357 @@ class CacheManager:
         
         if os.path.exists(cache_file):
             try:
-                stat = os.stat(cache_file)
-                created_time = time.ctime(stat.st_mtime)
-                file_size = stat.st_size / 1024  # KB
-                
-                return {
-                    "exists": True,
-                    "created": created_time,
-                    "size_kb": file_size,
-                    "path": cache_file
-                }
+                stat = os.stat(cache_file)
+                created_time = time.ctime(stat.st_mtime)
+                file_size = stat.st_size / 1024  # KB
+                
+                return {
+                    "exists": True,
+                    "created": created_time,
+                    "size_kb": file_size,
+                    "path": cache_file
+                }
+            except:
+                pass
+        
+        return {"exists": False}
+
+
+class ProfileStateStore:
+    """Per-profile JSON store for data learned about a portal across runs"""
+    def __init__(self, cache_dir, profile_id):
+        self.path = os.path.join(cache_dir, f"profile_{profile_id}.json")
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.data = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+                return data if isinstance(data, dict) else {}
+        except:
+            return {}
+
+    def get(self, section, default=None):
+        """Get a section of the stored profile state"""
+        with self.lock:
+            return self.data.get(section, default)
+
+    def set(self, section, value):
+        """Replace a section and write the state file"""
+        with self.lock:
+            if value is None:
+                self.data.pop(section, None)
+            else:
+                self.data[section] = value
+        self.save()
+
+    def save(self):
+        """Write state atomically so a crash never leaves a half-written file"""
+        try:
+            with self.lock:
+                payload = json.dumps(self.data)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            print(f"Profile state save error: {e}")
+
+
+class CachedResponse:
+    """Minimal response object served from ResponseCache"""
+    def __init__(self, url, status_code, content, from_cache=False):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ResponseCache:
+    """Content-addressed cache for portal analysis downloads (URL -> ETag/hash -> body).
+    Identical bodies share one blob; least recently used blobs go first past the size cap."""
+    MAX_BYTES = 64 * 1024 * 1024
+    FRESH_SECONDS = 600     # Serve without any request for this long, then revalidate
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+        except:
+            self.index = {"urls": {}, "blobs": {}}
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.body")
+
+    def _save_index(self):
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(temp_path, self.index_path)
+
+    def _read(self, url):
+        entry = self.index["urls"].get(url)
+        if not entry:
+            return None, None
+        try:
+            with open(self._blob_path(entry["hash"]), "rb") as f:
+                return entry, f.read()
+        except OSError:
+            self.index["urls"].pop(url, None)
+            return None, None
+
+    def _touch(self, entry):
+        now = time.time()
+        entry["last_used"] = now
+        blob = self.index["blobs"].get(entry["hash"])
+        if blob:
+            blob["last_used"] = now
+
+    def _store(self, url, response):
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        if digest not in self.index["blobs"]:
+            with open(self._blob_path(digest), "wb") as f:
+                f.write(content)
+            self.index["blobs"][digest] = {"size": len(content), "last_used": time.time()}
+        entry = {"hash": digest, "etag": response.headers.get("ETag"),
+                 "last_modified": response.headers.get("Last-Modified"),
+                 "validated_at": time.time(), "last_used": time.time()}
+        self.index["urls"][url] = entry
+        self._touch(entry)
+        self._evict()
+
+    def _evict(self):
+        """Drop unreferenced blobs, then least recently used ones until under the size cap"""
+        referenced = {entry["hash"] for entry in self.index["urls"].values()}
+        blobs = self.index["blobs"]
+        total = sum(blob["size"] for blob in blobs.values())
+        for digest in sorted(blobs, key=lambda d: (d in referenced, blobs[d]["last_used"])):
+            if digest in referenced and total <= self.MAX_BYTES:
+                break
+            total -= blobs.pop(digest)["size"]
+            try:
+                os.remove(self._blob_path(digest))
+            except OSError:
+                pass
+        self.index["urls"] = {url: entry for url, entry in self.index["urls"].items()
+                              if entry["hash"] in blobs}
+
+    def get(self, requests_client, url, kind="module", default_timeout=(5, 10), max_age=None):
+        """GET through the cache: fresh hit -> disk read, stale hit -> conditional GET"""
+        max_age = self.FRESH_SECONDS if max_age is None else max_age
+        with self.lock:
+            entry, body = self._read(url)
+            if entry and time.time() - entry["validated_at"] < max_age:
+                self._touch(entry)
+                print(f"📦 Cached response: {url}")
+                return CachedResponse(url, 200, body, from_cache=True)
+
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        response = requests_client.timed_get(url, kind, default_timeout, headers=headers)
+
+        with self.lock:
+            try:
+                if response.status_code == 304 and entry:
+                    entry["validated_at"] = time.time()
+                    self._touch(entry)
+                    self._save_index()
+                    return CachedResponse(url, 200, body, from_cache=True)
+                if response.status_code == 200:
+                    self._store(url, response)
+                    self._save_index()
+            except Exception as e:
+                print(f"Response cache error: {e}")
+        return response
+
+    def clear(self):
+        """Remove every cached body; returns the number of files removed"""
+        with self.lock:
+            removed = 0
+            for digest in list(self.index["blobs"]):
+                try:
+                    os.remove(self._blob_path(digest))
+                    removed += 1
+                except OSError:
+                    pass
+            self.index = {"urls": {}, "blobs": {}}
+            try:
+                self._save_index()
+            except OSError:
+                pass
+            return removed
+
+
+# Adaptive timeout limits per request kind:
+# kind: (connect_floor, connect_ceiling, read_floor, read_ceiling) in seconds
+ADAPTIVE_TIMEOUT_LIMITS = {
+    "handshake":   (1.0, 45.0, 2.0, 60.0),
+    "channels":    (1.0, 45.0, 5.0, 90.0),
+    "module":      (1.0, 30.0, 2.0, 45.0),
+    "create_link": (0.5, 10.0, 1.0, 15.0),
+}
+
+
+class LatencyTracker:
+    """Per-host latency history (connect / TTFB / total) with adaptive timeouts"""
+    MAX_SAMPLES = 50        # Rolling window per host and metric
+    MIN_SAMPLES = 5         # Use defaults until we have this much history
+    TIMEOUT_FACTOR = 3.0    # Timeout = p99 x factor, clamped to the kind's limits
+    SAVE_EVERY = 10         # Persist after this many new samples
+    MAX_TIMEOUTS = 10       # Censored (timed-out) samples kept per host and kind
+    TIMEOUT_GROWTH = 1.5    # Each timeout lets the read budget grow to this x the timeout used
+    TIMEOUT_DECAY = 600     # Seconds before a timeout stops counting
+
+    def __init__(self, state=None):
+        self.state = state  # Optional ProfileStateStore for persistence
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.unsaved = 0
+        if state:
+            saved = state.get("latency", {})
+            if isinstance(saved, dict):
+                self.hosts = saved
+
+    @staticmethod
+    def host_of(url):
+        return urllib.parse.urlparse(url).netloc.lower() or url
+
+    def _samples(self, host, metric):
+        return self.hosts.setdefault(host, {}).setdefault(metric, [])
+
+    def _add(self, host, metric, value):
+        samples = self._samples(host, metric)
+        samples.append(round(value, 4))
+        if len(samples) > self.MAX_SAMPLES:
+            del samples[:-self.MAX_SAMPLES]
+
+    def record(self, url, kind, ttfb=None, total=None, connect=None):
+        """Record timings for one successful request"""
+        host = self.host_of(url)
+        with self.lock:
+            if connect is not None:
+                self._add(host, "connect", connect)
+            if ttfb is not None:
+                self._add(host, f"ttfb:{kind}", ttfb)
+                # An answer means earlier timeouts no longer describe this host
+                self.hosts[host].pop(f"timeout:{kind}", None)
+            if total is not None:
+                self._add(host, f"total:{kind}", total)
+            self.unsaved += 1
+            should_save = self.unsaved >= self.SAVE_EVERY
+        if should_save:
+            self.flush()
+
+    def record_timeout(self, url, kind, timeout_used):
+        """A timeout only proves latency >= timeout, so keep it apart from real TTFB samples.
+
+        Censored samples let the read budget grow one step per timeout and expire after TIMEOUT_DECAY."""
+        if isinstance(timeout_used, (tuple, list)):
+            timeout_used = timeout_used[-1]
+        host = self.host_of(url)
+        with self.lock:
+            samples = self._samples(host, f"timeout:{kind}")
+            samples.append([round(float(timeout_used), 4), round(time.time(), 1)])
+            if len(samples) > self.MAX_TIMEOUTS:
+                del samples[:-self.MAX_TIMEOUTS]
+            self.unsaved += 1
+            should_save = self.unsaved >= self.SAVE_EVERY
+        if should_save:
+            self.flush()
+
+    def _recent_timeout(self, url, kind):
+        """Largest timeout hit within TIMEOUT_DECAY, or None"""
+        host = self.host_of(url)
+        cutoff = time.time() - self.TIMEOUT_DECAY
+        with self.lock:
+            samples = self.hosts.get(host, {}).get(f"timeout:{kind}", [])
+            recent = [value for value, stamp in samples if stamp >= cutoff]
+        return max(recent) if recent else None
+
+    def percentile(self, url, metric, pct):
+        """Return the pct percentile for a host metric, or None without enough history"""
+        host = self.host_of(url)
+        with self.lock:
+            samples = sorted(self.hosts.get(host, {}).get(metric, []))
+        if len(samples) < self.MIN_SAMPLES:
+            return None
+        index = max(0, min(len(samples) - 1, int(len(samples) * pct / 100.0 + 0.999999) - 1))
+        return samples[index]
+
+    def timeout(self, url, kind, default):
+        """Derive a (connect, read) timeout for this host, falling back to default"""
+        if not isinstance(default, (tuple, list)):
+            default = (default, default)
+        connect_floor, connect_ceiling, read_floor, read_ceiling = ADAPTIVE_TIMEOUT_LIMITS.get(
+            kind, ADAPTIVE_TIMEOUT_LIMITS["handshake"])
+
+        connect_p99 = self.percentile(url, "connect", 99)
+        ttfb_p99 = self.percentile(url, f"ttfb:{kind}", 99)
+
+        connect = default[0]
+        if connect_p99 is not None:
+            connect = min(connect_ceiling, max(connect_floor, connect_p99 * self.TIMEOUT_FACTOR))
+        elif ttfb_p99 is not None:
+            # TTFB includes the connect time, so it is a safe upper bound
+            connect = min(connect_ceiling, max(connect_floor, ttfb_p99 * self.TIMEOUT_FACTOR))
+
+        read = default[1]
+        if ttfb_p99 is not None:
+            read = min(read_ceiling, max(read_floor, ttfb_p99 * self.TIMEOUT_FACTOR))
+
+        # Slow-but-alive hosts: grow one step past the largest recent timeout, never straight to the ceiling
+        recent_timeout = self._recent_timeout(url, kind)
+        if recent_timeout is not None:
+            read = min(read_ceiling, max(read, recent_timeout * self.TIMEOUT_GROWTH))
+
+        return (round(connect, 2), round(read, 2))
+
+    def ceiling(self, kind):
+        """Worst-case (connect, read) budget for a request kind"""
+        limits = ADAPTIVE_TIMEOUT_LIMITS.get(kind, ADAPTIVE_TIMEOUT_LIMITS["handshake"])
+        return (limits[1], limits[3])
+
+    def measure_connect(self, url, timeout=3):
+        """Time a bare TCP connect to the portal host"""
+        import socket
+        parsed = urllib.parse.urlparse(url)
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        start = time.time()
+        with socket.create_connection((parsed.hostname, port), timeout=timeout):
+            elapsed = time.time() - start
+        self.record(url, "connect", connect=elapsed)
+        return elapsed
+
+    def flush(self):
+        """Persist history into the profile state"""
+        if not self.state:
+            return
+        with self.lock:
+            snapshot = json.loads(json.dumps(self.hosts))
+            self.unsaved = 0
+        self.state.set("latency", snapshot)
+
+
+# MAG external modules that may carry channel data (de-duplicated, most likely first)
+MAG_MODULE_NAMES = ["itv", "tv", "live_tv", "live", "channels", "all_channels", "channel_list",
+                    "player", "main_menu", "main", "stb", "epg", "favorites"]
+MAG_MODULE_PATHS = ["server/api/ext_module.php", "c/server/api/ext_module.php"]
+MAG_CHANNEL_LIST_BASES = ["server/load.php", "c/server/load.php", "stalker_portal/server/load.php",
+                          "portal.php", "c/portal.php"]
+MAG_CHANNEL_LIST_ACTIONS = ["get_all_channels", "get_ordered_list"]
+MAG_EXTRA_CHANNEL_PATHS = ["api/channels?mac={mac}", "api/itv/get_all_channels?mac={mac}",
+                           "tv/index.php?mac={mac}", "itv/index.php?mac={mac}"]
+
+
+def build_mag_probe_candidates(portal_url, mac_address, modules=True, channel_lists=True):
+    """De-duplicated (label, url) list of MAG module / channel-list endpoints to probe"""
+    candidates = []
+    if channel_lists:
+        for api_base in MAG_CHANNEL_LIST_BASES:
+            for action in MAG_CHANNEL_LIST_ACTIONS:
+                url = f"{portal_url}{api_base}?type=itv&action={action}&mac={mac_address}&JsHttpRequest=1-xml"
+                candidates.append((f"{api_base}:{action}", url))
+    if modules:
+        for module_name in MAG_MODULE_NAMES:
+            for module_path in MAG_MODULE_PATHS:
+                candidates.append((module_name, f"{portal_url}{module_path}?name={module_name}&mac={mac_address}"))
+    if channel_lists:
+        for path in MAG_EXTRA_CHANNEL_PATHS:
+            candidates.append((path.split("?")[0], portal_url + path.format(mac=mac_address)))
+
+    seen = set()
+    return [(label, url) for label, url in candidates if not (url in seen or seen.add(url))]
+
+
+class MagModuleProber:
+    """Concurrent MAG endpoint probing under a global time budget - first parsed result wins"""
+    DEFAULT_BUDGET = 30     # Seconds for the whole probe run
+    PER_HOST_LIMIT = 4      # Concurrent requests per host (portals throttle bursts)
+    MAX_WORKERS = 8
+
+    def __init__(self, requests_client):
+        self.requests = requests_client
+        self.host_slots = {}
+        self.lock = threading.Lock()
+
+    def _host_slot(self, url):
+        host = urllib.parse.urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.PER_HOST_LIMIT)
+            return self.host_slots[host]
+
+    def probe(self, candidates, parse, budget=None, stop_check=None):
+        """Probe (label, url) candidates; parse(content, label) returns channels.
+        Returns (channels, label) of the first success, or ([], None)."""
+        budget = budget or self.DEFAULT_BUDGET
+        deadline = time.time() + budget
+        done = threading.Event()
+
+        def attempt(label, url):
+            slot = self._host_slot(url)
+            with slot:
+                remaining = deadline - time.time()
+                if done.is_set() or remaining <= 0.5 or (stop_check and stop_check()):
+                    return [], label
+                connect, read = self.requests.adaptive_timeout(url, "module", (10, 20))
+                timeout = (min(connect, remaining), min(read, remaining))
+                response = self.requests.timed_get(url, "module", (10, 20), timeout=timeout)
+            if done.is_set() or response.status_code != 200:
+                return [], label
+            content = response.text.strip()
+            if not content:
+                return [], label
+            return parse(content, label), label
+
+        print(f"🔍 Probing {len(candidates)} MAG endpoints concurrently ({budget}s budget)...")
+        executor = ThreadPoolExecutor(max_workers=self.MAX_WORKERS)
+        futures = [executor.submit(attempt, label, url) for label, url in candidates]
+        result = ([], None)
+        try:
+            for future in as_completed(futures, timeout=budget):
+                try:
+                    channels, label = future.result()
+                except Exception as e:
+                    print(f"❌ MAG probe error: {e}")
+                    continue
+                if channels:
+                    print(f"✅ MAG probe '{label}' returned {len(channels)} channels")
+                    result = (channels, label)
+                    break
+        except Exception:
+            print(f"⏰ MAG probe budget ({budget}s) exhausted")
+        finally:
+            # Pending probes never start; in-flight ones are discarded when they return
+            done.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+        return result
+
+
+# ---- HTML/JS channel scraping (patterns compile once, every quantifier is bounded) ----
+MAX_SCAN_CHARS = 16 * 1024 * 1024   # Ignore anything past 16MB of a document
+MAX_URL_LENGTH = 2048
+
+VALID_STREAM_URL_RE = re.compile(
+    r'rtmp://.+|https?://.+(?:\.(?:ts|m3u8|mp4)(?:\?.*)?|/(?:ch|stream|live)/.+)', re.IGNORECASE)
+MAC_IN_PAGE_RE = re.compile(r'(?:mac|device)\s{0,8}[=:]\s{0,8}["\']?([0-9a-fA-F:]{17})', re.IGNORECASE)
+JS_ESCAPE_RE = re.compile(r'\\(u[0-9a-fA-F]{4}|.)')
+JS_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+
+
+def _js_string_pattern(group):
+    # Quoted JS string, at most MAX_URL_LENGTH chars, captured as <group>_d / <group>_s
+    return (rf'(?:"(?P<{group}_d>(?:[^"\\\n]|\\.){{0,{MAX_URL_LENGTH}}})"'
+            rf"|'(?P<{group}_s>(?:[^'\\\n]|\\.){{0,{MAX_URL_LENGTH}}})')")
+
+
+# One tokenizer for the whole document: key/value pairs, player calls, bare strings and braces
+CHANNEL_TOKEN_RE = re.compile(
+    r'(?<![\w$.])(?P<key>[A-Za-z_$][\w$.]{0,63}|"[\w$.]{1,64}"|\'[\w$.]{1,64}\')'
+    r'\s{0,16}(?:=(?![=>])|:)\s{0,16}' + _js_string_pattern("kv") +
+    r'|(?<![\w$])(?P<call>(?i:addChannel|setSource|setMedia|gSTB\.Play|stb\.play|play))'
+    r'\s{0,16}\(\s{0,16}' + _js_string_pattern("a1") +
+    r'(?:\s{0,16},\s{0,16}' + _js_string_pattern("a2") + r')?'
+    r'|' + _js_string_pattern("lit") +
+    r'|(?P<close>\})'
+)
+EMBEDDED_JSON_ATTR_RE = re.compile(
+    r'(?:data-(?:channels|streams)|value)\s{0,8}=\s{0,8}(?:"(\{[^"]{1,4000000}\})"|\'(\{[^\']{1,4000000}\})\')',
+    re.IGNORECASE)
+CHANNEL_NAME_KEYS = {"name", "title", "caption", "channel_name", "display_name", "label", "channel"}
+CHANNEL_URL_KEYS = {"url", "cmd", "stream", "stream_url", "channel_url", "src", "link", "source"}
+
+
+def is_stream_url(url):
+    """Check if URL looks like a playable stream URL (one compiled pattern)"""
+    if not url or not 10 <= len(url) <= MAX_URL_LENGTH:
+        return False
+    return VALID_STREAM_URL_RE.fullmatch(url) is not None
+
+
+def looks_like_url(value):
+    """Loose URL check for values stored under url/cmd keys (MAG cmds included)"""
+    value = value.replace("ffmpeg ", "").strip()
+    return value.startswith(("http://", "https://", "rtmp://", "/")) and len(value) > 1
+
+
+def unescape_js_string(value):
+    """Decode JS string escapes (\\/, \\", \\uXXXX, ...)"""
+    if "\\" not in value:
+        return value
+
+    def decode(match):
+        escape = match.group(1)
+        if escape[0] == "u" and len(escape) == 5:
+            return chr(int(escape[1:], 16))
+        return JS_ESCAPES.get(escape, escape)
+    return JS_ESCAPE_RE.sub(decode, value)
+
+
+def _token_string(match, group):
+    value = match.group(f"{group}_d")
+    if value is None:
+        value = match.group(f"{group}_s")
+    return None if value is None else unescape_js_string(value)
+
+
+def scan_channel_pairs(content):
+    """Scan HTML/JS once and return (name, url) pairs - name is None when unknown"""
+    pairs = []
+    name = url = None
+    for match in CHANNEL_TOKEN_RE.finditer(content, 0, min(len(content), MAX_SCAN_CHARS)):
+        if match.group("close"):
+            # End of an object literal - flush a URL that never got a name
+            if url:
+                pairs.append((name, url))
+            name = url = None
+
+        elif match.group("key"):
+            key = match.group("key").strip("'\"").rsplit(".", 1)[-1].lower()
+            value = _token_string(match, "kv")
+            if key in CHANNEL_URL_KEYS and looks_like_url(value):
+                if url:
+                    pairs.append((name, url))
+                    name = None
+                url = value
+            elif key in CHANNEL_NAME_KEYS and value and not looks_like_url(value):
+                name = value
+            elif is_stream_url(value):
+                pairs.append((None, value))         # var stream_url = "http://..."
+            if name and url:
+                pairs.append((name, url))
+                name = url = None
+
+        elif match.group("call"):
+            first, second = _token_string(match, "a1"), _token_string(match, "a2")
+            if second and looks_like_url(second) and not looks_like_url(first):
+                pairs.append((first, second))       # addChannel("name", "url")
+            elif first and looks_like_url(first):
+                pairs.append((second, first))       # play("url"[, "name"])
+
+        else:
+            value = _token_string(match, "lit")
+            if is_stream_url(value):
+                pairs.append((None, value))
+    if url:
+        pairs.append((name, url))
+    return pairs
+
+
+# ---- JS/JSON literal scanner (balanced brackets, string and comment aware, linear time) ----
+MAX_LITERAL_CHARS = 8 * 1024 * 1024
+
+# Assignment of an object/array literal (var x = [, a.b.c = {, "key": [) or JSON.parse("...")
+JS_ASSIGNMENT_RE = re.compile(
+    r'(?<![\w$.])(?P<target>(?:[A-Za-z_$][\w$]{0,63}\.){0,4}[A-Za-z_$][\w$]{0,63}|"[\w$]{1,64}"|\'[\w$]{1,64}\')'
+    r'\s{0,16}(?:=(?![=>])|:)\s{0,16}(?=[\[{])'
+    r'|(?P<json_parse>JSON\.parse)\(\s{0,16}(?=["\'])')
+# Tokens inside a literal: strings (unterminated ones stop at the line end), comments, brackets
+JS_LITERAL_SCAN_RE = re.compile(
+    r'"(?:[^"\\\n]|\\.)*"?|\'(?:[^\'\\\n]|\\.)*\'?|`(?:[^`\\]|\\.)*`?'
+    r'|//[^\n]*|/\*(?:[^*]|\*(?!/))*(?:\*/)?|[\[\]{}]')
+# JS-only syntax rewritten on the way to JSON (everything else passes through untouched)
+JS_TO_JSON_RE = re.compile(
+    r'(?P<string>"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'|`(?:[^`\\]|\\.)*`)'
+    r'|(?P<comment>//[^\n]*|/\*(?:[^*]|\*(?!/))*(?:\*/)?)'
+    r'|(?<![\w$])(?P<key>[A-Za-z_$][\w$]*)(?=\s*:)|(?<![\w$])(?P<ident>[A-Za-z_$][\w$]*)'
+    r'|(?P<trailing>,)(?=\s*(?://[^\n]*\s*|/\*(?:[^*]|\*(?!/))*\*/\s*)*[\]}])'
+    r'|(?P<number>(?<![\w.])\.\d+)')
+JS_BRACKET_PAIRS = {"]": "[", "}": "{"}
+SCRIPT_TAG_RE = re.compile(r'<script\b[^>]*>(.*?)</script>', re.DOTALL | re.IGNORECASE)
+
+
+def find_js_literal_end(text, start, max_chars=MAX_LITERAL_CHARS):
+    """Index just past the literal opening at text[start] ('[' or '{'), or -1 if unbalanced"""
+    stack = []
+    limit = min(len(text), start + max_chars)
+    pos = start
+    while pos < limit:
+        match = JS_LITERAL_SCAN_RE.search(text, pos, limit)
+        if not match:
+            return -1
+        token = match.group()
+        pos = match.end()
+        if token in "[{":
+            stack.append(token)
+        elif token in "]}":
+            if not stack or stack.pop() != JS_BRACKET_PAIRS[token]:
+                return -1
+            if not stack:
+                return pos
+    return -1
+
+
+def _js_token_to_json(match):
+    kind = match.lastgroup
+    token = match.group()
+    if kind == "string":
+        if token[0] == '"' and "\\" not in token:
+            return token
+        return json.dumps(unescape_js_string(token[1:-1]))
+    if kind == "key":
+        return json.dumps(token)                    # Bare object key
+    if kind == "ident":
+        return token if token in ("true", "false", "null") else "null"  # undefined, NaN, refs
+    if kind == "number":
+        return "0" + token                          # .5 -> 0.5
+    return ""                                       # Comments and trailing commas
+
+
+def js_literal_to_data(literal):
+    """Convert a JS object/array literal (single quotes, bare keys, trailing commas) to data"""
+    try:
+        return json.loads(literal)                  # Plain JSON - fast path
+    except ValueError:
+        pass
+    try:
+        return json.loads(JS_TO_JSON_RE.sub(_js_token_to_json, literal))
+    except ValueError:
+        return None  # Functions, expressions, regexes... not plain data
+
+
+def scan_js_literals(text, targets=None):
+    """Yield (target, data) for literals assigned to targets (last name segment,
+    case-insensitive; None = every target) and for JSON.parse("...") arguments"""
+    targets = {t.lower() for t in targets} if targets else None
+    limit = min(len(text), MAX_SCAN_CHARS)
+    pos = 0
+    while pos < limit:
+        match = JS_ASSIGNMENT_RE.search(text, pos, limit)
+        if not match:
+            return
+        pos = match.end()
+
+        if match.group("json_parse"):
+            string = JS_TO_JSON_RE.match(text, pos)
+            if string and string.lastgroup == "string":
+                try:
+                    yield "JSON.parse", json.loads(unescape_js_string(string.group()[1:-1]))
+                except ValueError:
+                    pass
+                pos = string.end()
+            continue
+
+        target = match.group("target").strip("'\"")
+        if targets is not None and target.rsplit(".", 1)[-1].lower() not in targets:
+            continue
+        end = find_js_literal_end(text, pos)
+        if end < 0:
+            continue
+        data = js_literal_to_data(text[pos:end])
+        if data is not None:
+            yield target, data
+            pos = end   # Nested assignments are part of this literal already
+
+
+def iter_channel_objects(data, depth=0):
+    """Stream {"name", "cmd"} dicts for every channel-shaped object nested in data"""
+    if depth > 32:
+        return
+    if isinstance(data, dict):
+        name = next((data[k] for k in data if k.lower() in CHANNEL_NAME_KEYS
+                     and isinstance(data[k], str) and data[k] and not looks_like_url(data[k])), "")
+        cmd = next((data[k] for k in data if k.lower() in CHANNEL_URL_KEYS
+                    and isinstance(data[k], str) and looks_like_url(data[k])), "")
+        if cmd:
+            yield {"name": name, "cmd": cmd}
+            return
+        for value in data.values():
+            yield from iter_channel_objects(value, depth + 1)
+    elif isinstance(data, list):
+        for item in data:
+            if isinstance(item, str):
+                if is_stream_url(item):
+                    yield {"name": "", "cmd": item}     # Simple URL list
+            else:
+                yield from iter_channel_objects(item, depth + 1)
+
+
+def scan_channel_objects(text, targets=None):
+    """All channel-shaped objects from JS literals in text, as a picklable list"""
+    return [item for target, data in scan_js_literals(text, targets) for item in iter_channel_objects(data)]
+
+
+# ---- Parse stage (module level so it can run in a worker process) ----
+def build_stream_url(cmd, portal_domain):
+    """Playable URL for a portal cmd (localhost / relative paths point at the portal)"""
+    if cmd.startswith("http://localhost"):
+        return cmd.replace("http://localhost", f"http://{portal_domain}")
+    if cmd.startswith("/"):
+        return f"http://{portal_domain}{cmd}"
+    if cmd.startswith(("http://", "https://")):
+        return cmd
+    return f"http://{portal_domain}/{cmd}"
+
+
+def normalize_channel_payload(raw, portal_url):
+    """Decode a get_all_channels response into channel tuples.
+    Returns (response_shape, item_count, channels) - shape is None for non-JSON bodies."""
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8-sig", errors="replace")
+    raw = raw.strip()
+    if not raw.startswith(("{", "[")):
+        return None, 0, []
+
+    response_data = json.loads(raw)
+    if isinstance(response_data, dict):
+        js_section = response_data.get("js")
+        if isinstance(js_section, list):
+            # Format: {"js": [...channels...]}
+            data, shape = js_section, "js_list"
+        elif isinstance(js_section, dict):
+            # Format: {"js": {"data": [...channels...]}}
+            data, shape = js_section.get("data", []), "js_data"
+        else:
+            # Format: {"data": [...channels...]} or flat dict
+            data, shape = response_data.get("data", []), "data"
+    elif isinstance(response_data, list):
+        data, shape = response_data, "list"
+    else:
+        data, shape = [], "unknown"
+    if not isinstance(data, list):
+        data = []
+
+    portal_domain = urllib.parse.urlparse(portal_url).netloc
+    channels = []
+    for ch in data:
+        if isinstance(ch, dict):
+            cmd = ch.get("cmd", ch.get("url", ""))
+            if cmd:
+                original_cmd = cmd.replace("ffmpeg ", "").strip()
+                name = ch.get("name", ch.get("title", "Unknown Channel"))
+                channels.append((name, build_stream_url(original_cmd, portal_domain), original_cmd))
+    return shape, len(data), channels
+
+
+def parse_m3u_text(m3u_content):
+    """Parse M3U playlist text into channel tuples"""
+    if isinstance(m3u_content, bytes):
+        m3u_content = m3u_content.decode("utf-8-sig", errors="replace")
+    channels = []
+    current_name = None
+    for line in m3u_content.split('\n'):
+        line = line.strip()
+        if line.startswith('#EXTINF:'):
+            # Extract channel name
+            if ',' in line:
+                current_name = line.split(',', 1)[1].strip()
+        elif line.startswith(('http://', 'https://')):
+            if current_name:
+                channels.append((current_name, line, line))
+                current_name = None
+    return channels
+
+
+def build_xtream_channels(data, portal_url, mac_address):
+    """Channel tuples from an Xtream get_live_streams list"""
+    channels = []
+    for item in data:
+        if isinstance(item, dict) and item.get('stream_id', ''):
+            stream_url = f"{portal_url}live/{mac_address}/{item['stream_id']}.ts"
+            channels.append((item.get('name', 'Unknown Channel'), stream_url, stream_url))
+    return channels
+
+
+def parse_xtream_payload(raw, portal_url, mac_address):
+    """Decode an Xtream get_live_streams response into channel tuples"""
+    data = json.loads(raw)
+    return build_xtream_channels(data, portal_url, mac_address) if isinstance(data, list) else []
+
+
+class ParseWorkerPool:
+    """Optional worker-process pool for the parse stage - keeps the GIL free for the Tk mainloop"""
+    MIN_PAYLOAD = 256 * 1024    # Smaller payloads parse faster inline than the IPC round-trip
+
+    def __init__(self, enabled=False, max_workers=None):
+        self.enabled = enabled
+        self.max_workers = max_workers or max(1, min(2, (os.cpu_count() or 2) - 1))
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        if not enabled:
+            self.shutdown()
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self.executor
+
+    def run(self, func, payload, *args):
+        """func(payload, *args) - raw bytes/text in, compact channel records out.
+        Runs in a worker process for large payloads when enabled, inline otherwise."""
+        if self.enabled and payload is not None and len(payload) >= self.MIN_PAYLOAD:
+            from concurrent.futures.process import BrokenProcessPool
+            try:
+                return self._get_executor().submit(func, payload, *args).result()
+            except (BrokenProcessPool, pickle.PicklingError, OSError) as e:
+                print(f"⚠️ Worker process unavailable ({e}) - parsing in-process")
+                self.shutdown()
+        return func(payload, *args)
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ==========================================================
+#   Headless engine - portal, cache, search and playback
+#   without Tk. The GUI (and scripts/services) consume it
+#   through EngineEvents callbacks.
+# ==========================================================
+
+class EngineError(Exception):
+    """Engine failure with a user-facing message"""
+
+
+class EngineEvents:
+    """Minimal callback registry - handlers run on the emitting (often background) thread"""
+    def __init__(self):
+        self.handlers = {}
+        self.lock = threading.Lock()
+
+    def on(self, event, handler):
+        with self.lock:
+            self.handlers.setdefault(event, []).append(handler)
+        return handler
+
+    def off(self, event, handler):
+        with self.lock:
+            if handler in self.handlers.get(event, []):
+                self.handlers[event].remove(handler)
+
+    def emit(self, event, **data):
+        with self.lock:
+            handlers = list(self.handlers.get(event, []))
+        for handler in handlers:
+            try:
+                handler(**data)
+            except Exception as e:
+                print(f"⚠️ '{event}' handler failed: {e}")
+
+
+def diagnose_server_response(response_text):
+    """Diagnose why server returned empty channels"""
+    diagnosis = {
+        "response_valid": False,
+        "has_js_key": False,
+        "is_empty": False,
+        "likely_cause": "Unknown"
+    }
+
+    try:
+        # Check JSON validity
+        data = json.loads(response_text)
+        diagnosis["response_valid"] = True
+
+        # Check structure
+        if isinstance(data, dict) and "js" in data:
+            diagnosis["has_js_key"] = True
+            js_content = data.get("js")
+
+            if isinstance(js_content, list) and len(js_content) == 0:
+                diagnosis["is_empty"] = True
+                diagnosis["likely_cause"] = "Subscription inactive or expired"
+            elif isinstance(js_content, dict):
+                data_content = js_content.get("data", [])
+                if len(data_content) == 0:
+                    diagnosis["is_empty"] = True
+                    diagnosis["likely_cause"] = "No channels assigned to this MAC"
+
+        # Additional checks
+        if "error" in str(data).lower():
+            diagnosis["likely_cause"] = "Server returned error"
+
+        print(f"📊 Server Diagnosis: {diagnosis}")
+        return diagnosis
+
+    except json.JSONDecodeError:
+        diagnosis["likely_cause"] = "Invalid JSON response"
+        return diagnosis
+
+
+class PortalClient:
+    """MAG/Xtream portal access - discovery, channel fetch and create_link"""
+    def __init__(self, portal_url, mac_address, requests_client, profile_state, parse_pool, events):
+        self.portal_url = portal_url
+        self.mac_address = mac_address
+        self.requests = requests_client
+        self.profile_state = profile_state
+        self.parse_pool = parse_pool
+        self.events = events
+        self.token_cache = TokenCache(ttl=300)  # 5 minutes
+
+    def progress(self, message):
+        self.events.emit("progress", message=message)
+
+    def load_capabilities(self):
+        """Portal capabilities recorded by the last successful fetch (or None)"""
+        capabilities = self.profile_state.get("capabilities")
+        if isinstance(capabilities, dict) and capabilities.get("api_base"):
+            return capabilities
+        return None
+
+    def save_capabilities(self, api_base, flavor, fetch_strategy=0):
+        """Remember how this portal answered so the next fetch skips discovery"""
+        capabilities = {
+            "api_base": api_base,
+            "flavor": flavor,
+            "fetch_strategy": fetch_strategy,
+            "recorded_at": time.time()
+        }
+        if capabilities != dict(self.load_capabilities() or {}, recorded_at=capabilities["recorded_at"]):
+            print(f"💾 Saved portal capabilities: {api_base} ({flavor}, fetch strategy {fetch_strategy + 1})")
+        self.profile_state.set("capabilities", capabilities)
+
+    def forget_capabilities(self):
+        """Drop recorded capabilities - next fetch runs full discovery"""
+        if self.profile_state.get("capabilities") is not None:
+            print("🗑️ Known portal capabilities failed - re-discovering next time")
+            self.profile_state.set("capabilities", None)
+
+    def get_mag_api_base(self):
+        """MAG API path for this portal - recorded one if known, else the common default"""
+        capabilities = self.load_capabilities()
+        if capabilities and capabilities.get("flavor") == "mag":
+            return capabilities["api_base"]
+        return MAG_API_BASES[0]
+
+    def detect_provider_type(self, portal_url=None):
+        """Detect provider type from URL to prioritize endpoints"""
+        portal_url = portal_url or self.portal_url
+        url_lower = portal_url.lower()
+
+        # Check for delta8k specifically first
+        if "delta8k" in url_lower:
+            print("🔍 Detected Delta8k provider - using direct URLs")
+            return "delta8k"
+
+        # A previous successful fetch beats URL keyword guesses
+        capabilities = self.load_capabilities() if portal_url == self.portal_url else None
+        if capabilities:
+            if capabilities["flavor"] == "mag":
+                return "stalker" if capabilities["api_base"].startswith("stalker_portal/") else "standard"
+            return capabilities["flavor"]
+
+        if "stalker" in url_lower:
+            return "stalker"
+        elif any(keyword in url_lower for keyword in ["xtream", "api", "panel"]):
+            return "xtream"
+        elif url_lower.endswith("/c/"):
+            return "cdn"
+        else:
+            return "standard"
+
+    def get_prioritized_endpoints(self):
+        """Get endpoints in priority order based on provider type"""
+        capabilities = self.load_capabilities()
+        endpoints = self._guessed_endpoints()
+        if capabilities:
+            # Known endpoint first, the guesses behind it in case it has gone stale
+            known = build_portal_endpoints(self.portal_url, self.mac_address, capabilities["api_base"])
+            endpoints = [known] + [endpoint for endpoint in endpoints if endpoint["auth"] != known["auth"]]
+        return endpoints
+
+    def _guessed_endpoints(self):
+        provider_type = self.detect_provider_type(self.portal_url)
+
+        if provider_type == "stalker":
+            return [
+                {
+                    "auth": f"{self.portal_url}stalker_portal/server/load.php?type=stb&action=handshake&mac={self.mac_address}",
+                    "channels": f"{self.portal_url}stalker_portal/server/load.php?type=itv&action=get_all_channels&mac={self.mac_address}&JsHttpRequest=1-xml"
+                },
+                {
+                    "auth": f"{self.portal_url}server/load.php?type=stb&action=handshake&mac={self.mac_address}",
+                    "channels": f"{self.portal_url}server/load.php?type=itv&action=get_all_channels&mac={self.mac_address}&JsHttpRequest=1-xml"
+                }
+            ]
+        elif provider_type == "xtream":
+            return [
+                {
+                    "auth": f"{self.portal_url}player_api.php?username={self.mac_address}&password=&action=get_live_categories",
+                    "channels": f"{self.portal_url}player_api.php?username={self.mac_address}&password=&action=get_live_streams"
+                }
+            ]
+        elif provider_type == "cdn":
+            return [
+                {
+                    "auth": f"{self.portal_url}",
+                    "channels": f"{self.portal_url}?get=channels&mac={self.mac_address}"
+                }
+            ]
+        else:
+            return [
+                {
+                    "auth": f"{self.portal_url}server/load.php?type=stb&action=handshake&mac={self.mac_address}",
+                    "channels": f"{self.portal_url}server/load.php?type=itv&action=get_all_channels&mac={self.mac_address}&JsHttpRequest=1-xml"
+                }
+            ]
+
+    def warmup_connection(self):
+        """Pre-warm connection to reduce first request latency"""
+        try:
+            # Time a bare TCP connect - feeds the adaptive connect timeout
+            connect_time = self.requests.latency_tracker.measure_connect(self.portal_url)
+            print(f"🔌 Connect time: {connect_time * 1000:.0f}ms")
+
+            # Quick HEAD request to warm up DNS and TCP connection
+            warmup_url = self.portal_url.rstrip('/')
+            self.requests.session.head(warmup_url, timeout=3)
+            print("🔥 Connection warmed up")
+        except:
+            pass  # Ignore warmup failures
+
+    def probe(self, timeout=(3, 5)):
+        """Quick health check - TCP connect + handshake on the known (or default) API"""
+        capabilities = self.load_capabilities()
+        endpoints = build_portal_endpoints(self.portal_url, self.mac_address,
+                                           capabilities["api_base"] if capabilities else MAG_API_BASES[0])
+        result = {"reachable": False, "api_base": endpoints["api_base"],
+                  "connect_ms": None, "handshake_ms": None, "status": None}
+        try:
+            connect_time = self.requests.latency_tracker.measure_connect(self.portal_url, timeout=timeout[0])
+            result["connect_ms"] = round(connect_time * 1000)
+            result["reachable"] = True
+
+            start_time = time.time()
+            response = self.requests.timed_get(endpoints["auth"], "handshake", timeout, timeout=timeout)
+            result["handshake_ms"] = round((time.time() - start_time) * 1000)
+            result["status"] = response.status_code
+        except Exception as e:
+            result["error"] = str(e)
+        return result
+
+    def parse_xtream_channels(self, data):
+        """Parse Xtream Codes API response into channel list"""
+        try:
+            if isinstance(data, (bytes, str)):
+                # Raw response body - decode in the parse stage
+                channels = self.parse_pool.run(parse_xtream_payload, data, self.portal_url, self.mac_address)
+            else:
+                channels = build_xtream_channels(data, self.portal_url, self.mac_address)
+
+            print(f"✅ Parsed {len(channels)} channels from Xtream API")
+            return channels
+
+        except Exception as e:
+            print(f"❌ Xtream parsing error: {e}")
+            return []
+
+    def fetch_channels(self, cancelled=lambda: False):
+        """Discover the portal API and download the channel list.
+        Returns channel tuples, None if cancelled; raises EngineError on failure."""
+        # ✅ KNOWN CAPABILITIES - skip discovery if a previous fetch found the working API
+        capabilities = self.load_capabilities()
+        known_endpoints = None
+        if capabilities:
+            known_endpoints = build_portal_endpoints(self.portal_url, self.mac_address,
+                                                     capabilities.get("api_base"))
+            print(f"⚡ Using known portal capabilities: {capabilities.get('api_base')} "
+                  f"({capabilities.get('flavor')})")
+
+        # ✅ REDUCED endpoint list - only test most common ones first
+        priority_endpoints = [
+            # Most common MAG endpoints (test these first)
+            build_portal_endpoints(self.portal_url, self.mac_address, api_base)
+            for api_base in MAG_API_BASES
+        ]
+        if known_endpoints and known_endpoints["flavor"] != "xtream":
+            priority_endpoints = [known_endpoints] + [
+                ep for ep in priority_endpoints if ep["api_base"] != known_endpoints["api_base"]]
+
+        # ✅ ADAPTIVE timeout - learned from this portal's latency history (default 5s/8s)
+        fast_timeout = self.requests.adaptive_timeout(self.portal_url, "handshake", (5, 8))
+
+        headers = {
+            "Referer": self.portal_url + "index.html",
+            "Origin": self.portal_url.rstrip('/'),
+            "Accept-Language": "en-US,en;q=0.9",
+            "Pragma": "no-cache",
+            "User-Agent": "Mozilla/5.0 (QtEmbedded; U; Linux; C)"
+        }
+
+        if cancelled():
+            return None
+
+        self.requests.session.headers.update(headers)
+        successful_endpoints = None
+        auth_response = None
+
+        # ✅ KNOWN XTREAM PORTAL - go straight to the streams list
+        if known_endpoints and known_endpoints["flavor"] == "xtream":
+            self.progress("Fetching channels (known Xtream API)...")
+            try:
+                response = self.requests.timed_get(known_endpoints["channels"], "channels", (8, 12))
+                if response.status_code == 200:
+                    channels = self.parse_xtream_channels(response.content)
+                    if channels:
+                        self.save_capabilities("player_api.php", "xtream")
+                        return channels
+            except Exception as e:
+                print(f"❌ Known Xtream API failed: {e}")
+            self.forget_capabilities()
+            known_endpoints = None
+
+        # ✅ TRY PRIORITY ENDPOINTS FIRST with faster timeout
+        for endpoint_idx, endpoints in enumerate(priority_endpoints):
+            if cancelled():
+                return None
+
+            self.progress(f"Testing endpoint {endpoint_idx + 1}/{len(priority_endpoints)}...")
+            print(f"🔍 Testing priority endpoint {endpoint_idx + 1}: {endpoints['auth']}")
+
+            try:
+                self.progress(f"Quick auth test ({fast_timeout[0]}s)...")
+                auth_response = self.requests.timed_get(endpoints["auth"], "handshake", (5, 8), timeout=fast_timeout)
+
+                if auth_response.status_code == 200:
+                    print(f"✅ FAST authentication successful with endpoint {endpoint_idx + 1}")
+                    successful_endpoints = endpoints
+                    break  # SUCCESS - stop trying other endpoints
+                else:
+                    print(f"❌ Auth failed with status {auth_response.status_code}")
+
+            except requests.exceptions.ConnectTimeout:
+                print(f"⏰ Fast connect timeout ({fast_timeout[0]}s)")
+                continue
+            except requests.exceptions.ReadTimeout:
+                print(f"⏰ Fast read timeout ({fast_timeout[1]}s)")
+                continue
+            except Exception as e:
+                print(f"❌ Fast auth error: {e}")
+                continue
+
+        # ✅ IF PRIORITY ENDPOINTS FAIL, try extended list with longer timeout
+        if not successful_endpoints:
+            print("🔍 Priority endpoints failed, trying extended list...")
+
+            extended_endpoints = [
+                build_portal_endpoints(self.portal_url, self.mac_address, api_base)
+                for api_base, _ in FALLBACK_API_BASES
+            ]
+
+            extended_timeout = self.requests.adaptive_timeout(self.portal_url, "handshake", (8, 12))
+
+            for endpoint_idx, endpoints in enumerate(extended_endpoints):
+                if cancelled():
+                    return None
+
+                self.progress(f"Extended test {endpoint_idx + 1}...")
+
+                # Handle special endpoint types
+                if "player_api.php" in endpoints['auth']:
+                    try:
+                        response = self.requests.timed_get(endpoints["channels"], "channels", extended_timeout)
+                        if response.status_code == 200:
+                            channels = self.parse_xtream_channels(response.content)
+                            if channels:
+                                self.save_capabilities("player_api.php", "xtream")
+                                return channels
+                    except Exception as e:
+                        print(f"❌ Xtream API failed: {e}")
+                        continue
+
+                # Regular auth test
+                try:
+                    auth_response = self.requests.timed_get(endpoints["auth"], "handshake", (8, 12), timeout=extended_timeout)
+                    if auth_response.status_code == 200:
+                        successful_endpoints = endpoints
+                        break
+                except Exception as e:
+                    continue
+
+        if known_endpoints and successful_endpoints is not known_endpoints:
+            self.forget_capabilities()
+
+        if not successful_endpoints:
+            raise EngineError("Authentication failed with all endpoints.\n\n"
+                              "This may be due to:\n• Server being offline\n• Incorrect MAC address\n• Network connectivity issues")
+
+        if cancelled():
+            return None
+
+        def fetch_failed(message):
+            # The known endpoint still authenticates but no longer serves channels - re-discover next time
+            if known_endpoints and successful_endpoints is known_endpoints:
+                self.forget_capabilities()
+            return EngineError(message)
+
+        # ✅ EXTRACT TOKEN QUICKLY
+        try:
+            auth_data = auth_response.json()
+            token = auth_data.get('js', {}).get('token', '') or auth_data.get('token', '')
+        except:
+            token = ''
+
+        # ✅ BUILD CHANNELS URL
+        channels_url = successful_endpoints["channels"]
+        if token:
+            separator = "&" if "?" in channels_url else "?"
+            channels_url += f"{separator}token={token}"
+
+        self.progress("Fetching channels...")
+        print(f"📺 Using channels URL: {channels_url}")
+
+        # ✅ FETCH CHANNELS with Robust Retry Logic for 10054 Errors
+        channels_response = None
+        last_error = None
+
+        # Define retry strategies
+        fetch_strategies = [
+            # Strategy 1: Standard keep-alive
+            {"headers": {}, "timeout": (5, 15)},
+            # Strategy 2: Force close connection (fixes 10054 errors)
+            {"headers": {"Connection": "close"}, "timeout": (10, 30)},
+            # Strategy 3: Browser User-Agent + Close
+            {"headers": {
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+                "Connection": "close"
+            }, "timeout": (10, 30)}
+        ]
+
+        # Start from the strategy that worked last time (e.g. portals that need Connection: close)
+        first_strategy = 0
+        if known_endpoints and successful_endpoints is known_endpoints:
+            first_strategy = capabilities.get("fetch_strategy", 0) % len(fetch_strategies)
+        strategy_order = list(range(first_strategy, len(fetch_strategies))) + list(range(first_strategy))
+        used_strategy = first_strategy
+
+        for attempt, i in enumerate(strategy_order):
+            strategy = fetch_strategies[i]
+            try:
+                if cancelled():
+                    return None
+
+                if attempt > 0:
+                    self.progress(f"Retrying fetch (Strategy {i+1})...")
+                    print(f"🔄 Retry strategy {i+1}: {strategy['headers']}")
+                if strategy["headers"]:
+                    # Update headers for this attempt
+                    self.requests.session.headers.update(strategy["headers"])
+
+                channels_response = self.requests.timed_get(channels_url, "channels", strategy['timeout'])
+
+                if channels_response.status_code == 200:
+                    print(f"✅ Channels fetched successfully using strategy {i+1}")
+                    used_strategy = i
+                    break
+                else:
+                    print(f"❌ Strategy {i+1} failed with status {channels_response.status_code}")
+
+            except Exception as e:
+                print(f"❌ Strategy {i+1} error: {e}")
+                last_error = e
+                time.sleep(1) # Short wait before retry
+                continue
+
+        if not channels_response or channels_response.status_code != 200:
+            error_msg = str(last_error) if last_error else "Unknown error"
+            raise fetch_failed(f"Failed to get channels after retries.\nLast error: {error_msg}")
+
+        # ✅ PROCESS RESPONSE QUICKLY - decode + normalize runs in a worker process when enabled
+        try:
+            raw_body = channels_response.content
+            print(f"🔍 Response preview: {raw_body[:200].decode('utf-8', errors='replace').strip()}...")
+            self.progress(f"Processing {len(raw_body) // 1024} KB of channel data...")
+
+            response_shape, item_count, channels = self.parse_pool.run(
+                normalize_channel_payload, raw_body, self.portal_url)
+        except Exception as e:
+            print(f"❌ Channel processing error: {e}")
+            raise fetch_failed(f"Error processing channels: {str(e)}")
+
+        if response_shape is None:
+            raise fetch_failed("Unexpected response format from server")
+
+        if cancelled():
+            return None
+
+        # ✅ NEW: Run diagnosis if empty
+        if item_count == 0:
+            diagnosis = diagnose_server_response(channels_response.text.strip())
+            raise fetch_failed(
+                f"❌ Empty Channel List\n\n"
+                f"Server: {self.portal_url}\n"
+                f"MAC: {self.mac_address}\n\n"
+                f"Response Status: {'Valid JSON' if diagnosis['response_valid'] else 'Invalid'}\n"
+                f"Likely Cause: {diagnosis['likely_cause']}\n\n"
+                f"What to do:\n"
+                f"• Contact your provider to verify subscription\n"
+                f"• Check if MAC address needs activation\n"
+                f"• Ask for correct portal URL\n"
+                f"• Request channel list manually from provider"
+            )
+
+        self.progress(f"Processed {item_count} channels...")
+
+        if channels:
+            self.save_capabilities(
+                successful_endpoints["api_base"], successful_endpoints["flavor"], fetch_strategy=used_strategy)
+
+        return channels
+
+    def get_stream_link(self, cmd, strict=False):
+        """Get stream link with provider-specific handling.
+        strict returns None when create_link fails instead of falling back to the channel's own URL."""
+        clean_cmd = cmd.replace("ffmpeg ", "").strip()
+        print(f"🔗 Getting stream link for: {clean_cmd}")
+
+        # Check if this is delta8k provider
+        provider_type = self.detect_provider_type(self.portal_url)
+
+        if provider_type == "delta8k":
+            # For delta8k, URLs are already playable - return as is
+            print(f"✅ Delta8k provider - using direct URL: {clean_cmd}")
+            return clean_cmd
+
+        # For other providers, use the create_link endpoint
+        # Extract stream ID from the original command
+        stream_id = None
+        match = re.search(r'stream=(\d+)', clean_cmd)
+        if match:
+            stream_id = match.group(1)
+
+        # Build create_link_url as before
+        create_link_url = f"{self.portal_url}{self.get_mag_api_base()}?type=itv&action=create_link&mac={self.mac_address}&cmd={urllib.parse.quote(clean_cmd)}&JsHttpRequest=1-xml"
+
+        # Helper to fix URLs
+        def fix_url(url_to_fix):
+            if "localhost" in url_to_fix:
+                parsed_portal = urllib.parse.urlparse(self.portal_url)
+                return url_to_fix.replace("localhost", parsed_portal.netloc)
+            elif url_to_fix.startswith("/"):
+                parsed_portal = urllib.parse.urlparse(self.portal_url)
+                return f"{parsed_portal.scheme}://{parsed_portal.netloc}{url_to_fix}"
+            return url_to_fix
+
+        try:
+            timestamp = int(time.time() * 1000)
+            random_val = random.randint(1000, 9999)
+            create_link_url += f"&_t={timestamp}&_r={random_val}"
+
+            # Use specific headers to avoid 10054
+            headers = {
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+                "Connection": "close"
+            }
+
+            response = self.requests.hedged_get(create_link_url, "create_link", 5, headers=headers)
+            if response.status_code == 200:
+                try:
+                    data = response.json().get('js', {})
+                except:
+                    data = {}
+
+                real_cmd = data.get('cmd', '')
+                if real_cmd:
+                    final_url = real_cmd.replace("ffmpeg ", "").strip()
+
+                    # Restore stream ID if missing
+                    if stream_id:
+                        final_url = re.sub(r'stream=(?:&)?', f'stream={stream_id}&', final_url)
+                        # If still missing, append it
+                        if f'stream={stream_id}' not in final_url:
+                            if "stream=" in final_url:
+                                final_url = re.sub(r'stream=[^&]*', f'stream={stream_id}', final_url)
+                            else:
+                                # Add stream param before extension
+                                ext_match = re.search(r'extension=\w+', final_url)
+                                if ext_match:
+                                    ext_pos = ext_match.start()
+                                    final_url = final_url[:ext_pos] + f'stream={stream_id}&' + final_url[ext_pos:]
+
+                    # Fix localhost/relative URLs
+                    final_url = fix_url(final_url)
+
+                    print(f"✅ Got clean stream URL: {final_url}")
+                    return final_url
+                else:
+                    print(f"⚠️ No real_cmd in response: {data}")
+            else:
+                print(f"❌ HTTP {response.status_code}: {response.text[:100]}")
+        except Exception as e:
+            print(f"❌ Stream link error: {e}")
+
+        if strict:
+            return None
+        # ✅ FALLBACK: Return direct URL instead of None to avoid popup
+        print("⚠️ Failed to get stream link - falling back to direct URL")
+        return fix_url(clean_cmd)
+
+    def refresh_session_and_retry(self, original_cmd, strict=False):
+        """Refresh session and get new token"""
+        try:
+            print("🔄 Refreshing session due to token expiry...")
+
+            # Clear token cache
+            self.token_cache.clear()
+
+            # Perform new handshake
+            auth_url = f"{self.portal_url}{self.get_mag_api_base()}?type=stb&action=handshake&mac={self.mac_address}&_t={int(time.time())}"
+
+            headers = {
+                "Referer": self.portal_url + "index.html",
+                "Origin": self.portal_url.rstrip('/'),
+            }
+
+            auth_response = self.requests.timed_get(auth_url, "handshake", 10, headers=headers)
+
+            if auth_response.status_code == 200:
+                print("✅ Session refreshed successfully")
+                # Now try to get the stream link again
+                return self.get_stream_link(original_cmd, strict=strict)
+            else:
+                print(f"❌ Session refresh failed: {auth_response.status_code}")
+                return None
+
+        except Exception as e:
+            print(f"❌ Session refresh error: {e}")
+            return None
+
+
+class ChannelStore:
+    """Current channel list for one profile, backed by the permanent pickle cache.
+    Per-channel stream health (StreamProber results) is kept beside it in health_<profile>.json,
+    keyed by channel id and only read when first needed."""
+    def __init__(self, cache_manager, portal_url, mac_address, cache_dir=CACHE_DIR):
+        self.cache_manager = cache_manager
+        self.portal_url = portal_url
+        self.mac_address = mac_address
+        self.channels = []
+        self.health_path = os.path.join(cache_dir, f"health_{get_profile_id(portal_url, mac_address)}.json")
+        self._health = None
+        self.health_lock = threading.Lock()
+
+    def load_cached(self):
+        cached_channels = self.cache_manager.load_from_cache(self.portal_url, self.mac_address)
+        if cached_channels:
+            self.channels = cached_channels
+        return cached_channels
+
+    def replace(self, channels, persist=True):
+        self.channels = channels
+        if persist:
+            self.cache_manager.save_to_cache(self.portal_url, self.mac_address, channels)
+            if self._health or os.path.exists(self.health_path):
+                # Forget health of channels the portal no longer lists
+                current_ids = {get_channel_id(channel) for channel in channels}
+                with self.health_lock:
+                    self._health = {key: value for key, value in self.health.items() if key in current_ids}
+                self.record_health({})
+
+    def cache_info(self):
+        return self.cache_manager.get_cache_info(self.portal_url, self.mac_address)
+
+    @property
+    def health(self):
+        if self._health is None:
+            try:
+                with open(self.health_path, "r", encoding="utf-8") as f:
+                    self._health = json.load(f)
+            except:
+                self._health = {}
+        return self._health
+
+    def health_for(self, channel):
+        """Last probe result for a channel ({} if never probed)"""
+        return self.health.get(get_channel_id(channel), {})
+
+    def record_health(self, results):
+        """Merge {channel_id: result} and write the health file atomically"""
+        with self.health_lock:
+            self._health = dict(self.health, **results)
+            payload = json.dumps(self._health)
+        try:
+            temp_path = self.health_path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(temp_path, self.health_path)
+        except Exception as e:
+            print(f"Channel health save error: {e}")
+
+
+class SearchIndex:
+    """Substring search over channel names with a bounded result cache"""
+    MAX_ENTRIES = 100
+
+    def __init__(self):
+        self.channels = []
+        self.cache = {}
+
+    def reset(self, channels):
+        self.channels = channels
+        self.cache.clear()
+
+    def search(self, search_term):
+        """Returns (matching channels, served_from_cache)"""
+        search_term = search_term.lower().strip()
+        if not search_term:
+            return self.channels, False
+
+        if search_term in self.cache:
+            return self.cache[search_term], True
+
+        filtered = [channel for channel in self.channels if search_term in channel[0].lower()]
+        self.cache[search_term] = filtered
+
+        # Limit cache size
+        if len(self.cache) > self.MAX_ENTRIES:
+            for key in list(self.cache.keys())[:self.MAX_ENTRIES // 2]:
+                del self.cache[key]
+        return filtered, False
+
+
+class FailoverGroups:
+    """Alternate feeds of the same channel (same channel_identity, different stream ids or qualities),
+    grouped once when the channel list loads so failover never has to search at play time"""
+    def __init__(self):
+        self.groups = {}
+
+    def reset(self, channels):
+        groups = {}
+        for channel in channels:
+            groups.setdefault(channel_identity(channel[0]), []).append(channel)
+        # Only channels with at least one alternate need a group
+        self.groups = {identity: members for identity, members in groups.items() if len(members) > 1}
+
+    def members(self, channel, health=None):
+        """The channel followed by its alternates - known-good feeds first (fastest first), dead ones last.
+        health is the ChannelStore's {channel_id: probe result}."""
+        health = health or {}
+        alternates = []
+        seen = {get_channel_id(channel), channel[-1]}
+        for member in self.groups.get(channel_identity(channel[0]), []):
+            if get_channel_id(member) in seen or member[-1] in seen:
+                continue    # Same entry, or a duplicate listing of the same stream
+            seen.update((get_channel_id(member), member[-1]))
+            alternates.append(member)
+
+        def rank(member):
+            result = health.get(get_channel_id(member), {})
+            if result.get("up"):
+                return (0, result.get("ttfb_ms") or 0)
+            return (2, 0) if result.get("checked") else (1, 0)
+        return [channel] + sorted(alternates, key=rank)
+
+
+class StreamResolver:
+    """Turns a channel's portal command into a playable URL"""
+    def __init__(self, portal):
+        self.portal = portal
+        self.connection_manager = ConnectionManager(portal)  # Retry + session refresh
+
+    def resolve(self, channel, max_retries=3, strict=False):
+        """channel is (name, stream_url[, original_cmd]) - returns a URL or None.
+        strict: None when create_link fails, instead of the channel's own (usually unplayable) URL."""
+        if len(channel) < 3 or self.portal.detect_provider_type() == "delta8k":
+            # Old-format channels and delta8k URLs play as they are
+            return channel[1]
+        return self.connection_manager.get_stream_with_retry(channel[2], max_retries=max_retries, strict=strict)
+
+
+# ffmpeg/ffplay stderr: HTTP failures and the classic "size= time= bitrate= speed=" stats line
+FFMPEG_HTTP_ERROR_RE = re.compile(
+    r'(?:HTTP error|Server returned)\s+(\d{3})'
+    r'|\b(401|403|404|456|5\d\d)\s+(?:Unauthorized|Forbidden|Not Found|Service Unavailable|'
+    r'Bad Gateway|Gateway Timeout|Internal Server Error)', re.IGNORECASE)
+FFMPEG_STATS_RE = re.compile(
+    r'size=\s*(\d+)\s*(?:kB|KiB).*?time=\s*(\d+):(\d+):([\d.]+).*?bitrate=\s*([\d.]+)\s*kbits/s(?:.*?speed=\s*([\d.]+)x)?')
+FFPLAY_INPUT_RE = re.compile(r'Input #\d+, ([\w,]+), from')
+FFPLAY_VIDEO_RE = re.compile(r'Stream #\d+:\d+.*?: Video: (\w+).*?, (\d{2,5})x(\d{2,5})')
+FFPLAY_AUDIO_RE = re.compile(r'Stream #\d+:\d+.*?: Audio: (\w+)')
+
+
+class FFmpegMonitor:
+    """Event-driven view of a running ffmpeg - progress and HTTP errors as they happen.
+    Reads `-progress pipe:1` key=value blocks from stdout (when piped) and stderr line by line
+    on reader threads; waiters block on a condition instead of polling the output file."""
+    STDERR_TAIL = 50
+
+    def __init__(self, process, on_progress=None, on_error=None, on_line=None):
+        self.process = process
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.on_line = on_line      # Raw stderr lines (stream info for StreamParamCache)
+        self.stats = {"bytes": 0, "bitrate_kbps": 0.0, "speed": 0.0, "out_time": 0.0}
+        self.http_error = None      # First HTTP status seen in stderr (int)
+        self.error_line = None
+        self.stderr_tail = []
+        self.last_progress = time.time()
+        self.exited = False
+        self.cond = threading.Condition()
+
+        if process.stdout:
+            threading.Thread(target=self._read_progress, daemon=True).start()
+        if process.stderr:
+            threading.Thread(target=self._read_stderr, daemon=True).start()
+        threading.Thread(target=self._wait_exit, daemon=True).start()
+
+    def _publish(self, **stats):
+        with self.cond:
+            self.stats.update(stats)
+            self.last_progress = time.time()
+            snapshot = dict(self.stats)
+            self.cond.notify_all()
+        if self.on_progress:
+            self.on_progress(snapshot)
+
+    def _read_progress(self):
+        block = {}
+        try:
+            for line in self.process.stdout:
+                key, _, value = line.strip().partition("=")
+                if key != "progress":
+                    block[key] = value
+                    continue
+                # One block per stats period - "progress=continue|end" closes it
+                try:
+                    self._publish(bytes=int(block.get("total_size", 0) or 0),
+                                  bitrate_kbps=float(block.get("bitrate", "0").replace("kbits/s", "") or 0),
+                                  speed=float(block.get("speed", "0").rstrip("x") or 0),
+                                  out_time=int(block.get("out_time_us", 0) or 0) / 1000000)
+                except ValueError:
+                    pass
+                block = {}
+        except (ValueError, OSError):
+            pass    # Pipe closed
+
+    def _read_stderr(self):
+        try:
+            # Text-mode pipes turn ffmpeg's \r stats updates into separate lines
+            for line in self.process.stderr:
+                line = line.strip()
+                if not line:
+                    continue
+                self.stderr_tail = (self.stderr_tail + [line])[-self.STDERR_TAIL:]
+                if self.on_line:
+                    self.on_line(line)
+
+                match = FFMPEG_HTTP_ERROR_RE.search(line)
+                if match and self.http_error is None:
+                    with self.cond:
+                        self.http_error = int(match.group(1) or match.group(2))
+                        self.error_line = line
+                        self.cond.notify_all()
+                    print(f"🚫 ffmpeg reported HTTP {self.http_error}: {line[:120]}")
+                    if self.on_error:
+                        self.on_error(self.http_error, line)
+                    continue
+
+                stats = FFMPEG_STATS_RE.search(line)
+                if stats and not self.process.stdout:
+                    hours, minutes, seconds = int(stats.group(2)), int(stats.group(3)), float(stats.group(4))
+                    self._publish(bytes=int(stats.group(1)) * 1024,
+                                  bitrate_kbps=float(stats.group(5)),
+                                  speed=float(stats.group(6) or 0),
+                                  out_time=hours * 3600 + minutes * 60 + seconds)
+        except (ValueError, OSError):
+            pass
+
+    def _wait_exit(self):
+        self.process.wait()
+        with self.cond:
+            self.exited = True
+            self.cond.notify_all()
+
+    def wait_until(self, ready, timeout, cancelled=None, stall_timeout=None):
+        """Block until ready(stats) -> "ready", an HTTP error -> "error", ffmpeg exit -> "exited",
+        no progress for stall_timeout -> "stalled", cancelled() -> "cancelled", or "timeout"."""
+        deadline = time.time() + timeout
+        with self.cond:
+            while True:
+                if self.http_error is not None:
+                    return "error"
+                if ready(self.stats):
+                    return "ready"
+                if self.exited:
+                    return "exited"
+                if cancelled and cancelled():
+                    return "cancelled"
+                now = time.time()
+                if stall_timeout and self.stats["bytes"] and now - self.last_progress > stall_timeout:
+                    return "stalled"
+                if now >= deadline:
+                    return "timeout"
+                # Woken by every progress block / error / exit; the 1s cap only re-checks cancel
+                self.cond.wait(min(1.0, deadline - now))
+
+    def terminate(self):
+        if self.process.poll() is None:
+            try:
+                self.process.terminate()
+            except:
+                pass
+
+
+class ProcessRegistry:
+    """Owns every ffmpeg/ffplay/mpv process the app spawns - label, start time, CPU/RSS and exit status.
+    One watcher thread reaps exits; per-kind caps stop players and downloaders from piling up.
+    Live PIDs are kept in a per-instance ledger file so processes left behind by a crash are killed on the next start."""
+    LIMITS = {"player": 2, "downloader": 2}
+    POLL_INTERVAL = 1.0
+    HISTORY_SIZE = 50
+    TERMINATE_GRACE = 3             # Seconds a capped process gets to exit before it is killed
+
+    def __init__(self, ledger_dir=CACHE_DIR, limits=None):
+        self.ledger_dir = ledger_dir
+        self.ledger_path = os.path.join(ledger_dir, f"processes_{os.getpid()}.json")
+        self.limits = dict(self.LIMITS, **(limits or load_config().get("process_limits", {})))
+        self.lock = threading.Lock()
+        self.entries = {}           # pid -> entry dict
+        self.history = []           # Finished entries, newest last
+        self.stopping = []          # (process, kill_at) - asked to exit over the cap, killed by the watcher if still up
+        self.watcher = None
+        self._psutil = None         # Imported on first use
+
+    @property
+    def psutil(self):
+        if self._psutil is None:
+            try:
+                import psutil
+                self._psutil = psutil
+            except ImportError:
+                self._psutil = False    # Still tracks lifecycles, just no CPU/RSS
+        return self._psutil or None
+
+    def register(self, process, kind, label=None):
+        """Track a freshly spawned process; over the cap for its kind, the oldest one is terminated.
+        Never blocks - the watcher thread kills anything that ignores the terminate."""
+        entry = {"process": process, "pid": process.pid, "kind": kind, "label": label or "",
+                 "started": time.time(), "cpu_percent": 0.0, "rss": 0, "returncode": None}
+        if self.psutil:
+            try:
+                entry["handle"] = self.psutil.Process(process.pid)
+                entry["create_time"] = entry["handle"].create_time()
+            except Exception:
+                pass
+        with self.lock:
+            same_kind = [e for e in self.entries.values() if e["kind"] == kind]
+            self.entries[process.pid] = entry
+            if self.watcher is None:
+                self.watcher = threading.Thread(target=self._watch, daemon=True)
+                self.watcher.start()
+        limit = self.limits.get(kind)
+        if limit:
+            for old in sorted(same_kind, key=lambda e: e["started"])[:max(0, len(same_kind) + 1 - limit)]:
+                print(f"✋ {kind} limit ({limit}) reached - stopping {old['label'] or old['pid']}")
+                try:
+                    old["process"].terminate()
+                except:
+                    pass
+                with self.lock:
+                    self.stopping.append((old["process"], time.time() + self.TERMINATE_GRACE))
+        self._save_ledger()
+        return entry
+
+    @staticmethod
+    def _terminate(process):
+        try:
+            process.terminate()
+            process.wait(timeout=3)
+        except:
+            try:
+                process.kill()
+            except:
+                pass
+
+    def _kill_stragglers(self):
+        with self.lock:
+            stopping, self.stopping = self.stopping, []
+        waiting = []
+        for process, kill_at in stopping:
+            if process.poll() is not None:
+                continue
+            if time.time() < kill_at:
+                waiting.append((process, kill_at))
+                continue
+            try:
+                process.kill()
+            except:
+                pass
+        with self.lock:
+            self.stopping.extend(waiting)
+
+    def _watch(self):
+        while True:
+            time.sleep(self.POLL_INTERVAL)
+            self._kill_stragglers()
+            finished = []
+            with self.lock:
+                entries = list(self.entries.values())
+            for entry in entries:
+                returncode = entry["process"].poll()
+                if returncode is not None:
+                    entry["returncode"] = returncode
+                    entry["ended"] = time.time()
+                    finished.append(entry)
+                elif "handle" in entry:
+                    try:
+                        entry["cpu_percent"] = entry["handle"].cpu_percent()
+                        entry["rss"] = entry["handle"].memory_info().rss
+                    except Exception:
+                        pass
+            if finished:
+                with self.lock:
+                    for entry in finished:
+                        self.entries.pop(entry["pid"], None)
+                        entry.pop("handle", None)
+                    self.history = (self.history + finished)[-self.HISTORY_SIZE:]
+                for entry in finished:
+                    print(f"🪦 {entry['kind']} {entry['label'] or entry['pid']} exited "
+                          f"({entry['returncode']}) after {entry['ended'] - entry['started']:.0f}s")
+                self._save_ledger()
+
+    def active(self, kind=None):
+        """Snapshot of running processes (without Popen/psutil handles)"""
+        with self.lock:
+            return [{k: v for k, v in e.items() if k not in ("process", "handle")}
+                    for e in self.entries.values() if kind is None or e["kind"] == kind]
+
+    def terminate_all(self, kind=None):
+        with self.lock:
+            processes = [e["process"] for e in self.entries.values() if kind is None or e["kind"] == kind]
+        for process in processes:
+            self._terminate(process)
+
+    def _save_ledger(self):
+        with self.lock:
+            ledger = [{"pid": e["pid"], "kind": e["kind"], "create_time": e.get("create_time")}
+                      for e in self.entries.values()]
+        try:
+            if not ledger:
+                if os.path.exists(self.ledger_path):
+                    os.remove(self.ledger_path)
+                return
+            os.makedirs(self.ledger_dir, exist_ok=True)
+            temp_path = self.ledger_path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(ledger, f)
+            os.replace(temp_path, self.ledger_path)
+        except Exception as e:
+            print(f"Process ledger save error: {e}")
+
+    def cleanup_orphans(self):
+        """Kill processes recorded by instances that are no longer running. Returns how many were killed."""
+        if not self.psutil or not os.path.isdir(self.ledger_dir):
+            return 0
+        killed = 0
+        for name in os.listdir(self.ledger_dir):
+            match = re.fullmatch(r"processes_(\d+)\.json", name)
+            if not match or int(match.group(1)) == os.getpid() or self.psutil.pid_exists(int(match.group(1))):
+                continue    # Ours, or another instance still running
+            path = os.path.join(self.ledger_dir, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    ledger = json.load(f)
+                os.remove(path)
+            except:
+                continue
+            for record in ledger:
+                try:
+                    proc = self.psutil.Process(record["pid"])
+                    # create_time guards against the PID having been reused by something else
+                    if record.get("create_time") and abs(proc.create_time() - record["create_time"]) > 1:
+                        continue
+                    proc.terminate()
+                    killed += 1
+                    print(f"🔪 Terminated orphaned {record['kind']} (PID: {record['pid']})")
+                except (self.psutil.NoSuchProcess, self.psutil.AccessDenied):
+                    continue
+        return killed
+
+
+PROCESS_REGISTRY = ProcessRegistry()
+
+
+class StreamParamCache:
+    """Per-channel stream parameters learned from earlier plays (container, codecs, resolution and the
+    last probe size that worked). Channels seen before start with a tiny probe and a forced demuxer."""
+    FAST_PROBESIZE = 32768
+    FAST_ANALYZEDURATION = 500000   # microseconds
+    FULL_PROBESIZE = 3000000
+    FAILURE_WINDOW = 5              # ffplay exiting this soon after a fast start means the probe was too small
+    FORCEABLE_FORMATS = ("mpegts", "hls")
+
+    def __init__(self, profile_state):
+        self.profile_state = profile_state
+        self.lock = threading.Lock()
+        self.params = profile_state.get("stream_params", {}) or {}
+
+    @staticmethod
+    def channel_key(channel_cmd):
+        return hashlib.sha1(channel_cmd.replace("ffmpeg ", "").strip().encode("utf-8")).hexdigest()[:12]
+
+    def get(self, key):
+        with self.lock:
+            return dict(self.params[key]) if key in self.params else None
+
+    def _save(self):
+        with self.lock:
+            snapshot = dict(self.params)
+        self.profile_state.set("stream_params", snapshot)
+
+    def record(self, key, **params):
+        with self.lock:
+            entry = self.params.setdefault(key, {"probesize": self.FAST_PROBESIZE,
+                                                 "analyzeduration": self.FAST_ANALYZEDURATION})
+            entry.update(params, updated=time.time())
+        self._save()
+
+    def mark_failed(self, key):
+        """Fast start failed - grow the probe, or forget the channel once it is back to a full probe"""
+        with self.lock:
+            entry = self.params.get(key)
+            if not entry:
+                return
+            if entry["probesize"] >= self.FULL_PROBESIZE:
+                del self.params[key]
+            else:
+                entry["probesize"] = min(entry["probesize"] * 4, self.FULL_PROBESIZE)
+                entry["analyzeduration"] = min(entry["analyzeduration"] * 4, self.FULL_PROBESIZE)
+        print(f"🐢 Fast start failed for {key}, probing more next time")
+        self._save()
+
+    def probe_options(self, key):
+        """ffplay input options - minimal for known channels, the old full probe otherwise"""
+        known = self.get(key) if key else None
+        if not known:
+            return ["-probesize", str(self.FULL_PROBESIZE), "-analyzeduration", str(self.FULL_PROBESIZE)]
+        options = ["-probesize", str(known["probesize"]), "-analyzeduration", str(known["analyzeduration"])]
+        if known.get("container") in self.FORCEABLE_FORMATS:
+            options += ["-f", known["container"]]
+        return options
+
+    def watch(self, key, process):
+        """Learn parameters from ffplay's stderr; demote the fast path if the player dies right away"""
+        fast = self.get(key) is not None
+        learned = {}
+        started = time.time()
+
+        def on_line(line):
+            found = {}
+            match = FFPLAY_INPUT_RE.search(line)
+            if match:
+                found["container"] = match.group(1).split(",")[0]
+            match = FFPLAY_VIDEO_RE.search(line)
+            if match:
+                found.update(video_codec=match.group(1), resolution=f"{match.group(2)}x{match.group(3)}")
+            match = FFPLAY_AUDIO_RE.search(line)
+            if match:
+                found["audio_codec"] = match.group(1)
+            found = {name: value for name, value in found.items() if learned.get(name) != value}
+            if found:
+                learned.update(found)
+                if "container" in learned and ("video_codec" in learned or "audio_codec" in learned):
+                    self.record(key, **learned)
+
+        def check_exit():
+            process.wait()
+            if fast and "video_codec" not in learned and "audio_codec" not in learned \
+                    and time.time() - started < self.FAILURE_WINDOW:
+                self.mark_failed(key)
+
+        threading.Thread(target=check_exit, daemon=True).start()
+        return FFmpegMonitor(process, on_line=on_line)
+
+
+class PlayerLauncher:
+    """Starts ffplay for a resolved URL"""
+    USER_AGENT = "Mozilla/5.0 (QtEmbedded; U; Linux; C)"
+
+    def __init__(self, events, stream_params=None):
+        self.events = events
+        self.stream_params = stream_params
+
+    def build_command(self, stream_url, referer, user_agent=None, probe_options=None):
+        return [
+            "ffplay", "-x", "800", "-y", "600",
+            "-user_agent", user_agent or self.USER_AGENT,
+            "-headers", f"Referer: {referer}",
+            "-seek_interval", "3",
+
+            # Network optimizations for 4K-CDN
+            "-reconnect", "1",
+            "-reconnect_streamed", "1",
+            "-reconnect_delay_max", "3",
+            "-timeout", "15000000",  # 15s timeout
+
+            # Performance optimizations
+            "-sync", "video",
+            "-framedrop",
+            *(probe_options or ["-probesize", "3000000", "-analyzeduration", "3000000"]),
+
+            # Error handling
+            "-fflags", "+discardcorrupt",
+            "-err_detect", "ignore_err",
+
+            "-i", stream_url
+        ]
+
+    def launch(self, stream_url, referer, user_agent=None, channel_key=None):
+        """Returns (process, mode) - raises EngineError if ffplay cannot start.
+        With a channel_key, known channels start with a minimal probe and new ones are learned."""
+        learn = bool(self.stream_params and channel_key)
+        try:
+            print(f"🎬 Playing: {stream_url}")
+            probe_options = self.stream_params.probe_options(channel_key) if learn else None
+            mode = "fast" if learn and self.stream_params.get(channel_key) else "enhanced"
+            process = subprocess.Popen(self.build_command(stream_url, referer, user_agent, probe_options),
+                                       stderr=subprocess.PIPE if learn else None,
+                                       text=True, errors="replace")
+            PROCESS_REGISTRY.register(process, "player", channel_key or stream_url)
+            if learn:
+                self.stream_params.watch(channel_key, process)
+            print("⚡ Fast start with cached stream parameters!" if mode == "fast"
+                  else "🚀 Enhanced direct playback launched successfully!")
+            self.events.emit("playback_started", pid=process.pid, url=stream_url, mode=mode)
+            return process, mode
+        except Exception as e:
+            print(f"Enhanced direct play failed: {e}")
+
+        # Fallback with minimal command
+        print("🔄 Trying minimal fallback...")
+        try:
+            process = subprocess.Popen(["ffplay", "-seek_interval", "3", "-i", stream_url])
+            PROCESS_REGISTRY.register(process, "player", channel_key or stream_url)
+            print("🔄 Minimal fallback launched!")
+            self.events.emit("playback_started", pid=process.pid, url=stream_url, mode="minimal")
+            return process, "minimal"
+        except Exception as e:
+            print(f"All playback attempts failed: {e}")
+            raise EngineError(f"Unable to start ffplay: {e}")
+
+
+class PlayerController:
+    """One long-lived player window. With mpv installed it is started once in idle mode and driven over
+    its JSON IPC socket, so zapping just loads the next URL; otherwise every play replaces the previous ffplay.
+    Backend comes from config "player_backend": auto (default), mpv or ffplay."""
+    IPC_CONNECT_TIMEOUT = 5
+    STARTUP_TIMEOUT = 10            # How long wait_started gives mpv to open a stream
+    FFPLAY_SETTLE = 1.5             # ffplay has no status channel - alive this long counts as playing
+
+    def __init__(self, launcher, backend=None):
+        import shutil
+        self.launcher = launcher
+        self.backend = backend or load_config().get("player_backend", "auto")
+        self.mpv_path = shutil.which("mpv") if self.backend in ("auto", "mpv") else None
+        self.lock = threading.RLock()
+        self.process = None         # Current player (mpv or ffplay)
+        self.mode = None
+        self.ipc = None
+        self.ipc_events = []        # mpv events read while waiting for command replies
+        self.request_id = 0
+        if os.name == "nt":
+            self.ipc_path = rf"\\.\pipe\iptv-player-{os.getpid()}"
+        else:
+            import tempfile
+            self.ipc_path = os.path.join(tempfile.gettempdir(), f"iptv-player-{os.getpid()}.sock")
+
+    def _connect_ipc(self):
+        deadline = time.time() + self.IPC_CONNECT_TIMEOUT
+        while time.time() < deadline and self.process.poll() is None:
+            try:
+                if os.name == "nt":
+                    return open(self.ipc_path, "r+b", buffering=0)
+                import socket
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(5)
+                sock.connect(self.ipc_path)
+                return sock.makefile("rwb", buffering=0)
+            except OSError:
+                time.sleep(0.05)    # mpv creates the socket shortly after starting
+        raise EngineError("mpv IPC socket did not come up")
+
+    def _start_mpv(self, referer, user_agent):
+        print("🎞️ Starting persistent mpv player...")
+        self.process = subprocess.Popen([
+            self.mpv_path, "--idle=yes", "--force-window=yes", "--really-quiet",
+            "--geometry=800x600", f"--input-ipc-server={self.ipc_path}",
+            f"--user-agent={user_agent}", f"--referrer={referer}",
+        ])
+        PROCESS_REGISTRY.register(self.process, "player", "mpv (persistent)")
+        self.ipc = self._connect_ipc()
+        self.mode = "mpv"
+
+    def _command(self, *command):
+        """Send one IPC command and wait for its reply (mpv interleaves async events on the same socket)"""
+        self.request_id += 1
+        self.ipc.write((json.dumps({"command": list(command), "request_id": self.request_id}) + "\n").encode("utf-8"))
+        while True:
+            line = self.ipc.readline()
+            if not line:
+                raise EngineError("mpv IPC connection closed")
+            reply = json.loads(line)
+            if "event" in reply:
+                self.ipc_events.append(reply)
+            elif reply.get("request_id") == self.request_id:
+                if reply.get("error") != "success":
+                    raise EngineError(f"mpv {command[0]} failed: {reply.get('error')}")
+                return reply.get("data")
+
+    def _play_mpv(self, stream_url, referer, user_agent, title):
+        if self.mode != "mpv" or self.process is None or self.process.poll() is not None:
+            self.stop()
+            self._start_mpv(referer, user_agent)
+        self._command("set_property", "user-agent", user_agent)
+        self._command("set_property", "referrer", referer)
+        self._command("set_property", "force-media-title", title or stream_url)
+        self.ipc_events = []
+        self._command("loadfile", stream_url, "replace")
+        print(f"🔁 Loaded into running player (PID: {self.process.pid})")
+        return self.process, "mpv"
+
+    def play(self, stream_url, referer, user_agent=None, channel_key=None, command=None, title=None, **popen_kwargs):
+        """Returns (process, mode). command is a custom ffplay command line for the ffplay backend."""
+        user_agent = user_agent or self.launcher.USER_AGENT
+        with self.lock:
+            if self.mpv_path:
+                try:
+                    return self._play_mpv(stream_url, referer, user_agent, title)
+                except Exception as e:
+                    print(f"⚠️ mpv player unavailable ({e}) - falling back to ffplay")
+                    self.stop()
+                    if self.backend == "auto":
+                        self.mpv_path = None
+
+            # ffplay cannot change input - replace the previous window instead of piling them up
+            self.stop()
+            if command:
+                try:
+                    self.process = subprocess.Popen(command, **popen_kwargs)
+                    PROCESS_REGISTRY.register(self.process, "player", title or stream_url)
+                except Exception as e:
+                    raise EngineError(f"Unable to start ffplay: {e}")
+                mode = "custom"
+            else:
+                self.process, mode = self.launcher.launch(stream_url, referer, user_agent, channel_key)
+            self.mode = "ffplay"
+            return self.process, mode
+
+    def wait_started(self, timeout=None):
+        """Blocks until the current stream is playing (True) or the player gave up on it (False).
+        mpv reports file-loaded / end-file over IPC; for ffplay an early exit is the only failure signal."""
+        timeout = timeout or self.STARTUP_TIMEOUT
+        with self.lock:
+            process, mode = self.process, self.mode
+        if process is None:
+            return False
+        if mode != "mpv":
+            deadline = time.time() + min(timeout, self.FFPLAY_SETTLE)
+            while time.time() < deadline and process.poll() is None:
+                time.sleep(0.1)
+            return process.poll() is None
+
+        deadline = time.time() + timeout
+        while time.time() < deadline and process.poll() is None:
+            with self.lock:
+                if self.process is not process or not self.ipc:
+                    return False    # Replaced or stopped meanwhile
+                try:
+                    self._command("get_property", "idle-active")     # Any reply also delivers queued events
+                except Exception:
+                    return False
+                events, self.ipc_events = self.ipc_events, []
+            for event in events:
+                if event.get("event") == "file-loaded":
+                    return True
+                if event.get("event") == "end-file" and event.get("reason") == "error":
+                    print(f"❌ mpv could not open the stream: {event.get('file_error', 'error')}")
+                    return False
+            time.sleep(0.2)
+        return False
+
+    def stop(self):
+        """Close the player window (and IPC connection)"""
+        with self.lock:
+            if self.ipc:
+                try:
+                    self.ipc.close()
+                except:
+                    pass
+                self.ipc = None
+            if self.process and self.process.poll() is None:
+                try:
+                    self.process.terminate()
+                    self.process.wait(timeout=3)
+                except:
+                    try:
+                        self.process.kill()
+                    except:
+                        pass
+            self.process = None
+            self.mode = None
+            if os.name != "nt" and os.path.exists(self.ipc_path):
+                try:
+                    os.remove(self.ipc_path)
+                except OSError:
+                    pass
+
+
+class IPTVEngine:
+    """GUI-free core for one profile. Events: progress(message),
+    channels_loaded(channels, source), error(message), playback_started(pid, url, mode)"""
+    def __init__(self, portal_url, mac_address, cache_dir=CACHE_DIR, parse_in_worker=None):
+        self.portal_url = portal_url
+        self.mac_address = mac_address
+        self.cache_dir = cache_dir
+        if parse_in_worker is None:
+            parse_in_worker = load_config().get("parse_in_worker_process", False)
+
+        self.events = EngineEvents()
+        self.profile_state = ProfileStateStore(cache_dir, get_profile_id(portal_url, mac_address))
+        self.latency_tracker = LatencyTracker(self.profile_state)  # Adaptive per-host timeouts
+        self.requests = OptimizedRequests(self.latency_tracker)
+        self.parse_pool = ParseWorkerPool(parse_in_worker)
+        self.cache_manager = CacheManager(cache_dir)  # Only for channel cache
+        self.portal = PortalClient(portal_url, mac_address, self.requests,
+                                   self.profile_state, self.parse_pool, self.events)
+        self.store = ChannelStore(self.cache_manager, portal_url, mac_address, cache_dir)
+        self.search_index = SearchIndex()
+        self.failover_groups = FailoverGroups()
+        self.resolver = StreamResolver(self.portal)
+        self.failover = FailoverResolver(self)
+        self.stream_params = StreamParamCache(self.profile_state)
+        self.launcher = PlayerLauncher(self.events, self.stream_params)
+        self.player = PlayerController(self.launcher)
+
+    @property
+    def channels(self):
+        return self.store.channels
+
+    def set_channels(self, channels, persist=False):
+        self.store.replace(channels, persist=persist)
+        self.search_index.reset(channels)
+        self.failover_groups.reset(channels)
+
+    def load_cached_channels(self):
+        cached_channels = self.store.load_cached()
+        if cached_channels:
+            self.search_index.reset(cached_channels)
+            self.failover_groups.reset(cached_channels)
+            self.events.emit("channels_loaded", channels=cached_channels, source="cache")
+        return cached_channels
+
+    def fetch_channels(self, cancelled=lambda: False):
+        """Fresh fetch from the portal (blocking) - saves to the permanent cache.
+        Returns channels, or None if cancelled; raises EngineError on failure."""
+        try:
+            channels = self.portal.fetch_channels(cancelled)
+        except EngineError as e:
+            self.events.emit("error", message=str(e))
+            raise
+        except Exception as e:
+            self.events.emit("error", message=f"Error: {str(e)}")
+            raise EngineError(f"Error: {str(e)}")
+        if channels is None:
+            return None
+
+        self.set_channels(channels, persist=True)
+        self.latency_tracker.flush()
+        self.events.emit("channels_loaded", channels=channels, source="portal")
+        return channels
+
+    def search(self, search_term):
+        return self.search_index.search(search_term)
+
+    def resolve(self, channel, max_retries=3, strict=False):
+        return self.resolver.resolve(channel, max_retries=max_retries, strict=strict)
+
+    def get_stream_link(self, cmd):
+        return self.portal.get_stream_link(cmd)
+
+    def real_stream_url(self, channel):
+        """Fresh create_link URL for a channel (falls back to its basic URL)"""
+        real_stream_url = self.get_stream_link(channel[2] if len(channel) > 2 else channel[1])
+        if not real_stream_url:
+            return channel[1]
+        clean_url = real_stream_url.replace("ffmpeg ", "").strip()
+        return build_stream_url(clean_url, urllib.parse.urlparse(self.portal_url).netloc)
+
+    def play(self, stream_url, channel_cmd=None):
+        """Play an already-resolved URL in the shared player - channel_cmd keys the stream parameter cache"""
+        clean_stream_url = stream_url.replace("ffmpeg ", "").strip()
+        channel_key = StreamParamCache.channel_key(channel_cmd) if channel_cmd else None
+        return self.player.play(clean_stream_url, self.portal_url + "index.html", channel_key=channel_key)
+
+    def close(self):
+        """Persist learned latency, close requests session and parse workers"""
+        try:
+            self.latency_tracker.flush()
+            self.requests.close()
+            self.parse_pool.shutdown()
+        except:
+            pass
+
+
+HEALTH_COLORS = {"ok": "green", "degraded": "orange", "dead": "red"}
+
+
+class ProfileHealthChecker:
+    """Concurrent health check of saved profiles - handshake, get_profile, channel count and one sample
+    create_link per portal, with a global worker limit and short per-host adaptive timeouts.
+    Results land in the ProfileStore as status colour, latency and last-check time."""
+    WORKERS = 16
+    TIMEOUT = (3, 5)
+
+    def __init__(self, store, cache_dir=CACHE_DIR, workers=None):
+        self.store = store
+        self.cache_dir = cache_dir
+        self.workers = workers or self.WORKERS
+
+    def check_profile(self, name, user_data):
+        """Returns {"profile", "status": ok|degraded|dead, "latency_ms", "channel_count", "error", ...}"""
+        started = time.time()
+        result = {"profile": name, "status": "dead", "latency_ms": None, "channel_count": None,
+                  "checked": started, "error": None}
+        # Just the portal client - a full IPTVEngine per profile would load stores and caches a check never uses
+        portal_url, mac_address = user_data["portal_url"], user_data["mac_address"]
+        profile_state = ProfileStateStore(self.cache_dir, get_profile_id(portal_url, mac_address))
+        latency_tracker = LatencyTracker(profile_state)
+        client = OptimizedRequests(latency_tracker)
+        portal = PortalClient(portal_url, mac_address, client, profile_state, ParseWorkerPool(), EngineEvents())
+        try:
+            # Learned timeouts may shrink the check but never stretch it past TIMEOUT
+            timeout = tuple(min(learned, limit) for learned, limit in
+                            zip(client.adaptive_timeout(portal_url, "handshake", self.TIMEOUT), self.TIMEOUT))
+            probe = portal.probe(timeout)
+            result["latency_ms"] = probe["handshake_ms"] or probe["connect_ms"]
+            if probe["status"] != 200:
+                result["error"] = probe.get("error") or f"handshake HTTP {probe['status']}"
+                return result
+
+            result["status"] = "degraded"
+            flavor = build_portal_endpoints(portal_url, mac_address, probe["api_base"])["flavor"]
+            if flavor == "mag":
+                base_url = f"{portal_url}{probe['api_base']}?mac={mac_address}&JsHttpRequest=1-xml"
+                response = client.timed_get(base_url + "&type=stb&action=get_profile",
+                                                     "handshake", self.TIMEOUT, timeout=timeout)
+                if response.status_code != 200:
+                    result["error"] = f"get_profile HTTP {response.status_code}"
+                    return result
+
+                # First page of the channel list carries the total and a cmd to test create_link with
+                response = client.timed_get(base_url + "&type=itv&action=get_ordered_list&p=1",
+                                                     "channels", self.TIMEOUT, timeout=timeout)
+                listing = response.json().get("js") or {}
+                result["channel_count"] = int(listing.get("total_items") or 0) or None
+                sample_cmd = next((item.get("cmd") for item in listing.get("data") or []
+                                   if isinstance(item, dict) and item.get("cmd")), None)
+                if sample_cmd and not portal.get_stream_link(sample_cmd, strict=True):
+                    result["error"] = "create_link returned no stream"
+                    return result
+            result["status"] = "ok"
+        except Exception as e:
+            result["error"] = str(e)
+        finally:
+            latency_tracker.flush()
+            client.close()
+            result["elapsed_ms"] = round((time.time() - started) * 1000)
+        return result
+
+    def run(self, names=None, on_result=None, cancelled=lambda: False):
+        """Check the named (default: all) profiles concurrently, then write every result to the store.
+        on_result(result, done, total) is called from worker threads as checks finish."""
+        profiles = [(name, dict(data)) for name, data in self.store.profiles.items()
+                    if names is None or name in names]
+        results = []
+        with ThreadPoolExecutor(max_workers=min(self.workers, max(1, len(profiles)))) as executor:
+            futures = [executor.submit(self.check_profile, name, data) for name, data in profiles]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if on_result:
+                    on_result(result, len(results), len(profiles))
+                if cancelled():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+
+        updates = {}
+        for result in results:
+            fields = {"color": HEALTH_COLORS[result["status"]], "health": result["status"],
+                      "latency_ms": result["latency_ms"], "last_check": result["checked"],
+                      "health_error": result["error"]}
+            if result["channel_count"]:
+                fields["channel_count"] = result["channel_count"]
+            updates[result["profile"]] = fields
+        self.store.update_many(updates)
+        return results
+
+
+def find_ts_sync(data, packets=3):
+    """Offset of the first run of `packets` MPEG-TS sync bytes 188 apart, or None"""
+    for offset in range(min(188, len(data) - 188 * (packets - 1))):
+        if all(data[offset + 188 * index] == 0x47 for index in range(packets)):
+            return offset
+    return None
+
+
+class StreamProber:
+    """Checks that channels actually deliver video without decoding anything: resolve, then a small
+    ranged GET checked for MPEG-TS sync bytes (or an HLS playlist with media). Records up/down, TTFB and
+    delivery rate per channel in the ChannelStore; per-host slots and request spacing keep it polite."""
+    WORKERS = 8
+    PER_HOST = 2
+    HOST_SPACING = 0.1              # Seconds between request starts to one host (10 req/s)
+    SAMPLE_BYTES = 188 * 1024
+    SAMPLE_SECONDS = 3
+    MAX_AGE = 6 * 3600              # Fresher results are not re-probed
+    SAVE_EVERY = 500
+
+    def __init__(self, engine, workers=None):
+        self.engine = engine
+        self.workers = workers or self.WORKERS
+        self.lock = threading.Lock()
+        self.host_slots = {}
+        self.host_next_start = {}
+
+    def _acquire(self, url):
+        """Wait for a per-host slot and the host's spacing - returns the slot to release"""
+        host = urllib.parse.urlparse(url).netloc
+        with self.lock:
+            slot = self.host_slots.setdefault(host, threading.Semaphore(self.PER_HOST))
+        slot.acquire()
+        with self.lock:
+            now = time.time()
+            start = max(now, self.host_next_start.get(host, 0))
+            self.host_next_start[host] = start + self.HOST_SPACING
+        if start > now:
+            time.sleep(start - now)
+        return slot
+
+    def _sample(self, stream_url, result, max_bytes=None):
+        max_bytes = max_bytes or self.SAMPLE_BYTES
+        started = time.time()
+        headers = {"User-Agent": PlayerLauncher.USER_AGENT, "Range": f"bytes=0-{max_bytes - 1}"}
+        response = self.engine.requests.session.get(stream_url, headers=headers, stream=True, timeout=(5, 8))
+        data = bytearray()
+        first_byte = None
+        try:
+            if response.status_code not in (200, 206):
+                result["error"] = f"HTTP {response.status_code}"
+                return
+            # Live streams ignore Range - stop reading once the sample is big or old enough
+            for chunk in response.iter_content(16384):
+                if first_byte is None:
+                    first_byte = time.time()
+                data += chunk
+                if len(data) >= max_bytes or time.time() - started > self.SAMPLE_SECONDS:
+                    break
+        finally:
+            response.close()
+        if first_byte is None:
+            result["error"] = "no data"
+            return
+
+        result["ttfb_ms"] = round((first_byte - started) * 1000)
+        if is_hls_url(response.url, response.headers.get("Content-Type")) or data.lstrip().startswith(b"#EXTM3U"):
+            playlist = parse_hls_playlist(data.decode("utf-8", errors="replace"), response.url)
+            result["up"] = bool(playlist["variants"] or playlist["segments"])
+            result["error"] = None if result["up"] else "empty HLS playlist"
+            return
+        result["up"] = find_ts_sync(data) is not None
+        result["error"] = None if result["up"] else "no MPEG-TS sync in sample"
+        elapsed = time.time() - first_byte
+        if result["up"] and elapsed > 0:
+            result["kbps"] = round(len(data) * 8 / elapsed / 1000)     # Delivery rate over the sample
+
+    def probe_channel(self, channel):
+        """{"up", "ttfb_ms", "kbps", "checked", "error"} for one channel"""
+        result = {"up": False, "ttfb_ms": None, "kbps": None, "checked": time.time(), "error": None}
+        try:
+            slot = self._acquire(self.engine.portal_url)
+            try:
+                stream_url = self.engine.resolve(channel, max_retries=1, strict=True)
+            finally:
+                slot.release()
+            if not stream_url:
+                result["error"] = "create_link failed"
+                return result
+            slot = self._acquire(stream_url)
+            try:
+                self._sample(stream_url, result)
+            finally:
+                slot.release()
+        except Exception as e:
+            result["error"] = str(e)[:120]
+        return result
+
+    def run(self, channels, on_result=None, cancelled=lambda: False, max_age=None):
+        """Probe channels whose result is missing or older than max_age - unchecked and stalest first.
+        on_result(channel, result, done, total) is called from the calling thread."""
+        max_age = self.MAX_AGE if max_age is None else max_age
+        store = self.engine.store
+        now = time.time()
+        checked = {get_channel_id(channel): store.health_for(channel).get("checked", 0) for channel in channels}
+        pending = sorted((channel for channel in channels if now - checked[get_channel_id(channel)] > max_age),
+                         key=lambda channel: checked[get_channel_id(channel)])
+        print(f"🩺 Probing {len(pending)} of {len(channels)} channels ({self.workers} workers)")
+
+        batch = {}
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.probe_channel, channel): channel for channel in pending}
+            for future in as_completed(futures):
+                channel = futures[future]
+                result = future.result()
+                batch[get_channel_id(channel)] = result
+                done += 1
+                if on_result:
+                    on_result(channel, result, done, len(pending))
+                if len(batch) >= self.SAVE_EVERY:
+                    store.record_health(batch)
+                    batch = {}
+                if cancelled():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+        store.record_health(batch)
+        return done
+
+
+class FailoverResolver:
+    """Resolves a channel through its failover group, hedged: the next member starts as soon as one fails
+    or after HEDGE_DELAY without an answer, and the first member whose stream opens (resolve + TS/HLS check)
+    wins. Outcomes are recorded as channel health so the next play ranks the group better."""
+    HEDGE_DELAY = 1.5
+    MAX_PARALLEL = 3
+    OPEN_CHECK_BYTES = 188 * 64
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.prober = StreamProber(engine)
+
+    def _attempt(self, member, results, stop):
+        result = {"up": False, "ttfb_ms": None, "kbps": None, "checked": time.time(), "error": None}
+        stream_url = None
+        try:
+            stream_url = self.engine.resolve(member, max_retries=1, strict=True)
+            if not stream_url:
+                result["error"] = "create_link failed"
+            elif stop.is_set():
+                result = None     # Another member already won - don't open this one
+            else:
+                self.prober._sample(stream_url, result, self.OPEN_CHECK_BYTES)
+        except Exception as e:
+            result["error"] = str(e)[:120]
+        results.put((member, stream_url if result and result["up"] else None, result))
+
+    def resolve(self, channel, skip=(), cancelled=lambda: False, on_attempt=None):
+        """Returns (member, stream_url) for the first member that opens, or (None, None).
+        skip holds channel ids already tried; on_attempt(member) is called as each member starts."""
+        members = [member for member in self.engine.failover_groups.members(channel, self.engine.store.health)
+                   if get_channel_id(member) not in skip]
+        results = queue.Queue()
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.MAX_PARALLEL)
+        health = {}
+        next_index = 0
+        running = 0
+        try:
+            while not cancelled():
+                if next_index < len(members) and running < self.MAX_PARALLEL:
+                    if on_attempt:
+                        on_attempt(members[next_index])
+                    executor.submit(self._attempt, members[next_index], results, stop)
+                    next_index += 1
+                    running += 1
+                if not running:
+                    break
+                try:
+                    member, stream_url, result = results.get(timeout=self.HEDGE_DELAY)
+                except queue.Empty:
+                    continue    # Slow answer - hedge with the next member
+                running -= 1
+                if result:
+                    health[get_channel_id(member)] = result
+                if stream_url:
+                    print(f"🔀 Failover: playing {member[0]}")
+                    return member, stream_url
+                print(f"❌ {member[0]}: {result and result['error']}")
+            return None, None
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            if health:
+                self.engine.store.record_health(health)
+
+
+class TimeShiftRing:
+    """Fixed-size on-disk time-shift buffer - a ring of preallocated segment files.
+    The writer appends MPEG-TS; when it wraps, the oldest segment is reused in place (O(1), no data copied).
+    Each segment records its start time and keyframe (random access) offsets so readers can jump back by seconds."""
+    SEGMENT_SIZE = 8 * 1024 * 1024
+    SEGMENT_COUNT = 25              # 200MB - about 100 seconds of HD video
+
+    def __init__(self, directory, segment_size=None, segment_count=None):
+        self.directory = directory
+        self.segment_size = segment_size or self.SEGMENT_SIZE
+        self.segment_count = segment_count or self.SEGMENT_COUNT
+        self.segment_size -= self.segment_size % 188     # Segments hold whole TS packets
+        os.makedirs(directory, exist_ok=True)
+
+        self.files = []
+        for index in range(self.segment_count):
+            f = open(os.path.join(directory, f"segment_{index:03d}.ts"), "w+b")
+            f.truncate(self.segment_size)   # Preallocate once - never grows or shrinks
+            self.files.append(f)
+        # Per slot: [absolute segment number, start time, keyframe offsets]
+        self.segments = [[-1, 0.0, []] for _ in range(self.segment_count)]
+        self.head = 0
+        self.cond = threading.Condition()
+        self.closed = False
+
+    def oldest_offset(self):
+        """First byte still in the ring (the segment being overwritten is already gone)"""
+        first_segment = self.head // self.segment_size - self.segment_count + 1
+        return max(0, first_segment * self.segment_size)
+
+    def write(self, data):
+        """Append bytes (bytes/memoryview) - called by the downloader/relay thread"""
+        data = memoryview(data)
+        while len(data) and not self.closed:
+            number = self.head // self.segment_size
+            slot = number % self.segment_count
+            within = self.head % self.segment_size
+            length = min(len(data), self.segment_size - within)
+
+            with self.cond:
+                segment = self.segments[slot]
+                if segment[0] != number:
+                    # Recycle the oldest segment in place
+                    segment[0], segment[1], segment[2] = number, time.time(), []
+
+            f = self.files[slot]
+            f.seek(within)
+            f.write(data[:length])
+            f.flush()
+            keyframes = self._scan_keyframes(data[:length], self.head)
+
+            with self.cond:
+                self.segments[slot][2].extend(keyframes)
+                self.head += length
+                self.cond.notify_all()
+            data = data[length:]
+
+    @staticmethod
+    def _scan_keyframes(chunk, offset):
+        """Absolute offsets of TS packets with random_access_indicator set.
+        Packets whose header straddles two writes are skipped - a missed keyframe only costs precision."""
+        keyframes = []
+        position = (-offset) % 188
+        end = len(chunk) - 6
+        while position <= end:
+            # sync byte, adaptation field present, non-empty, random_access_indicator
+            if chunk[position] == 0x47 and chunk[position + 3] & 0x20 and chunk[position + 4] and chunk[position + 5] & 0x40:
+                keyframes.append(offset + position)
+            position += 188
+        return keyframes
+
+    def offset_for(self, seconds_back):
+        """Keyframe offset about seconds_back behind the live edge (oldest available if further)"""
+        target_time = time.time() - seconds_back
+        oldest = self.oldest_offset()
+        with self.cond:
+            candidates = sorted(seg for seg in self.segments
+                                if seg[0] >= 0 and seg[0] * self.segment_size >= oldest)
+        chosen = None
+        for segment in candidates:
+            if segment[1] <= target_time or chosen is None:
+                chosen = segment
+        if chosen is None:
+            return self.head - self.head % 188
+        keyframes = [k for k in chosen[2] if k >= oldest]
+        return keyframes[0] if keyframes else max(oldest, chosen[0] * self.segment_size)
+
+    def read_from(self, position, chunk_size=256 * 1024):
+        """Generator of byte slices from position up to the live edge and beyond (follows the writer)"""
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        readers = {}
+        try:
+            while not self.closed:
+                with self.cond:
+                    while position >= self.head and not self.closed:
+                        self.cond.wait(1.0)
+                    available = self.head - position
+                if self.closed:
+                    return
+                if position < self.oldest_offset():
+                    # Lapped by the writer - continue from the oldest data still buffered
+                    position = self.offset_for(float("inf"))
+                    continue
+
+                slot = (position // self.segment_size) % self.segment_count
+                within = position % self.segment_size
+                length = min(available, chunk_size, self.segment_size - within)
+                f = readers.get(slot)
+                if f is None:
+                    f = readers[slot] = open(self.files[slot].name, "rb")
+                f.seek(within)
+                read = f.readinto(view[:length])
+                if position < self.oldest_offset():
+                    continue    # Overwritten while reading - drop this slice
+                yield view[:read]
+                position += read
+        finally:
+            for f in readers.values():
+                f.close()
+
+    def close(self, remove=True):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for f in self.files:
+            try:
+                f.close()
             except:
                 pass
-        
-        return {"exists": False}
-    
-    
-    
+        if remove:
+            import shutil
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+HLS_ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def is_hls_url(url, content_type=""):
+    return ".m3u8" in urllib.parse.urlparse(url).path.lower() or "mpegurl" in (content_type or "").lower()
+
+
+def parse_hls_playlist(text, base_url):
+    """Master or media playlist -> variants [(bandwidth, url)] or segments [(sequence, duration, url)]"""
+    playlist = {"variants": [], "segments": [], "target_duration": 6.0,
+                "endlist": False, "map_url": None, "encrypted": False, "byterange": False}
+    sequence = 0
+    duration = 0.0
+    variant_bandwidth = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#EXT-X-STREAM-INF:"):
+            attributes = dict(HLS_ATTR_RE.findall(line[len("#EXT-X-STREAM-INF:"):]))
+            variant_bandwidth = int(attributes.get("BANDWIDTH", "0").strip('"') or 0)
+        elif line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            sequence = int(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-TARGETDURATION:"):
+            playlist["target_duration"] = float(line.split(":", 1)[1])
+        elif line.startswith("#EXTINF:"):
+            duration = float(line[len("#EXTINF:"):].split(",")[0] or 0)
+        elif line.startswith("#EXT-X-ENDLIST"):
+            playlist["endlist"] = True
+        elif line.startswith("#EXT-X-MAP:"):
+            uri = dict(HLS_ATTR_RE.findall(line[len("#EXT-X-MAP:"):])).get("URI", "").strip('"')
+            playlist["map_url"] = urllib.parse.urljoin(base_url, uri) if uri else None
+        elif line.startswith("#EXT-X-KEY:"):
+            method = dict(HLS_ATTR_RE.findall(line[len("#EXT-X-KEY:"):])).get("METHOD", "NONE")
+            playlist["encrypted"] = method.strip('"') != "NONE"
+        elif line.startswith("#EXT-X-BYTERANGE:"):
+            playlist["byterange"] = True    # Segments are sub-ranges of shared files
+        elif not line.startswith("#"):
+            url = urllib.parse.urljoin(base_url, line)
+            if variant_bandwidth is not None:
+                playlist["variants"].append((variant_bandwidth, url))
+                variant_bandwidth = None
+            else:
+                playlist["segments"].append((sequence, duration, url))
+                sequence += 1
+    playlist["variants"].sort()
+    return playlist
+
+
+class HLSPrebuffer:
+    """Native HLS reader - fetches the next N media segments concurrently over one pooled session
+    and hands them to write() strictly in order. Follows live playlist refreshes and switches
+    variants by measured throughput."""
+    CONCURRENCY = 4
+    LIVE_START_SEGMENTS = 3         # Join live playlists this many segments behind the edge
+    SWITCH_HEADROOM = 0.7           # Pick variants needing at most 70% of measured throughput
+    INITIAL_BANDWIDTH = 3000000     # Variant cap before anything has been measured (bit/s)
+
+    def __init__(self, playlist_url, headers=None, session=None, concurrency=None):
+        self.playlist_url = playlist_url
+        self.media_url = playlist_url
+        self.headers = dict(headers or {}, Connection="keep-alive")
+        self.session = session or requests.Session()
+        self.concurrency = concurrency or self.CONCURRENCY
+        self.variants = []
+        self.throughput = None      # bit/s, smoothed
+        self.status_code = None
+
+    def fetch(self, url, timeout=(5, 15)):
+        response = self.session.get(url, headers=self.headers, timeout=timeout)
+        self.status_code = response.status_code
+        response.raise_for_status()
+        return response
+
+    def pick_variant(self):
+        budget = self.throughput * self.SWITCH_HEADROOM if self.throughput else self.INITIAL_BANDWIDTH
+        affordable = [url for bandwidth, url in self.variants if bandwidth <= budget]
+        return affordable[-1] if affordable else self.variants[0][1]
+
+    def load_media_playlist(self):
+        response = self.fetch(self.media_url)
+        playlist = parse_hls_playlist(response.text, response.url)
+        if playlist["variants"]:
+            # Master playlist - remember the variants and descend into one
+            self.variants = playlist["variants"]
+            self.media_url = self.pick_variant()
+            print(f"📶 HLS: {len(self.variants)} variants, starting with {self.media_url}")
+            response = self.fetch(self.media_url)
+            playlist = parse_hls_playlist(response.text, response.url)
+        return playlist
+
+    def _record_throughput(self, byte_count, seconds):
+        if byte_count and seconds > 0:
+            measured = byte_count * 8 / seconds
+            self.throughput = measured if self.throughput is None else self.throughput * 0.6 + measured * 0.4
+
+    def _maybe_switch_variant(self):
+        if len(self.variants) < 2 or not self.throughput:
+            return
+        chosen = self.pick_variant()
+        if chosen != self.media_url:
+            print(f"📶 HLS: switching variant at {self.throughput / 1000000:.1f} Mbit/s -> {chosen}")
+            self.media_url = chosen
+
+    def run(self, write, stop_check=lambda: False, on_start=None):
+        """Blocking loop - write(bytes) receives segments in playlist order until stopped or ENDLIST.
+        on_start(content_type) runs once the first media segment has been written."""
+        playlist = self.load_media_playlist()
+        if playlist["encrypted"]:
+            raise EngineError("Encrypted HLS (EXT-X-KEY) is not supported by the native prebuffer")
+        if playlist["byterange"]:
+            raise EngineError("Byte-range HLS (EXT-X-BYTERANGE) is not supported by the native prebuffer")
+        segments = playlist["segments"]
+        if not segments:
+            raise EngineError("HLS playlist has no segments")
+
+        live = not playlist["endlist"]
+        next_sequence = segments[max(0, len(segments) - self.LIVE_START_SEGMENTS)][0] if live else segments[0][0]
+        content_type = "video/mp4" if playlist["map_url"] else "video/mp2t"
+        started = False
+
+        written_map = None
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while not stop_check():
+                segments = playlist["segments"]
+                if segments and (next_sequence < segments[0][0] or next_sequence > segments[-1][0] + 10):
+                    # Fell behind the window, or a variant switch renumbered the sequence
+                    next_sequence = segments[max(0, len(segments) - self.LIVE_START_SEGMENTS)][0]
+                if playlist["map_url"] and playlist["map_url"] != written_map:
+                    write(self.fetch(playlist["map_url"]).content)
+                    written_map = playlist["map_url"]
+
+                pending = [segment for segment in segments if segment[0] >= next_sequence]
+                in_flight = []
+                index = 0
+                batch_start = time.time()
+                batch_bytes = 0
+                while (in_flight or index < len(pending)) and not stop_check():
+                    # Keep N segment downloads running; write them out in sequence order
+                    while index < len(pending) and len(in_flight) < self.concurrency:
+                        in_flight.append((pending[index], executor.submit(self.fetch, pending[index][2])))
+                        index += 1
+                    segment, future = in_flight.pop(0)
+                    try:
+                        data = future.result().content
+                        write(data)
+                        batch_bytes += len(data)
+                        if not started and on_start:
+                            on_start(content_type)
+                        started = True
+                    except Exception as e:
+                        print(f"⚠️ HLS segment {segment[0]} skipped: {e}")
+                    next_sequence = segment[0] + 1
+                for _, future in in_flight:
+                    future.cancel()
+
+                if pending:
+                    self._record_throughput(batch_bytes, time.time() - batch_start)
+                    self._maybe_switch_variant()
+                if not live and next_sequence > segments[-1][0]:
+                    break
+
+                # Live edge reached - wait for the playlist to grow
+                if not pending:
+                    wait_until = time.time() + max(1.0, playlist["target_duration"] / 2)
+                    while time.time() < wait_until and not stop_check():
+                        time.sleep(0.2)
+                response = self.fetch(self.media_url)
+                playlist = parse_hls_playlist(response.text, response.url)
+                live = not playlist["endlist"]
+
+
+class StreamRelay:
+    """One upstream connection fanned out to N consumers from a shared ring buffer.
+    The upstream is read straight into the ring; consumers near the live edge get memoryview slices of it
+    (no per-consumer copies). A consumer lagging past COPY_LAG gets copies instead, so the writer wrapping
+    around can't overwrite a slice while that consumer is still sending it.
+    HLS upstreams are fed by HLSPrebuffer instead, segment by segment."""
+    RING_SIZE = 16 * 1024 * 1024
+    READ_SIZE = 188 * 1024          # Whole MPEG-TS packets per upstream read
+    MAX_SLICE = 256 * 1024          # Largest slice handed to one consumer write
+    JOIN_BACKLOG = 1024 * 1024      # New consumers start this far behind the live edge
+    IDLE_GRACE = 5                  # Keep upstream open briefly after the last consumer leaves
+    COPY_LAG = 0.5                  # Fraction of the ring a consumer may lag and still get zero-copy slices
+
+    def __init__(self, stream_url, headers, ring_size=None, timeshift=None, session=None):
+        self.stream_url = stream_url
+        self.headers = headers
+        self.session = session      # Pooled session for HLS segment fetches
+        self.timeshift = timeshift  # Optional TimeShiftRing fed alongside the memory ring
+        self.size = ring_size or self.RING_SIZE
+        self.ring = bytearray(self.size)
+        self.view = memoryview(self.ring)
+        self.head = 0               # Total bytes received (absolute offset)
+        self.cond = threading.Condition()
+        self.ready = threading.Event()
+        self.status_code = None
+        self.content_type = "video/mp2t"
+        self.redirect_url = None    # HLS the prebuffer couldn't start - clients are redirected here instead
+        self.error = None
+        self.finished = False
+        self.closed = False
+        self.consumers = 0
+        self.claims = 0             # Client requests holding the relay, consuming or not yet
+
+    def start(self):
+        threading.Thread(target=self._pump, daemon=True).start()
+        return self
+
+    def _append(self, data):
+        """Copy one fetched chunk (an HLS segment) into the ring"""
+        data = memoryview(data)
+        while len(data) and not self.closed:
+            start = self.head % self.size
+            length = min(len(data), self.READ_SIZE, self.size - start)
+            self.view[start:start + length] = data[:length]
+            with self.cond:
+                self.head += length
+                self.cond.notify_all()
+            if self.timeshift:
+                self.timeshift.write(self.view[start:start + length])
+            data = data[length:]
+
+    def _pump_hls(self, playlist_url):
+        def started(content_type):
+            self.status_code = 200
+            self.content_type = content_type
+            self.ready.set()
+
+        prebuffer = HLSPrebuffer(playlist_url, self.headers, self.session)
+        try:
+            prebuffer.run(self._append, stop_check=lambda: self.closed, on_start=started)
+        finally:
+            if self.status_code is None:
+                # Nothing went out yet - let the player fetch the playlist itself, as before the relay
+                self.status_code = 302
+                self.redirect_url = playlist_url
+
+    def _pump(self):
+        upstream = None
+        try:
+            if is_hls_url(self.stream_url):
+                self._pump_hls(self.stream_url)
+                return
+            upstream = requests.get(self.stream_url, headers=self.headers, stream=True, timeout=(5, 30))
+            if upstream.status_code == 200 and is_hls_url(upstream.url, upstream.headers.get("Content-Type")):
+                # Redirected to (or served as) a playlist
+                playlist_url = upstream.url
+                upstream.close()
+                upstream = None
+                self._pump_hls(playlist_url)
+                return
+            self.status_code = upstream.status_code
+            self.content_type = upstream.headers.get("Content-Type", self.content_type)
+            self.ready.set()
+            if upstream.status_code != 200:
+                return
+
+            raw = upstream.raw
+            while not self.closed:
+                start = self.head % self.size
+                received = raw.readinto(self.view[start:start + min(self.READ_SIZE, self.size - start)])
+                if not received:
+                    break
+                with self.cond:
+                    self.head += received
+                    self.cond.notify_all()
+                if self.timeshift:
+                    self.timeshift.write(self.view[start:start + received])
+        except Exception as e:
+            self.error = e
+            print(f"❌ Relay upstream error: {e}")
+        finally:
+            self.ready.set()
+            with self.cond:
+                self.finished = True
+                self.cond.notify_all()
+            if upstream is not None:
+                upstream.close()
+            if self.timeshift:
+                self.timeshift.close()
+
+    def consume_timeshift(self, seconds_back):
+        """Generator of slices starting about seconds_back behind live, read from the time-shift ring"""
+        with self.cond:
+            self.consumers += 1
+        try:
+            yield from self.timeshift.read_from(self.timeshift.offset_for(seconds_back))
+        finally:
+            self._release()
+
+    def consume(self):
+        """Generator of memoryview slices from the live edge onwards - stops when the upstream ends"""
+        with self.cond:
+            self.consumers += 1
+            position = max(0, self.head - self.JOIN_BACKLOG)
+            position -= position % 188
+        try:
+            while True:
+                with self.cond:
+                    while position >= self.head and not self.finished:
+                        self.cond.wait(1.0)
+                    if position >= self.head:
+                        return
+                    # Too far behind - the writer is about to reuse this part of the ring
+                    if self.head - position > self.size - self.READ_SIZE - self.MAX_SLICE:
+                        skipped_to = self.head - self.JOIN_BACKLOG
+                        skipped_to -= skipped_to % 188
+                        print(f"⚠️ Relay consumer lagging - skipped {(skipped_to - position) // 1024} KB")
+                        position = skipped_to
+                    start = position % self.size
+                    length = min(self.head - position, self.size - start, self.MAX_SLICE)
+                    if self.head - position > self.size * self.COPY_LAG:
+                        # Close to being lapped - copy while the lock keeps the writer off this region
+                        chunk = bytes(self.view[start:start + length])
+                    else:
+                        chunk = self.view[start:start + length]
+                yield chunk
+                position += length
+        finally:
+            self._release()
+
+    def claim(self):
+        """Hold the relay open for one client request until unclaim()"""
+        with self.cond:
+            self.claims += 1
+
+    def unclaim(self):
+        with self.cond:
+            self.claims -= 1
+        self._release(consumer=False)
+
+    def _release(self, consumer=True):
+        with self.cond:
+            if consumer:
+                self.consumers -= 1
+            idle = self.consumers == 0 and self.claims == 0
+        if idle:
+            threading.Timer(self.IDLE_GRACE, self._close_if_idle).start()
+
+    def _close_if_idle(self):
+        with self.cond:
+            if self.consumers == 0 and self.claims == 0:
+                self.close()
+
+    def close(self):
+        self.closed = True
+
+    @property
+    def alive(self):
+        return not (self.finished or self.closed)
+
+
+class RelayHub:
+    """Shares one StreamRelay per channel between all local consumers"""
+    STALE_TIMESHIFT = 600       # Seconds without writes before a leftover time-shift directory is removed
+    def __init__(self, session=None):
+        self.session = session      # Shared by HLS relays for pooled segment fetches
+        self.relays = {}
+        self.key_locks = {}
+        self.lock = threading.Lock()
+
+    def attach(self, key, open_stream, timeshift_dir=None):
+        """Live relay for key - open_stream() -> (url, headers) only runs when a new upstream is needed.
+        The relay comes back claimed: the caller must unclaim() it once done, whether it consumed or not.
+        With timeshift_dir a new relay also records into a TimeShiftRing in its own <timeshift_dir>_<id>
+        directory, so a relay still shutting down can't remove the files of its replacement."""
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        # Per-channel lock: concurrent openers of one channel share it, other channels don't wait
+        with key_lock:
+            relay = self.relays.get(key)
+            if relay and relay.alive:
+                print("🔁 Joining shared upstream")
+                relay.claim()
+                return relay
+            stream_url, headers = open_stream()
+            if not stream_url:
+                return None
+            timeshift = None
+            if timeshift_dir:
+                import uuid
+                self._prune_timeshift(timeshift_dir)
+                timeshift = TimeShiftRing(f"{timeshift_dir}_{uuid.uuid4().hex[:8]}")
+            relay = StreamRelay(stream_url, headers, timeshift=timeshift, session=self.session)
+            relay.claim()
+            relay.start()
+            with self.lock:
+                self.relays[key] = relay
+            return relay
+
+    def _prune_timeshift(self, timeshift_dir):
+        """Remove time-shift directories of this channel left behind by relays that never closed (crash, kill)"""
+        import glob
+        import shutil
+        for directory in glob.glob(glob.escape(timeshift_dir) + "_*"):
+            try:
+                segment_times = [os.path.getmtime(path) for path in glob.glob(os.path.join(directory, "*.ts"))]
+                if time.time() - max(segment_times or [os.path.getmtime(directory)]) > self.STALE_TIMESHIFT:
+                    shutil.rmtree(directory, ignore_errors=True)
+            except OSError:
+                pass
+
+    def close_all(self):
+        with self.lock:
+            relays, self.relays = list(self.relays.values()), {}
+        for relay in relays:
+            relay.close()
+
+
+class PlaylistProxyServer:
+    """Local HTTP server - live M3U of the engine's channels, tokens resolved lazily per channel.
+    GET /playlist.m3u, GET /play/<id> (?mode=redirect|proxy overrides the server default,
+    ?back=<seconds> starts that far behind live when time-shift is on)"""
+    RESOLVE_TTL = 30            # Players often reconnect/probe twice - reuse the fresh URL briefly
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, engine, host="127.0.0.1", port=8765, mode="proxy", timeshift=False):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.mode = mode
+        self.timeshift = timeshift  # Record proxied channels into an on-disk TimeShiftRing
+        self.resolved = TokenCache(ttl=self.RESOLVE_TTL)
+        self.relays = RelayHub(engine.requests.session)  # One upstream per channel, however many players watch it
+        self.by_id = {}
+        self.indexed_channels = None
+        self.httpd = None
+
+    @staticmethod
+    def channel_id(channel):
+        return get_channel_id(channel)
+
+    def _index(self):
+        channels = self.engine.channels
+        if channels is not self.indexed_channels:
+            self.by_id = {self.channel_id(ch): ch for ch in channels}
+            self.indexed_channels = channels
+        return self.by_id
+
+    @property
+    def playlist_url(self):
+        host = "127.0.0.1" if self.host in ("", "0.0.0.0") else self.host
+        return f"http://{host}:{self.port}/playlist.m3u"
+
+    @property
+    def running(self):
+        return self.httpd is not None
+
+    def channel_url(self, channel):
+        host = "127.0.0.1" if self.host in ("", "0.0.0.0") else self.host
+        return f"http://{host}:{self.port}/play/{self.channel_id(channel)}"
+
+    def playlist_text(self, host_header=None):
+        base_url = f"http://{host_header or f'{self.host}:{self.port}'}/play/"
+        return build_m3u((ch[0], base_url + self.channel_id(ch)) for ch in self.engine.channels)
+
+    def upstream_headers(self):
+        return {
+            "User-Agent": PlayerLauncher.USER_AGENT,
+            "Referer": self.engine.portal_url + "index.html"
+        }
+
+    def resolve(self, channel_id):
+        """(channel, fresh playable URL) - create_link only runs for channels actually opened"""
+        channel = self._index().get(channel_id)
+        if not channel:
+            return None, None
+        stream_url = self.resolved.get(channel_id)
+        if not stream_url:
+            stream_url = self.engine.resolve(channel)
+            if stream_url:
+                self.resolved.set(channel_id, stream_url)
+        return channel, stream_url
+
+    def start(self):
+        from http.server import ThreadingHTTPServer
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        print(f"📡 Playlist server: {self.playlist_url} ({self.mode} mode)")
+        return self.playlist_url
+
+    def stop(self):
+        httpd, self.httpd = self.httpd, None
+        self.relays.close_all()
+        if httpd:
+            httpd.shutdown()
+            httpd.server_close()
+            print("📡 Playlist server stopped")
+
+    def relay(self, handler, relay, seconds_back=0):
+        """Feed one client from the channel's shared relay (or its time-shift ring).
+        Releases the claim taken by RelayHub.attach on every exit, so an upstream nobody reads gets closed."""
+        try:
+            relay.ready.wait(35)
+            if relay.redirect_url:
+                handler.send_response(302)
+                handler.send_header("Location", relay.redirect_url)
+                handler.end_headers()
+                return
+            if relay.status_code != 200:
+                handler.send_text(502, f"Upstream failed: {relay.error or relay.status_code}")
+                return
+            handler.send_response(200)
+            handler.send_header("Content-Type", relay.content_type)
+            handler.end_headers()
+            if seconds_back > 0 and relay.timeshift:
+                consumer = relay.consume_timeshift(seconds_back)
+            else:
+                consumer = relay.consume()
+            try:
+                for chunk in consumer:
+                    handler.wfile.write(chunk)
+            finally:
+                consumer.close()
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            pass  # Player closed the connection
+        finally:
+            relay.unclaim()
+
+    def proxy(self, handler, stream_url):
+        """Pipe the upstream stream to one client with the portal's UA/Referer (ranged/VOD requests)"""
+        headers = self.upstream_headers()
+        if handler.headers.get("Range"):
+            headers["Range"] = handler.headers["Range"]
+
+        upstream = requests.get(stream_url, headers=headers, stream=True, timeout=(5, 30))
+        try:
+            handler.send_response(upstream.status_code)
+            for name in ("Content-Type", "Content-Length", "Content-Range", "Accept-Ranges"):
+                if upstream.headers.get(name):
+                    handler.send_header(name, upstream.headers[name])
+            handler.end_headers()
+            for chunk in upstream.iter_content(self.CHUNK_SIZE):
+                handler.wfile.write(chunk)
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            pass  # Player closed the connection
+        finally:
+            upstream.close()
+
+    def _make_handler(self):
+        from http.server import BaseHTTPRequestHandler
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def send_text(self, status, text, content_type="text/plain; charset=utf-8"):
+                body = text.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parsed = urllib.parse.urlparse(self.path)
+                query = urllib.parse.parse_qs(parsed.query)
+                try:
+                    if parsed.path in ("/", "/playlist.m3u", "/playlist.m3u8"):
+                        self.send_text(200, server.playlist_text(self.headers.get("Host")),
+                                       "audio/x-mpegurl; charset=utf-8")
+                        return
+
+                    if parsed.path.startswith("/play/"):
+                        channel_id = parsed.path[len("/play/"):].strip("/")
+                        mode = query.get("mode", [server.mode])[0]
+
+                        # Live proxying shares one upstream per channel - resolve only for a new one
+                        if mode == "proxy" and not self.headers.get("Range") and channel_id in server._index():
+                            def open_stream():
+                                return server.resolve(channel_id)[1], server.upstream_headers()
+
+                            timeshift_dir = (os.path.join(server.engine.cache_dir, "stream_cache", channel_id)
+                                             if server.timeshift else None)
+                            relay = server.relays.attach(channel_id, open_stream, timeshift_dir)
+                            if relay:
+                                try:
+                                    seconds_back = float(query.get("back", ["0"])[0])
+                                except ValueError:
+                                    seconds_back = 0
+                                server.relay(self, relay, seconds_back)
+                                return
+
+                        channel, stream_url = server.resolve(channel_id)
+                        if not channel:
+                            self.send_text(404, "Unknown channel - reload the playlist")
+                            return
+                        if not stream_url:
+                            self.send_text(502, f"Could not resolve {channel[0]}")
+                            return
+
+                        # HLS playlists hold relative segment URLs - hand those to the player directly
+                        if mode == "redirect" or is_hls_url(stream_url):
+                            self.send_response(302)
+                            self.send_header("Location", stream_url)
+                            self.end_headers()
+                        else:
+                            print(f"📡 Proxying {channel[0]}")
+                            server.proxy(self, stream_url)
+                        return
+
+                    self.send_text(404, "Not found")
+                except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+                    pass
+                except Exception as e:
+                    print(f"❌ Playlist server error: {e}")
+                    try:
+                        self.send_text(502, str(e))
+                    except:
+                        pass
+
+        return Handler
+
+
 class M3UExportWindow:
     """M3U Export Options Window with enhanced functionality"""
     def __init__(self, parent, channels, mac_address):
@@ -458,18 +4214,8 @@ class M3UExportWindow:
     def _export_basic(self, channels, file_path):
         """Quick export with basic URLs"""
         try:
-            m3u_content = "#EXTM3U\n"
-            
-            for channel_data in channels:
-                channel_name = channel_data[0]
-                stream_url = channel_data[1]
-                
-                clean_name = channel_name.replace('\n', ' ').replace('\r', ' ')
-                m3u_content += f"#EXTINF:-1,{clean_name}\n"
-                m3u_content += f"{stream_url}\n"
-            
             with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(m3u_content)
+                f.write(build_m3u((ch[0], ch[1]) for ch in channels))
             
             messagebox.showinfo("Success", 
                               f"Successfully exported {len(channels)} channels to:\n{file_path}")
@@ -563,7 +4309,7 @@ class IPTVUserSelection:
     def __init__(self, root: tk.Tk):
         self.root = root 
         self.root.title("Select IPTV User - Created by Saleh (github.com/2saleh1)")
-        self.root.geometry("400x320") # Increased height for buttons
+        self.root.geometry("400x345") # Increased height for buttons and health status
         
         footer = tk.Label(root, text="Created by Saleh  |  github.com/2saleh1", fg="gray", font=("Arial", 8))
         footer.pack(side=tk.BOTTOM, pady=2)
@@ -572,7 +4318,8 @@ class IPTVUserSelection:
         if not os.path.exists(CREDENTIALS_DIR): 
             os.makedirs(CREDENTIALS_DIR)
 
-        self.credentials = self.load_credentials()
+        self.profile_store = ProfileStore(CREDENTIALS_DIR)
+        self.credentials = self.profile_store.profiles
 
         # --- Theme selection at the top, centered ---
         theme_frame = tk.Frame(root)
@@ -623,6 +4370,14 @@ class IPTVUserSelection:
                                       font=("Arial", 8), width=8)
         self.btn_mark_clear.pack(side=tk.LEFT, padx=2)
 
+        self.btn_check_all = tk.Button(status_frame, text="🩺 Check All",
+                                       command=self.check_all_profiles,
+                                       font=("Arial", 8), width=10)
+        self.btn_check_all.pack(side=tk.LEFT, padx=2)
+
+        self.health_var = StringVar(root)
+        tk.Label(root, textvariable=self.health_var, fg="gray", font=("Arial", 8)).pack()
+
         # --- Buttons ---
         self.start_button = tk.Button(root, text="Start Player", command=self.start_player, 
                                     width=25, bg="#2196F3", fg="white", font=("Arial", 10, "bold"))
@@ -650,18 +4405,9 @@ class IPTVUserSelection:
         if not username or username not in self.credentials:
             return
             
-        # Update data
-        if color:
-            self.credentials[username]["color"] = color
-        else:
-            if "color" in self.credentials[username]:
-                del self.credentials[username]["color"]
-        
-        # Save to file
-        file_path = os.path.join(CREDENTIALS_DIR, f"{username}.json")
+        # Update data (None clears the status) and the profile index
         try:
-            with open(file_path, "w") as f:
-                json.dump(self.credentials[username], f)
+            self.profile_store.update(username, color=color)
             
             # Update UI
             self.update_user_menu_colors()
@@ -682,7 +4428,13 @@ class IPTVUserSelection:
                     fg_color = "#00C853" # Strong Green
                 elif color == "red": 
                     fg_color = "#D50000" # Strong Red
+                elif color == "orange":
+                    fg_color = "#FF9100" # Reachable, but create_link/profile failing
                 
+                # Cached channel count from the profile index next to the name
+                count = user_data.get("channel_count")
+                menu.entryconfig(index, label=f"{user}  ({count} ch)" if count else user)
+
                 if fg_color:
                     menu.entryconfig(index, foreground=fg_color)
                 else:
@@ -693,6 +4445,36 @@ class IPTVUserSelection:
         except Exception as e:
             print(f"Error updating menu colors: {e}")
 
+    def check_all_profiles(self):
+        """Probe every saved profile in the background and colour the menu from the results"""
+        self.btn_check_all.config(state=tk.DISABLED)
+        self.health_var.set(f"🩺 Checking {len(self.user_keys)} profiles...")
+        checker = ProfileHealthChecker(self.profile_store)
+
+        def on_result(result, done, total):
+            latency = f"{result['latency_ms']} ms" if result["latency_ms"] is not None else "no answer"
+            message = f"🩺 {done}/{total} - {result['profile']}: {result['status']} ({latency})"
+            try:
+                self.root.after(0, lambda: self.health_var.set(message))
+            except (tk.TclError, RuntimeError):
+                pass
+
+        def run():
+            results = checker.run(on_result=on_result)
+            healthy = sum(1 for result in results if result["status"] == "ok")
+
+            def finish():
+                self.update_user_menu_colors()
+                self.btn_check_all.config(state=tk.NORMAL)
+                self.health_var.set(f"🩺 {healthy}/{len(results)} profiles healthy "
+                                    f"(checked {datetime.now().strftime('%H:%M')})")
+            try:
+                self.root.after(0, finish)
+            except (tk.TclError, RuntimeError):
+                pass  # Window closed while checking - results are already saved
+
+        threading.Thread(target=run, daemon=True).start()
+
     def on_theme_change(self, selected_theme):
         save_theme(selected_theme)
         self.root.destroy()
@@ -709,22 +4491,12 @@ class IPTVUserSelection:
             root.mainloop()
 
     def load_credentials(self):
-        """Load all saved user profiles from the credentials directory."""
-        users = {}
-        for filename in os.listdir(CREDENTIALS_DIR):
-            # Only load files that end with .json and do NOT contain '_favorites'
-            if filename.endswith(".json") and "_favorites" not in filename:
-                with open(os.path.join(CREDENTIALS_DIR, filename), "r") as f:
-                    try:
-                        data = json.load(f)
-                        users[filename.replace(".json", "")] = data
-                    except:
-                        pass
-        return users
+        """Load all saved user profiles from the profile index."""
+        return self.profile_store.load()
     
     def update_user_menu(self):
         """Refresh the dropdown menu after adding or deleting users."""
-        self.credentials = self.load_credentials()
+        self.credentials = self.profile_store.profiles
         self.user_keys = list(self.credentials.keys())
         default_user = self.user_keys[0] if self.user_keys else ""
 
@@ -771,8 +4543,7 @@ class IPTVUserSelection:
 
         confirm = messagebox.askyesno("Delete User", f"Are you sure you want to delete '{username}'?")
         if confirm:
-            file_path = os.path.join(CREDENTIALS_DIR, f"{username}.json")
-            os.remove(file_path)
+            self.profile_store.delete(username)
             messagebox.showinfo("Deleted", f"User '{username}' has been deleted.")
             self.update_user_menu()
 
@@ -786,6 +4557,111 @@ class IPTVUserSelection:
             WindowsIPTVPlayer(root, user_data)
             root.mainloop()
 
+TEST_CONNECTION_BUDGET = 20     # Seconds until test_connection gives its verdict
+TEST_CONNECTION_TIER_SHARES = (0.2, 0.3, 0.5)   # Budget slice of the quick, standard and extended tiers
+
+
+def portal_url_variants(portal_url):
+    """The portal URL plus its http/https and default-port (:80/:443) spellings, without duplicates"""
+    if not portal_url.endswith('/'):
+        portal_url += '/'
+    parsed = urllib.parse.urlparse(portal_url)
+    try:
+        port = parsed.port
+    except ValueError:
+        return [portal_url]
+    host = parsed.hostname or parsed.netloc
+    if ":" in host:
+        host = f"[{host}]"     # IPv6 literal
+    default_ports = {"http": 80, "https": 443}
+    other_scheme = {"http": "https", "https": "http"}.get(parsed.scheme)
+    schemes = [parsed.scheme] + ([other_scheme] if other_scheme else [])
+    ports = [port] + ([None] if port in (80, 443) else [])
+
+    variants = []
+    seen = set()
+    for scheme in schemes:
+        for variant_port in ports:
+            # http://host:80/ and http://host/ are the same server
+            if variant_port == default_ports.get(scheme):
+                variant_port = None
+            if (scheme, variant_port) in seen:
+                continue
+            seen.add((scheme, variant_port))
+            netloc = f"{host}:{variant_port}" if variant_port else host
+            variants.append(urllib.parse.urlunparse(parsed._replace(scheme=scheme, netloc=netloc)))
+    return variants
+
+
+def race_portal_variants(portal_url, mac_address, tracker, budget=TEST_CONNECTION_BUDGET, on_status=None):
+    """Handshake every URL variant concurrently, tier by tier (quick -> standard -> extended timeouts),
+    on one pooled session; the first 200 wins. Each tier gets its TEST_CONNECTION_TIER_SHARES slice of
+    the budget, so the extended tier always gets its turn. Returns {"ok", "url", "tier", "status", "elapsed", "error"}."""
+    started = time.time()
+    quick = tracker.timeout(portal_url, "handshake", (10, 15))
+    ceiling = tracker.ceiling("handshake")
+    standard = (min(ceiling[0], quick[0] * 2), min(ceiling[1], quick[1] * 2))
+    tiers = [("Quick", quick), ("Standard", standard), ("Extended", ceiling)]
+    variants = portal_url_variants(portal_url)
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=len(variants), pool_maxsize=len(variants))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def handshake(variant, timeout):
+        test_url = f"{variant}server/load.php?type=stb&action=handshake&mac={mac_address}"
+        print(f"🔍 Testing {test_url}")
+        response = session.get(test_url, timeout=timeout)
+        return variant, test_url, response
+
+    result = {"ok": False, "url": None, "tier": None, "status": None, "elapsed": None, "error": None}
+    executor = ThreadPoolExecutor(max_workers=len(variants))
+    try:
+        tier_deadline = started
+        for (tier_name, tier_timeout), share in zip(tiers, TEST_CONNECTION_TIER_SHARES):
+            tier_deadline += budget * share
+            remaining = tier_deadline - time.time()
+            if remaining <= 1:
+                continue
+            # connect + read must fit the slice, or the next tier would never start
+            scale = min(1.0, remaining / (tier_timeout[0] + tier_timeout[1]))
+            timeout = (tier_timeout[0] * scale, tier_timeout[1] * scale)
+            if on_status:
+                on_status(f"{tier_name}: racing {len(variants)} URL variants ({timeout[0]:.0f}s)...")
+            futures = [executor.submit(handshake, variant, timeout) for variant in variants]
+            timed_out = False
+            try:
+                for future in as_completed(futures, timeout=remaining):
+                    try:
+                        variant, test_url, response = future.result()
+                    except requests.exceptions.Timeout:
+                        timed_out = True
+                        continue
+                    except Exception as e:
+                        result["error"] = str(e)
+                        continue
+                    result["status"] = response.status_code
+                    if response.status_code == 200:
+                        print(f"✅ Connection successful with {tier_name} timeout: {variant}")
+                        tracker.record(test_url, "handshake", ttfb=response.elapsed.total_seconds())
+                        tracker.flush()
+                        result.update(ok=True, url=variant, tier=tier_name, error=None)
+                        return result
+            except Exception:
+                timed_out = True    # Budget ran out with requests still in flight
+            if not timed_out:
+                break   # Every variant answered or was refused - longer timeouts will not help
+            print(f"⏰ {tier_name} tier timed out on every variant")
+        if result["error"] is None and not result["status"]:
+            result["error"] = "timed out"
+        return result
+    finally:
+        result["elapsed"] = round(time.time() - started, 1)
+        # Losing requests finish on their own; nothing new starts
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 class NewUserWindow:
     """New User Creation Window with connection testing"""
     def __init__(self):
@@ -810,9 +4686,9 @@ class NewUserWindow:
         buttons_frame = tk.Frame(self.root)
         buttons_frame.pack(pady=10)
 
-        # self.test_button = tk.Button(buttons_frame, text="Test Connection", 
-        #                            command=self.test_connection, bg="orange", fg="white")
-        # self.test_button.pack(side=tk.LEFT, padx=5)
+        self.test_button = tk.Button(buttons_frame, text="Test Connection", 
+                                   command=self.test_connection, bg="orange", fg="white")
+        self.test_button.pack(side=tk.LEFT, padx=5)
 
         self.save_button = tk.Button(buttons_frame, text="Save", command=self.save_user)
         self.save_button.pack(side=tk.LEFT, padx=5)
@@ -870,85 +4746,38 @@ class NewUserWindow:
         status_label = tk.Label(progress_window, text="Connecting...", font=("Arial", 10))
         status_label.pack(pady=10)
 
-        # Enhanced connection test
+        # Concurrent connection test - URL variants race within each timeout tier
         def test_in_background():
             try:
-                # ✅ ENHANCED: Multiple timeout strategies
-                timeout_configs = [
-                    {"connect": 10, "read": 15, "name": "Quick"},
-                    {"connect": 20, "read": 30, "name": "Standard"}, 
-                    {"connect": 45, "read": 60, "name": "Extended"}
-                ]
-                
-                urls_to_try = [
-                    portal_url,
-                    portal_url.replace("https://", "http://"),
-                    portal_url.replace("http://", "https://"),
-                    portal_url.replace(":80", ""),
-                    portal_url.replace(":443", "")
-                ]
-                
-                for i, timeout_config in enumerate(timeout_configs):
-                    if progress_window.winfo_exists():
-                        self.root.after(0, lambda cfg=timeout_config: status_label.config(
-                            text=f"Trying {cfg['name']} timeout ({cfg['connect']}s)..."))
-                    
-                    for j, test_portal in enumerate(urls_to_try):
-                        try:
-                            if not progress_window.winfo_exists():
-                                return
-                            
-                            if not test_portal.endswith('/'):
-                                test_portal += '/'
-                            
-                            test_url = f"{test_portal}server/load.php?type=stb&action=handshake&mac={mac_address}"
-                            
-                            # Update progress
-                            self.root.after(0, lambda url=test_portal, cfg=timeout_config: status_label.config(
-                                text=f"{cfg['name']} test: {url[:30]}..."))
-                            
-                            print(f"🔍 Testing {timeout_config['name']}: {test_url}")
-                            
-                            # ✅ ENHANCED: Custom session with specific timeouts
-                            session = requests.Session()
-                            
-                            # Custom timeout for this attempt
-                            timeout = (timeout_config["connect"], timeout_config["read"])
-                            
-                            response = session.get(test_url, timeout=timeout)
-                            session.close()
-                            
-                            if response.status_code == 200:
-                                print(f"✅ Connection successful with {timeout_config['name']} timeout: {test_portal}")
-                                
-                                # Update UI on success
-                                self.root.after(0, lambda portal=test_portal: self.portal_entry.delete(0, tk.END))
-                                self.root.after(0, lambda portal=test_portal: self.portal_entry.insert(0, portal.rstrip('/')))
-                                self.root.after(0, lambda: progress_window.destroy())
-                                self.root.after(0, lambda: messagebox.showinfo("Connection Test", 
-                                    f"✅ Portal is reachable!\n\n"
-                                    f"Server: {test_portal}\n"
-                                    f"Timeout: {timeout_config['name']} ({timeout_config['connect']}s)\n"
-                                    f"Response: {response.status_code}"))
-                                return
-                                
-                        except requests.exceptions.ConnectTimeout:
-                            print(f"⏰ Connect timeout ({timeout_config['connect']}s) with {test_portal}")
-                            continue
-                        except requests.exceptions.ReadTimeout:
-                            print(f"⏰ Read timeout ({timeout_config['read']}s) with {test_portal}")
-                            continue
-                        except requests.exceptions.Timeout:
-                            print(f"⏰ General timeout with {test_portal}")
-                            continue
-                        except Exception as e:
-                            print(f"❌ Error with {test_portal}: {e}")
-                            continue
+                # ✅ ADAPTIVE: Timeout tiers derived from this portal's latency history
+                tracker = LatencyTracker(ProfileStateStore(CACHE_DIR, get_profile_id(portal_url, mac_address)))
+
+                def on_status(text):
+                    self.root.after(0, lambda: status_label.config(text=text) if status_label.winfo_exists() else None)
+
+                result = race_portal_variants(portal_url, mac_address, tracker, on_status=on_status)
+
+                if result["ok"]:
+                    winner = urllib.parse.urlparse(result["url"])
+                    port = winner.port or {"http": 80, "https": 443}.get(winner.scheme)
+                    # Update UI on success
+                    self.root.after(0, lambda portal=result["url"]: self.portal_entry.delete(0, tk.END))
+                    self.root.after(0, lambda portal=result["url"]: self.portal_entry.insert(0, portal.rstrip('/')))
+                    self.root.after(0, lambda: progress_window.destroy())
+                    self.root.after(0, lambda: messagebox.showinfo("Connection Test", 
+                        f"✅ Portal is reachable!\n\n"
+                        f"Server: {result['url']}\n"
+                        f"Scheme/port: {winner.scheme} / {port}\n"
+                        f"Timeout: {result['tier']} ({result['elapsed']}s total)\n"
+                        f"Response: {result['status']}"))
+                    return
                 
                 # All attempts failed
+                last_error = f"Last answer: HTTP {result['status']}" if result["status"] else f"Last error: {result['error']}"
                 self.root.after(0, lambda: progress_window.destroy())
                 self.root.after(0, lambda: messagebox.showerror("Connection Test", 
-                    "❌ Cannot connect to portal after multiple attempts.\n\n"
+                    f"❌ Cannot connect to portal ({result['elapsed']}s).\n"
+                    f"{last_error}\n\n"
                     "Possible issues:\n"
                     "• Server is down or very slow\n"
                     "• DNS resolution problems\n"
@@ -989,9 +4818,7 @@ class NewUserWindow:
         if not portal_url.endswith('/'):
             portal_url += '/'
 
-        user_data = {"portal_url": portal_url, "mac_address": mac_address}
-        with open(os.path.join(CREDENTIALS_DIR, f"{username}.json"), "w") as f:
-            json.dump(user_data, f)
+        ProfileStore(CREDENTIALS_DIR).add(username, portal_url, mac_address)
 
         messagebox.showinfo("Success", f"User '{username}' saved successfully!")
         self.root.destroy()
@@ -1352,14 +5179,22 @@ class WindowsIPTVPlayer:
         # Initialize favorites for this user profile
         self.favorites = self.load_favorites()
 
-        # Initialize optimized components
-        self.requests = OptimizedRequests()
-        self.cache_manager = CacheManager(CACHE_DIR)  # Only for channel cache
-        self.token_cache = TokenCache(ttl=300)  # 5 minutes
-        self.connection_manager = ConnectionManager(self) # Enhanced connection management
+        # Headless engine - portal, cache, search and playback logic lives there
+        self.engine = IPTVEngine(self.portal_url, self.mac_address)
+        threading.Thread(target=self.cleanup_orphaned_processes, daemon=True).start()
+        self.engine.events.on("progress", lambda message: self.update_progress(message))
+        self.engine.events.on("channels_loaded", self.on_channels_loaded)
+        self.profile_state = self.engine.profile_state
+        self.latency_tracker = self.engine.latency_tracker
+        self.requests = self.engine.requests
+        self.parse_pool = self.engine.parse_pool
+        self.cache_manager = self.engine.cache_manager
+        self.module_prober = MagModuleProber(self.requests)
+        self.response_cache = ResponseCache(os.path.join(CACHE_DIR, "responses"))  # Provider analysis downloads
+        
+        self.playlist_server = None  # Local M3U/stream proxy (📡 button)
         
         # Performance tracking
-        self.search_cache = {}
         self.last_search = ""
         self.search_delay_id = None
         
@@ -1367,10 +5202,6 @@ class WindowsIPTVPlayer:
         self.loading_progress = None
         self.cancel_loading = False
         
-        # Check FFmpeg installation
-        if not self.check_ffmpeg_installation():
-            return  # Don't continue if FFmpeg is missing
-
         # ===== CLEAN COMPACT GUI SETUP =====
         
         # === HEADER SECTION ===
@@ -1442,6 +5273,22 @@ class WindowsIPTVPlayer:
                                     bg="#607D8B", fg="white", font=("Arial", 9), width=8)
         self.clear_button.pack(side=tk.LEFT, padx=3)
 
+        # Stream availability (StreamProber) - probe the list in view, then filter/sort by the results
+        self.probe_button = tk.Button(filter_buttons_frame, text="🩺 Probe Streams",
+                                      command=self.toggle_stream_probe,
+                                      bg="#009688", fg="white", font=("Arial", 9), width=14)
+        self.probe_button.pack(side=tk.LEFT, padx=3)
+
+        self.hide_dead_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(filter_buttons_frame, text="Hide dead", variable=self.hide_dead_var,
+                       command=self.update_channel_list, font=("Arial", 9)).pack(side=tk.LEFT, padx=3)
+
+        self.sort_health_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(filter_buttons_frame, text="Sort by health", variable=self.sort_health_var,
+                       command=self.update_channel_list, font=("Arial", 9)).pack(side=tk.LEFT, padx=3)
+        self.probe_running = False
+        self.cancel_probe = False
+
         # === CHANNEL LIST SECTION ===
         list_frame = tk.LabelFrame(self.root, text="📺 Channel List", 
                                 font=("Arial", 10, "bold"), fg="darkgreen")
@@ -1487,6 +5334,12 @@ class WindowsIPTVPlayer:
                                     bg="#FF9800", fg="white", font=("Arial", 10, "bold"),
                                     width=15, height=1, relief=tk.RAISED)
         self.export_button.pack(side=tk.LEFT, padx=5)
+
+        self.playlist_server_button = tk.Button(buttons_row1, text="📡 Playlist Server",
+                                    command=self.toggle_playlist_server,
+                                    bg="#009688", fg="white", font=("Arial", 10, "bold"),
+                                    width=15, height=1, relief=tk.RAISED)
+        self.playlist_server_button.pack(side=tk.LEFT, padx=5)
         
         
         
@@ -1559,6 +5412,12 @@ class WindowsIPTVPlayer:
                                     width=15)
         self.controls_button.pack(side=tk.LEFT, padx=3)
 
+        self.worker_parse_var = tk.BooleanVar(value=self.parse_pool.enabled)
+        self.worker_parse_check = tk.Checkbutton(mgmt_buttons_row, text="⚙️ Parse in worker process",
+                                                 variable=self.worker_parse_var,
+                                                 command=self.toggle_worker_parsing, font=("Arial", 9))
+        self.worker_parse_check.pack(side=tk.LEFT, padx=3)
+
         # === STATUS BAR ===
         self.status_var = StringVar(value="Ready - Direct Play Mode | Select a channel and click Play")
         self.status_bar = tk.Label(self.root, textvariable=self.status_var, 
@@ -1571,7 +5430,8 @@ class WindowsIPTVPlayer:
         self.channels = []
         self.filtered_channels = []
         
-        # Try to load channels from permanent cache
+        # Tool check and cache load run off the UI thread so the window shows immediately
+        threading.Thread(target=self.check_ffmpeg_installation, daemon=True).start()
         self.load_channels_with_cache()
         
         
@@ -1584,8 +5444,7 @@ class WindowsIPTVPlayer:
             
     def get_profile_id(self):
         # Unique ID for each user profile
-        key = f"{self.portal_url}|{self.mac_address}"
-        return hashlib.md5(key.encode()).hexdigest()
+        return get_profile_id(self.portal_url, self.mac_address)
 
     def get_favorites_path(self):
         return os.path.join(CREDENTIALS_DIR, f"{self.get_profile_id()}_favorites.json")
@@ -1653,21 +5512,16 @@ class WindowsIPTVPlayer:
         if hasattr(self, 'playback_active'):
             self.playback_active = False
         
-        # Terminate running processes if any
-        processes_to_check = ['download_process', 'playback_process']
-        for process_name in processes_to_check:
-            if hasattr(self, process_name) and getattr(self, process_name) and getattr(self, process_name).poll() is None:
-                try:
-                    getattr(self, process_name).terminate()
-                except:
-                    pass
-        
-        # Close requests session
-        try:
-            self.requests.close()
-        except:
-            pass
+        # Terminate every player/downloader we started
+        PROCESS_REGISTRY.terminate_all()
         
+        # Persist learned latency, close requests session and parse workers
+        self.cancel_probe = True
+        if self.playlist_server:
+            self.playlist_server.stop()
+        self.engine.player.stop()
+        self.engine.close()
+
         # ✅ NEW: Proper cleanup sequence
         try:
             # Withdraw window first (hide it)
@@ -1699,7 +5553,7 @@ class WindowsIPTVPlayer:
                             "This may take a few moments.\n\n"
                             "Continue?"):
             # Temporarily clear search cache
-            self.search_cache.clear()
+            self.engine.set_channels([])
             self.channels = []
             self.filtered_channels = []
             self.update_channel_list()
@@ -1730,22 +5584,36 @@ class WindowsIPTVPlayer:
     
     
 
+    def on_channels_loaded(self, channels, source):
+        """Keep the channel count shown in the user menu current"""
+        if source == "portal":
+            ProfileStore(CREDENTIALS_DIR).record_channel_count(self.portal_url, self.mac_address, len(channels))
+
     def load_channels_with_cache(self):
-        """Try cache first, then fetch if needed"""
-        cached_channels = self.cache_manager.load_from_cache(self.portal_url, self.mac_address)
-        
-        if cached_channels:
-            self.channels = cached_channels
-            self.filtered_channels = self.channels
-            self.update_channel_list()
-            
-            # Show cache info in status
-            cache_info = self.cache_manager.get_cache_info(self.portal_url, self.mac_address)
-            self.status_var.set(f"📁 Loaded {len(cached_channels)} channels from permanent cache (Created: {cache_info.get('created', 'Unknown')})")
-            print(f"💾 Using permanent cache with {len(cached_channels)} channels")
-        else:
-            self.status_var.set("No permanent cache found - click 'Fetch Channels' to load and cache")
-            print("📁 No permanent cache - ready to fetch fresh channels")
+        """Try cache first, then fetch if needed - the cache is read on a background thread"""
+        self.status_var.set("📁 Loading cached channels...")
+
+        def load():
+            cached_channels = self.engine.load_cached_channels()
+            cache_info = self.engine.store.cache_info() if cached_channels else {}
+            self.root.after(0, lambda: show(cached_channels, cache_info))
+
+        def show(cached_channels, cache_info):
+            if self.channels:
+                return  # A fetch finished first - keep the fresher list
+            if cached_channels:
+                self.channels = cached_channels
+                self.filtered_channels = self.channels
+                self.update_channel_list()  # Batched inserts - first rows show right away
+
+                # Show cache info in status
+                self.status_var.set(f"📁 Loaded {len(cached_channels)} channels from permanent cache (Created: {cache_info.get('created', 'Unknown')})")
+                print(f"💾 Using permanent cache with {len(cached_channels)} channels")
+            else:
+                self.status_var.set("No permanent cache found - click 'Fetch Channels' to load and cache")
+                print("📁 No permanent cache - ready to fetch fresh channels")
+
+        threading.Thread(target=load, daemon=True).start()
 
     def show_loading_progress(self):
         """Show loading progress window"""
@@ -1795,392 +5663,42 @@ class WindowsIPTVPlayer:
             return
         
         # ✅ PRE-WARM CONNECTION
-        warmup_thread = threading.Thread(target=self.warmup_connection, daemon=True)
+        warmup_thread = threading.Thread(target=self.engine.portal.warmup_connection, daemon=True)
         warmup_thread.start()
         
         self.show_loading_progress()
         
         self.cancel_loading = False
-        loading_thread = threading.Thread(target=self._fetch_channels_background, daemon=True)
-        loading_thread.start()
-
-    def _fetch_channels_background(self):
-        """OPTIMIZED background thread for fetching channels - FASTER for new users"""
-        try:
-            # ✅ REDUCED endpoint list - only test most common ones first
-            priority_endpoints = [
-                # Most common MAG endpoints (test these first)
-                {
-                    "auth": f"{self.portal_url}server/load.php?type=stb&action=handshake&mac={self.mac_address}",
-                    "channels": f"{self.portal_url}server/load.php?type=itv&action=get_all_channels&mac={self.mac_address}&JsHttpRequest=1-xml"
-                },
-                {
-                    "auth": f"{self.portal_url}stalker_portal/server/load.php?type=stb&action=handshake&mac={self.mac_address}",
-                    "channels": f"{self.portal_url}stalker_portal/server/load.php?type=itv&action=get_all_channels&mac={self.mac_address}&JsHttpRequest=1-xml"
-                },
-                {
-                    "auth": f"{self.portal_url}portal.php?type=stb&action=handshake&mac={self.mac_address}",
-                    "channels": f"{self.portal_url}portal.php?type=itv&action=get_all_channels&mac={self.mac_address}&JsHttpRequest=1-xml"
-                },
-            ]
-
-            # ✅ FASTER timeout - reduced from 10s to 5s
-            fast_timeout = (5, 8)  # 5s connect, 8s read
-            
-            headers = {
-                "Referer": self.portal_url + "index.html",
-                "Origin": self.portal_url.rstrip('/'),
-                "Accept-Language": "en-US,en;q=0.9",
-                "Pragma": "no-cache",
-                "User-Agent": "Mozilla/5.0 (QtEmbedded; U; Linux; C)"
-            }
-
-            if self.cancel_loading:
-                return
-
-            self.requests.session.headers.update(headers)
-            successful_endpoints = None
-            auth_response = None
-
-            # ✅ TRY PRIORITY ENDPOINTS FIRST with faster timeout
-            for endpoint_idx, endpoints in enumerate(priority_endpoints):
-                if self.cancel_loading:
-                    return
-
-                self.update_progress(f"Testing endpoint {endpoint_idx + 1}/{len(priority_endpoints)}...")
-                print(f"🔍 Testing priority endpoint {endpoint_idx + 1}: {endpoints['auth']}")
-
-                try:
-                    self.update_progress(f"Quick auth test ({fast_timeout[0]}s)...")
-                    auth_response = self.requests.session.get(endpoints["auth"], timeout=fast_timeout)
-                    
-                    if auth_response.status_code == 200:
-                        print(f"✅ FAST authentication successful with endpoint {endpoint_idx + 1}")
-                        successful_endpoints = endpoints
-                        break  # SUCCESS - stop trying other endpoints
-                    else:
-                        print(f"❌ Auth failed with status {auth_response.status_code}")
-                        
-                except requests.exceptions.ConnectTimeout:
-                    print(f"⏰ Fast connect timeout ({fast_timeout[0]}s)")
-                    continue
-                except requests.exceptions.ReadTimeout:
-                    print(f"⏰ Fast read timeout ({fast_timeout[1]}s)")
-                    continue
-                except Exception as e:
-                    print(f"❌ Fast auth error: {e}")
-                    continue
-
-            # ✅ IF PRIORITY ENDPOINTS FAIL, try extended list with longer timeout
-            if not successful_endpoints:
-                print("🔍 Priority endpoints failed, trying extended list...")
-                
-                extended_endpoints = [
-                    # Add your remaining endpoints here with longer timeout
-                    {
-                        "auth": f"{self.portal_url}c/",
-                        "channels": f"{self.portal_url}c/?get=channels&mac={self.mac_address}"
-                    },
-                    # Xtream Codes API style  
-                    {
-                        "auth": f"{self.portal_url}player_api.php?username={self.mac_address}&password=&action=get_live_categories",
-                        "channels": f"{self.portal_url}player_api.php?username={self.mac_address}&password=&action=get_live_streams"
-                    },
-                ]
-                
-                extended_timeout = (8, 12)  # Slightly longer for fallback
-                
-                for endpoint_idx, endpoints in enumerate(extended_endpoints):
-                    if self.cancel_loading:
-                        return
-                    
-                    self.update_progress(f"Extended test {endpoint_idx + 1}...")
-                    
-                    # Handle special endpoint types
-                    if "player_api.php" in endpoints['auth']:
-                        try:
-                            response = self.requests.session.get(endpoints["channels"], timeout=extended_timeout)
-                            if response.status_code == 200:
-                                data = response.json()
-                                if isinstance(data, list) and len(data) > 0:
-                                    channels = self.parse_xtream_channels(data)
-                                    if channels:
-                                        self.root.after(0, lambda: self._update_channels_ui(channels))
-                                        return
-                        except Exception as e:
-                            print(f"❌ Xtream API failed: {e}")
-                            continue
-                    
-                    # Regular auth test
-                    try:
-                        auth_response = self.requests.session.get(endpoints["auth"], timeout=extended_timeout)
-                        if auth_response.status_code == 200:
-                            successful_endpoints = endpoints
-                            break
-                    except Exception as e:
-                        continue
-
-            if not successful_endpoints:
-                self.show_error_threadsafe("Authentication failed with all endpoints.\n\n"
-                                        "This may be due to:\n• Server being offline\n• Incorrect MAC address\n• Network connectivity issues")
-                return
-
-            if self.cancel_loading:
-                return
-
-            # ✅ EXTRACT TOKEN QUICKLY
-            try:
-                auth_data = auth_response.json()
-                token = auth_data.get('js', {}).get('token', '') or auth_data.get('token', '')
-            except:
-                token = ''
-
-            # ✅ BUILD CHANNELS URL
-            channels_url = successful_endpoints["channels"]
-            if token:
-                separator = "&" if "?" in channels_url else "?"
-                channels_url += f"{separator}token={token}"
-
-            self.update_progress("Fetching channels...")
-            print(f"📺 Using channels URL: {channels_url}")
-
-            # ✅ FETCH CHANNELS with Robust Retry Logic for 10054 Errors
-            channels_response = None
-            last_error = None
-            
-            # Define retry strategies
-            fetch_strategies = [
-                # Strategy 1: Standard keep-alive
-                {"headers": {}, "timeout": (5, 15)},
-                # Strategy 2: Force close connection (fixes 10054 errors)
-                {"headers": {"Connection": "close"}, "timeout": (10, 30)},
-                # Strategy 3: Browser User-Agent + Close
-                {"headers": {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                    "Connection": "close"
-                }, "timeout": (10, 30)}
-            ]
-
-            for i, strategy in enumerate(fetch_strategies):
-                try:
-                    if self.cancel_loading: return
-                    
-                    if i > 0:
-                        self.update_progress(f"Retrying fetch (Strategy {i+1})...")
-                        print(f"🔄 Retry strategy {i+1}: {strategy['headers']}")
-                        # Update headers for this attempt
-                        self.requests.session.headers.update(strategy["headers"])
-                    
-                    channels_response = self.requests.session.get(channels_url, timeout=strategy['timeout'])
-                    
-                    if channels_response.status_code == 200:
-                        print(f"✅ Channels fetched successfully using strategy {i+1}")
-                        break
-                    else:
-                        print(f"❌ Strategy {i+1} failed with status {channels_response.status_code}")
-                        
-                except Exception as e:
-                    print(f"❌ Strategy {i+1} error: {e}")
-                    last_error = e
-                    time.sleep(1) # Short wait before retry
-                    continue
-
-            if not channels_response or channels_response.status_code != 200:
-                error_msg = str(last_error) if last_error else "Unknown error"
-                self.show_error_threadsafe(f"Failed to get channels after retries.\nLast error: {error_msg}")
-                return
-
-            # ✅ PROCESS RESPONSE QUICKLY
-            try:
-                response_text = channels_response.text.strip()
-                print(f"🔍 Response preview: {response_text[:200]}...")
-
-                if response_text.startswith('{') or response_text.startswith('['):
-                    response_data = channels_response.json()
-                    if isinstance(response_data, dict):
-                        # ✅ FIXED: Handle both list and dict formats for 'js'
-                        js_section = response_data.get("js")
-                        if isinstance(js_section, list):
-                            # Format: {"js": [...channels...]}
-                            data = js_section
-                        elif isinstance(js_section, dict):
-                            # Format: {"js": {"data": [...channels...]}}
-                            data = js_section.get("data", [])
-                        else:
-                            # Format: {"data": [...channels...]} or flat dict
-                            data = response_data.get("data", [])
-                    elif isinstance(response_data, list):
-                        data = response_data
-                    else:
-                        data = []
-                else:
-                    self.show_error_threadsafe("Unexpected response format from server")
-                    return
-
-                # ✅ NEW: Run diagnosis if empty
-                if not data or len(data) == 0:
-                    diagnosis = self.diagnose_server_response(response_text, self.portal_url, self.mac_address)
-                    
-                    error_message = (
-                        f"❌ Empty Channel List\n\n"
-                        f"Server: {self.portal_url}\n"
-                        f"MAC: {self.mac_address}\n\n"
-                        f"Response Status: {'Valid JSON' if diagnosis['response_valid'] else 'Invalid'}\n"
-                        f"Likely Cause: {diagnosis['likely_cause']}\n\n"
-                        f"What to do:\n"
-                        f"• Contact your provider to verify subscription\n"
-                        f"• Check if MAC address needs activation\n"
-                        f"• Ask for correct portal URL\n"
-                        f"• Request channel list manually from provider"
-                    )
-                    
-                    self.show_error_threadsafe(error_message)
-                    return
-
-                if not data:
-                    self.show_error_threadsafe("No channels found in server response")
-                    return
-
-                self.update_progress(f"Processing {len(data)} channels...")
-
-                # ✅ OPTIMIZED CHANNEL PROCESSING - process in larger batches
-                channels = []
-                from urllib.parse import urlparse
-                parsed_portal = urlparse(self.portal_url)
-                portal_domain = parsed_portal.netloc
-
-                # Process all at once instead of batches for speed
-                for ch in data:
-                    if self.cancel_loading:
-                        return
-                    
-                    if isinstance(ch, dict):
-                        name = ch.get("name", ch.get("title", "Unknown Channel"))
-                        cmd = ch.get("cmd", ch.get("url", ""))
-                        if cmd:
-                            original_cmd = cmd.replace("ffmpeg ", "").strip()
-                            
-                            # Build URL efficiently
-                            if original_cmd.startswith("http://localhost"):
-                                stream_url = original_cmd.replace("http://localhost", f"http://{portal_domain}")
-                            elif original_cmd.startswith("/"):
-                                stream_url = f"http://{portal_domain}{original_cmd}"
-                            elif original_cmd.startswith(("http://", "https://")):
-                                stream_url = original_cmd
-                            else:
-                                stream_url = f"http://{portal_domain}/{original_cmd}"
-                            
-                            channels.append((name, stream_url, original_cmd))
+        loading_thread = threading.Thread(target=self._fetch_channels_background, daemon=True)
+        loading_thread.start()
 
+    def _fetch_channels_background(self):
+        """Background thread - the engine fetches, the UI is updated on the main thread"""
+        try:
+            channels = self.engine.fetch_channels(cancelled=lambda: self.cancel_loading)
+            if channels is not None:
                 self.root.after(0, lambda: self._update_channels_ui(channels))
-
-            except Exception as e:
-                print(f"❌ Channel processing error: {e}")
-                self.show_error_threadsafe(f"Error processing channels: {str(e)}")
-
-        except Exception as e:
-            self.show_error_threadsafe(f"Error: {str(e)}")
+        except EngineError as e:
+            self.show_error_threadsafe(str(e))
 
 
             
             
     def detect_provider_type(self, portal_url):
         """Detect provider type from URL to prioritize endpoints"""
-        url_lower = portal_url.lower()
-
-        # Check for delta8k specifically first
-        if "delta8k" in url_lower:
-            print("🔍 Detected Delta8k provider - using direct URLs")
-            return "delta8k"
-        if "stalker" in url_lower:
-            return "stalker"
-        elif any(keyword in url_lower for keyword in ["xtream", "api", "panel"]):
-            return "xtream"
-        elif url_lower.endswith("/c/"):
-            return "cdn"
-        else:
-            return "standard"
+        return self.engine.portal.detect_provider_type(portal_url)
 
-    def get_prioritized_endpoints(self):
-        """Get endpoints in priority order based on provider type"""
-        provider_type = self.detect_provider_type(self.portal_url)
-        
-        if provider_type == "stalker":
-            return [
-                {
-                    "auth": f"{self.portal_url}stalker_portal/server/load.php?type=stb&action=handshake&mac={self.mac_address}",
-                    "channels": f"{self.portal_url}stalker_portal/server/load.php?type=itv&action=get_all_channels&mac={self.mac_address}&JsHttpRequest=1-xml"
-                },
-                {
-                    "auth": f"{self.portal_url}server/load.php?type=stb&action=handshake&mac={self.mac_address}",
-                    "channels": f"{self.portal_url}server/load.php?type=itv&action=get_all_channels&mac={self.mac_address}&JsHttpRequest=1-xml"
-                }
-            ]
-        elif provider_type == "xtream":
-            return [
-                {
-                    "auth": f"{self.portal_url}player_api.php?username={self.mac_address}&password=&action=get_live_categories",
-                    "channels": f"{self.portal_url}player_api.php?username={self.mac_address}&password=&action=get_live_streams"
-                }
-            ]
-        elif provider_type == "cdn":
-            return [
-                {
-                    "auth": f"{self.portal_url}",
-                    "channels": f"{self.portal_url}?get=channels&mac={self.mac_address}"
-                }
-            ]
-        else:
-            return [
-                {
-                    "auth": f"{self.portal_url}server/load.php?type=stb&action=handshake&mac={self.mac_address}",
-                    "channels": f"{self.portal_url}server/load.php?type=itv&action=get_all_channels&mac={self.mac_address}&JsHttpRequest=1-xml"
-                }
-            ]
-            
-            
-    def warmup_connection(self):
-        """Pre-warm connection to reduce first request latency"""
-        try:
-            # Quick HEAD request to warm up DNS and TCP connection
-            warmup_url = self.portal_url.rstrip('/')
-            self.requests.session.head(warmup_url, timeout=3)
-            print("🔥 Connection warmed up")
-        except:
-            pass  # Ignore warmup failures
-            
-            
-            
     def parse_html_channel_response(self, html_content, original_url):
         """Parse HTML/JavaScript response to extract channel data - FIXED MAC EXTRACTION"""
         try:
             print("🔍 Attempting to parse MAG STB HTML/JavaScript channel data...")
             
-            # ✅ FIXED: Better MAC address extraction
-            import re
-            
-            # Look for MAC in various formats within the HTML
-            mac_patterns = [
-                # Direct MAC patterns
-                r'mac\s*[=:]\s*["\']([0-9a-fA-F:]{17})["\']',  # Standard MAC format
-                r'stb\.mac\s*=\s*["\']([0-9a-fA-F:]{17})["\']',
-                r'device\s*[=:]\s*["\']([0-9a-fA-F:]{17})["\']',
-                
-                # MAC without quotes
-                r'mac\s*[=:]\s*([0-9a-fA-F:]{17})',
-                r'stb\.mac\s*=\s*([0-9a-fA-F:]{17})',
-                
-                # MAC in URL parameters
-                r'mac=([0-9a-fA-F:]{17})',
-            ]
-            
+            # ✅ FIXED: Better MAC address extraction (mac=, stb.mac =, device: ... in one pattern)
             extracted_mac = None
-            for pattern in mac_patterns:
-                match = re.search(pattern, html_content, re.IGNORECASE)
-                if match:
-                    extracted_mac = match.group(1)
-                    print(f"✅ Successfully extracted MAC: {extracted_mac}")
-                    break
+            match = MAC_IN_PAGE_RE.search(html_content, 0, min(len(html_content), MAX_SCAN_CHARS))
+            if match:
+                extracted_mac = match.group(1)
+                print(f"✅ Successfully extracted MAC: {extracted_mac}")
             
             # ✅ FALLBACK: If no MAC found in HTML, use our original MAC
             if not extracted_mac or len(extracted_mac) != 17:
@@ -2192,17 +5710,15 @@ class WindowsIPTVPlayer:
             print("💡 Skipping module approach to prevent infinite loops")
             
             # Instead, try to find any embedded data in the HTML itself
-            channels = []
+            # Method 1: Extract from JavaScript variables (balanced literal scanner)
+            channels = self.extract_from_js_variables(html_content)
             
-            # Method 1: Extract from JavaScript variables
-            channels.extend(self.extract_from_js_variables(html_content))
+            # Method 2: one tokenizer pass for script objects and player calls
+            channels.extend(self.channels_from_pairs(self.parse_pool.run(scan_channel_pairs, html_content)))
             
-            # Method 2: Extract from JSON embedded in HTML  
+            # Method 3: Extract from JSON embedded in HTML attributes
             channels.extend(self.extract_from_embedded_json(html_content))
             
-            # Method 3: Extract from script tags
-            channels.extend(self.extract_from_script_tags(html_content))
-            
             # Remove duplicates
             unique_channels = []
             seen_names = set()
@@ -2230,133 +5746,38 @@ class WindowsIPTVPlayer:
         
     def extract_channels_via_mag_modules(self, mac_address):
         """Extract channels via MAG STB external module system"""
+        print("🔍 Attempting MAG module-based channel extraction...")
+        return self.probe_mag_endpoints(mac_address, modules=True, channel_lists=True)
+
+    def probe_mag_endpoints(self, mac_address, modules=True, channel_lists=True, budget=None):
+        """Probe MAG module / channel-list endpoints concurrently, first parsed result wins"""
         try:
-            print("🔍 Attempting MAG module-based channel extraction...")
-            
-            # Common MAG modules that contain channel data
-            modules_to_try = [
-                'tv',           # Main TV module
-                'itv',          # IPTV module
-                'live_tv',      # Live TV module
-                'channels',     # Direct channels module
-                'player',       # Player module
-                'main_menu',    # Main menu module
-                'epg',          # EPG module (sometimes has channel list)
-                'favorites',    # Favorites module
-                'all_channels', # All channels module
-                'channel_list', # Channel list module
-            ]
-            
-            for module_name in modules_to_try:
-                try:
-                    # Try the external module endpoint
-                    module_url = f"{self.portal_url}server/api/ext_module.php?name={module_name}&mac={mac_address}"
-                    print(f"🔍 Trying MAG module: {module_name}")
-                    
-                    response = self.requests.session.get(module_url, timeout=(15, 30))
-                    
-                    if response.status_code == 200:
-                        content = response.text.strip()
-                        
-                        if content and len(content) > 100:  # Reasonable content length
-                            print(f"✅ Got response from module '{module_name}': {len(content)} chars")
-                            
-                            # Try to extract channel data from module response
-                            channels = self.parse_mag_module_response(content, module_name)
-                            if channels:
-                                print(f"✅ Successfully extracted {len(channels)} channels from module '{module_name}'")
-                                return channels
-                        else:
-                            print(f"⚠️ Module '{module_name}' returned empty/small response")
-                    else:
-                        print(f"❌ Module '{module_name}' failed with status {response.status_code}")
-                        
-                except Exception as e:
-                    print(f"❌ Module '{module_name}' error: {e}")
-                    continue
-            
-            # If direct modules don't work, try alternative MAG endpoints
-            return self.try_alternative_mag_endpoints(mac_address)
-            
+            candidates = build_mag_probe_candidates(self.portal_url, mac_address,
+                                                    modules=modules, channel_lists=channel_lists)
+            channels, label = self.module_prober.probe(
+                candidates, self.parse_probed_mag_content, budget=budget,
+                stop_check=lambda: getattr(self, "cancel_loading", False))
+            return channels
         except Exception as e:
             print(f"❌ MAG module extraction error: {e}")
             return []
+
+    def parse_probed_mag_content(self, content, label):
+        """Parse any MAG probe response (JSON, JavaScript, HTML or mixed content)"""
+        channels = self.parse_mag_module_response(content, label)
+        if not channels and not content.startswith('<'):
+            channels = self.extract_from_complex_content(content)
+        return channels
         
         
+
     def try_alternative_mag_endpoints(self, mac_address):
         """Try alternative MAG STB endpoints"""
-        try:
-            print("🔍 Trying alternative MAG endpoints...")
-            
-            alternative_endpoints = [
-                # Direct portal endpoints
-                f"{self.portal_url}portal.php?type=itv&action=get_all_channels&mac={mac_address}",
-                f"{self.portal_url}portal.php?type=itv&action=get_ordered_list&mac={mac_address}",
-                
-                # Server load endpoints
-                f"{self.portal_url}server/load.php?type=itv&action=get_all_channels&mac={mac_address}&JsHttpRequest=1-xml",
-                f"{self.portal_url}server/load.php?type=itv&action=get_ordered_list&mac={mac_address}",
-                
-                # Alternative server paths
-                f"{self.portal_url}c/server/load.php?type=itv&action=get_all_channels&mac={mac_address}&JsHttpRequest=1-xml",
-                f"{self.portal_url}stalker_portal/server/load.php?type=itv&action=get_all_channels&mac={mac_address}&JsHttpRequest=1-xml",
-                
-                # Direct API endpoints
-                f"{self.portal_url}api/channels?mac={mac_address}",
-                f"{self.portal_url}api/itv/get_all_channels?mac={mac_address}",
-                
-                # Web interface endpoints
-                f"{self.portal_url}tv/index.php?mac={mac_address}",
-                f"{self.portal_url}itv/index.php?mac={mac_address}",
-            ]
-            
-            for endpoint in alternative_endpoints:
-                try:
-                    print(f"🔍 Trying: {endpoint}")
-                    response = self.requests.session.get(endpoint, timeout=(10, 20))
-                    
-                    if response.status_code == 200:
-                        content = response.text.strip()
-                        
-                        # Try to parse as JSON
-                        if content.startswith('{') or content.startswith('['):
-                            try:
-                                data = response.json()
-                                
-                                # Handle different JSON structures
-                                if isinstance(data, dict):
-                                    channel_data = data.get("js", {}).get("data", []) or data.get("data", []) or data.get("channels", [])
-                                elif isinstance(data, list):
-                                    channel_data = data
-                                else:
-                                    continue
-                                
-                                if channel_data:
-                                    print(f"✅ Found {len(channel_data)} channels in alternative endpoint")
-                                    channels = self.process_mag_channel_data(channel_data)
-                                    if channels:
-                                        return channels
-                                        
-                            except:
-                                continue
-                        
-                        # Try HTML parsing
-                        elif "<!DOCTYPE" in content or "<html" in content.lower():
-                            channels = self.extract_from_html_structure(content)
-                            if channels:
-                                return channels
-                                
-                except Exception as e:
-                    print(f"❌ Alternative endpoint failed: {e}")
-                    continue
-            
-            return []
-            
-        except Exception as e:
-            print(f"❌ Alternative MAG endpoints error: {e}")
-            return []
+        print("🔍 Trying alternative MAG endpoints...")
+        return self.probe_mag_endpoints(mac_address, modules=False, channel_lists=True)
         
         
+
     def parse_mag_module_response(self, content, module_name):
         """Parse response from MAG external module"""
         try:
@@ -2480,7 +5901,7 @@ class WindowsIPTVPlayer:
                     js_url = f"{self.portal_url}c/{js_file}"
                     print(f"🔍 Trying to load: {js_url}")
                     
-                    response = self.requests.session.get(js_url, timeout=(5, 10))
+                    response = self.fetch_for_analysis(js_url)
                     if response.status_code == 200:
                         js_content = response.text
                         
@@ -2508,7 +5929,7 @@ class WindowsIPTVPlayer:
             for endpoint in init_endpoints:
                 try:
                     print(f"🔍 Trying: {endpoint}")
-                    response = self.requests.session.get(endpoint, timeout=(5, 10))
+                    response = self.fetch_for_analysis(endpoint)
                     
                     if response.status_code == 200:
                         content = response.text.strip()
@@ -2543,80 +5964,11 @@ class WindowsIPTVPlayer:
     def extract_channels_from_js_content(self, js_content):
         """Extract channel data from JavaScript content - FIXED FOR PLAYER.JS"""
         try:
-            import re
-            channels = []
-            
             print("🔍 Analyzing JavaScript content for channel data...")
             
-            # Enhanced patterns specifically for MAG STB player.js files
-            patterns = [
-                # Look for channel URLs in various formats
-                r'["\']((https?://[^"\']+\.(?:ts|m3u8|mp4)[^"\']*?))["\']',
-                r'["\']((rtmp://[^"\']+))["\']',
-                r'["\']((http://[^"\']+/ch/[^"\']+))["\']',
-                
-                # Channel objects with name and URL
-                r'{\s*["\']?name["\']?\s*:\s*["\']([^"\']+)["\'].*?["\']?(?:url|cmd|stream)["\']?\s*:\s*["\']([^"\']+)["\']',
-                r'{\s*["\']?title["\']?\s*:\s*["\']([^"\']+)["\'].*?["\']?(?:url|cmd|stream)["\']?\s*:\s*["\']([^"\']+)["\']',
-                
-                # MAG-specific stream commands
-                r'cmd\s*:\s*["\']([^"\']+)["\'].*?name\s*:\s*["\']([^"\']+)["\']',
-                
-                # Channel arrays
-                r'channels\s*=\s*\[(.*?)\]',
-                r'stream_list\s*=\s*\[(.*?)\]',
-                
-                # URL assignments
-                r'stream_url\s*=\s*["\']([^"\']+)["\']',
-                r'channel_url\s*=\s*["\']([^"\']+)["\']',
-                
-                # Function calls with URLs
-                r'play\s*\(\s*["\']([^"\']+)["\']',
-                r'setSource\s*\(\s*["\']([^"\']+)["\']',
-            ]
-            
-            for pattern in patterns:
-                matches = re.findall(pattern, js_content, re.IGNORECASE | re.DOTALL)
-                
-                for match in matches:
-                    if isinstance(match, tuple):
-                        if len(match) == 2:
-                            # Two parts - could be name/url or url/name
-                            part1, part2 = match
-                            
-                            # Determine which is URL and which is name
-                            if any(part1.startswith(proto) for proto in ['http://', 'https://', 'rtmp://']):
-                                url = part1
-                                name = part2 if part2 and len(part2) > 3 else f"Channel {len(channels) + 1}"
-                            elif any(part2.startswith(proto) for proto in ['http://', 'https://', 'rtmp://']):
-                                url = part2
-                                name = part1 if part1 and len(part1) > 3 else f"Channel {len(channels) + 1}"
-                            else:
-                                continue  # Neither is a URL
-                            
-                            # Validate URL
-                            if self.is_valid_stream_url(url) and name:
-                                full_url = self.build_full_url(url)
-                                channels.append((name, full_url, url))
-                        
-                        elif len(match) == 1:
-                            # Single URL
-                            url = match[0]
-                            if self.is_valid_stream_url(url):
-                                name = self.extract_name_from_url(url)
-                                full_url = self.build_full_url(url)
-                                channels.append((name, full_url, url))
-                    
-                    elif isinstance(match, str):
-                        # Single string match
-                        if self.is_valid_stream_url(match):
-                            name = self.extract_name_from_url(match)
-                            full_url = self.build_full_url(match)
-                            channels.append((name, full_url, match))
-            
-            # Try to find channel data in specific MAG player structures
-            mag_channels = self.extract_mag_player_channels(js_content)
-            channels.extend(mag_channels)
+            # One tokenizer pass finds name/url objects, player calls (play, setSource,
+            # gSTB.Play, ...) and bare stream URLs
+            channels = self.channels_from_pairs(self.parse_pool.run(scan_channel_pairs, js_content))
             
             # Remove duplicates and invalid entries
             cleaned_channels = self.clean_channel_list(channels)
@@ -2681,7 +6033,7 @@ class WindowsIPTVPlayer:
             if not html_files:
                 return
             
-            latest_file = max(html_files, key=os.path.getctime)
+            latest_file = max(html_files, key=os.path.getmtime)
             
             print(f"🔍 Analyzing saved HTML file: {latest_file}")
             
@@ -2715,7 +6067,7 @@ class WindowsIPTVPlayer:
                         js_url = js_file
                     
                     print(f"🔍 Trying to load JS file: {js_url}")
-                    response = self.requests.session.get(js_url, timeout=10)
+                    response = self.fetch_for_analysis(js_url, 10)
                     
                     if response.status_code == 200:
                         js_content = response.text
@@ -2739,7 +6091,7 @@ class WindowsIPTVPlayer:
             
             # Get the main STB interface page
             main_url = f"{self.portal_url}c/"
-            response = self.requests.session.get(main_url, timeout=15)
+            response = self.fetch_for_analysis(main_url, 15)
             
             if response.status_code == 200:
                 html_content = response.text
@@ -2779,13 +6131,7 @@ class WindowsIPTVPlayer:
     def save_html_for_detailed_analysis(self, html_content, filename_suffix):
         """Save HTML with detailed analysis markers"""
         try:
-            import os
-            analysis_dir = os.path.join(CACHE_DIR, "html_analysis")
-            os.makedirs(analysis_dir, exist_ok=True)
-            
             timestamp = int(time.time())
-            filename = f"detailed_analysis_{filename_suffix}_{timestamp}.html"
-            filepath = os.path.join(analysis_dir, filename)
             
             # Add analysis markers
             analysis_header = f"""
@@ -2812,9 +6158,8 @@ class WindowsIPTVPlayer:
 
     """
             
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(analysis_header)
-                f.write(html_content)
+            filepath = self.write_analysis_file(f"detailed_analysis_{filename_suffix}", html_content,
+                                                analysis_header)
             
             print(f"💾 Detailed analysis saved: {filepath}")
             
@@ -2929,7 +6274,7 @@ class WindowsIPTVPlayer:
             else:
                 test_url = f"{endpoint}?mac={self.mac_address}"
             
-            response = self.requests.session.get(test_url, timeout=10)
+            response = self.fetch_for_analysis(test_url, 10)
             
             if response.status_code == 200:
                 content = response.text.strip()
@@ -2973,43 +6318,13 @@ class WindowsIPTVPlayer:
             # Try different parsing approaches for various content types
             
             # Method 1: Look for JavaScript-like data structures
-            js_patterns = [
-                r'channels?\s*[=:]\s*(\[.*?\])',
-                r'items?\s*[=:]\s*(\[.*?\])',
-                r'data\s*[=:]\s*(\[.*?\])',
-                r'streams?\s*[=:]\s*(\[.*?\])',
-            ]
-            
-            for pattern in js_patterns:
-                matches = re.findall(pattern, content, re.DOTALL | re.IGNORECASE)
-                for match in matches:
-                    try:
-                        data = json.loads(match)
-                        if isinstance(data, list) and len(data) > 0:
-                            extracted = self.extract_channels_from_json_data(data)
-                            if extracted:
-                                channels.extend(extracted)
-                    except:
-                        continue
+            channels.extend(self.channels_from_objects(self.parse_pool.run(
+                scan_channel_objects, content, {"channel", "channels", "item", "items", "data", "stream", "streams"})))
             
             # Method 2: Look for URL patterns
-            url_patterns = [
-                r'["\']((https?://[^"\']+\.(?:ts|m3u8|mp4)[^"\']*?))["\']',
-                r'["\']((rtmp://[^"\']+))["\']',
-                r'["\']((http://[^"\']+/ch/[^"\']+))["\']',
-            ]
-            
-            for pattern in url_patterns:
-                matches = re.findall(pattern, content, re.IGNORECASE)
-                for match in matches:
-                    if isinstance(match, tuple):
-                        url = match[0]
-                    else:
-                        url = match
-                    
-                    if self.is_valid_stream_url(url):
-                        name = self.extract_name_from_url(url)
-                        channels.append((name, url, url))
+            for name, url in self.parse_pool.run(scan_channel_pairs, content):
+                if self.is_valid_stream_url(url):
+                    channels.append((self.extract_name_from_url(url), url, url))
             
             # Method 3: Look for serialized data or other formats
             # This could be extended based on what format the provider actually uses
@@ -3119,46 +6434,8 @@ class WindowsIPTVPlayer:
     def extract_mag_player_channels(self, js_content):
         """Extract channels from MAG player-specific structures"""
         try:
-            import re
-            channels = []
-            
-            # Look for MAG player channel definitions
-            mag_patterns = [
-                # Player configuration with channels
-                r'player\.(?:config|channels|streams)\s*=\s*(\{.*?\})',
-                r'stb\.player\.(?:config|channels)\s*=\s*(\{.*?\})',
-                
-                # Channel definitions in player
-                r'this\.channels\s*=\s*\[(.*?)\]',
-                r'var\s+channels\s*=\s*\[(.*?)\]',
-                
-                # Stream URLs in player functions
-                r'play\s*\(\s*["\']([^"\']+)["\'].*?["\']([^"\']+)["\']',
-                r'setMedia\s*\(\s*["\']([^"\']+)["\']',
-                
-                # MAG STB specific patterns
-                r'stb\.play\s*\(\s*["\']([^"\']+)["\']',
-                r'gSTB\.Play\s*\(\s*["\']([^"\']+)["\']',
-            ]
-            
-            for pattern in mag_patterns:
-                matches = re.findall(pattern, js_content, re.IGNORECASE | re.DOTALL)
-                for match in matches:
-                    if isinstance(match, tuple) and len(match) >= 2:
-                        url = match[0] if self.is_valid_stream_url(match[0]) else match[1]
-                        name = match[1] if match[0] == url else match[0]
-                        
-                        if self.is_valid_stream_url(url):
-                            if not name or len(name) < 3:
-                                name = self.extract_name_from_url(url)
-                            channels.append((name, self.build_full_url(url), url))
-                    
-                    elif isinstance(match, str):
-                        if self.is_valid_stream_url(match):
-                            name = self.extract_name_from_url(match)
-                            channels.append((name, self.build_full_url(match), match))
-            
-            return channels
+            channels = self.channels_from_pairs(self.parse_pool.run(scan_channel_pairs, js_content))
+            return [channel for channel in channels if is_stream_url(channel[2])]
             
         except Exception as e:
             print(f"❌ MAG player extraction error: {e}")
@@ -3200,20 +6477,24 @@ class WindowsIPTVPlayer:
         
     def is_valid_stream_url(self, url):
         """Check if URL looks like a valid stream URL"""
-        if not url or len(url) < 10:
-            return False
-        
-        # Valid stream URL patterns
-        valid_patterns = [
-            r'^https?://.+\.(?:ts|m3u8|mp4)(?:\?.*)?$',
-            r'^rtmp://.+',
-            r'^https?://.+/ch/.+',
-            r'^https?://.+/stream/.+',
-            r'^https?://.+/live/.+',
-        ]
-        
-        import re
-        return any(re.match(pattern, url, re.IGNORECASE) for pattern in valid_patterns)
+        return is_stream_url(url)
+
+    def channels_from_pairs(self, pairs):
+        """Turn scanned (name, url) pairs into channel tuples"""
+        channels = []
+        for name, url in pairs:
+            url = url.replace("ffmpeg ", "").strip()
+            if not name:
+                name = self.extract_name_from_url(url)
+            channels.append((name, self.build_full_url(url), url))
+        return channels
+
+    def channels_from_objects(self, items):
+        """Feed scanned channel objects ({"name", "cmd"} dicts) to process_mag_channel_data"""
+        for item in items:
+            if not item["name"]:
+                item["name"] = self.extract_name_from_url(item["cmd"].replace("ffmpeg ", "").strip())
+        return self.process_mag_channel_data(items) if items else []
 
     def extract_channels_from_json_data(self, data):
         """Extract channels from JSON data structures"""
@@ -3280,32 +6561,22 @@ class WindowsIPTVPlayer:
         
         
     def extract_from_embedded_json(self, html_content):
-        """Extract channels from embedded JSON data"""
+        """Extract channels from JSON embedded in data-* attributes and input values"""
         try:
-            import re
-            import json
+            import html
             channels = []
             
-            # Look for JSON data in various formats
-            json_patterns = [
-                r'<script[^>]*>\s*(?:var\s+\w+\s*=\s*)?(\{.*?"channels".*?\})\s*[;}]?\s*</script>',
-                r'<script[^>]*>\s*(?:window\.\w+\s*=\s*)?(\{.*?"streams".*?\})\s*[;}]?\s*</script>',
-                r'data-channels=["\'](\{.*?\})["\']',
-                r'data-streams=["\'](\{.*?\})["\']',
-                r'<input[^>]*value=["\'](\{.*?"channels".*?\})["\'][^>]*>',
-            ]
-            
-            for pattern in json_patterns:
-                matches = re.findall(pattern, html_content, re.DOTALL | re.IGNORECASE)
-                for match in matches:
-                    try:
-                        data = json.loads(match)
-                        if 'channels' in data:
-                            channels.extend(self.process_js_channel_data(data['channels']))
-                        elif 'streams' in data:
-                            channels.extend(self.process_js_channel_data(data['streams']))
-                    except:
-                        continue
+            for match in EMBEDDED_JSON_ATTR_RE.finditer(html_content, 0, min(len(html_content), MAX_SCAN_CHARS)):
+                try:
+                    data = json.loads(html.unescape(match.group(1) or match.group(2)))
+                except:
+                    continue
+                if not isinstance(data, dict):
+                    continue
+                if 'channels' in data:
+                    channels.extend(self.process_js_channel_data(data['channels']))
+                elif 'streams' in data:
+                    channels.extend(self.process_js_channel_data(data['streams']))
             
             return channels
             
@@ -3317,38 +6588,16 @@ class WindowsIPTVPlayer:
     def extract_from_script_tags(self, html_content):
         """Extract channels from script tags content"""
         try:
-            import re
             channels = []
             
-            # Extract all script tag contents
-            script_pattern = r'<script[^>]*>(.*?)</script>'
-            scripts = re.findall(script_pattern, html_content, re.DOTALL | re.IGNORECASE)
-            
-            for script in scripts:
-                # Look for channel-like data in script content
-                channel_patterns = [
-                    # addChannel("name", "url")
-                    r'addChannel\s*\(\s*["\']([^"\']+)["\']\s*,\s*["\']([^"\']+)["\']',
-                    
-                    # channel: {name: "...", url: "..."}
-                    r'name\s*:\s*["\']([^"\']+)["\']\s*,\s*url\s*:\s*["\']([^"\']+)["\']',
-                    
-                    # "name": "...", "stream": "..."
-                    r'["\']name["\']\s*:\s*["\']([^"\']+)["\']\s*,.*?["\'](?:stream|url)["\']\s*:\s*["\']([^"\']+)["\']',
-                    
-                    # URLs that look like streams
-                    r'["\']([^"\']*(?:live|stream|channel)[^"\']*)["\'].*?["\']([^"\']*\.(ts|m3u8|mp4)[^"\']*)["\']',
-                ]
-                
-                for pattern in channel_patterns:
-                    matches = re.findall(pattern, script, re.IGNORECASE)
-                    for match in matches:
-                        if len(match) >= 2:
-                            name = match[0].strip()
-                            url = match[1].strip()
-                            
-                            if name and url and (url.startswith('http') or url.startswith('/')):
-                                channels.append((name, self.build_full_url(url), url))
+            for script in SCRIPT_TAG_RE.findall(html_content, 0, min(len(html_content), MAX_SCAN_CHARS)):
+                # Channel-shaped objects in any literal of the script
+                script_channels = self.channels_from_objects(scan_channel_objects(script))
+                if not script_channels:
+                    # addChannel("name", "url") style calls
+                    script_channels = [channel for channel in self.channels_from_pairs(scan_channel_pairs(script))
+                                       if channel[2].startswith(('http', '/'))]
+                channels.extend(script_channels)
             
             return channels
             
@@ -3393,50 +6642,18 @@ class WindowsIPTVPlayer:
             
             return channels
             
-        except Exception as e:
-            print(f"❌ HTML structure extraction error: {e}")
-            return []
-        
-        
-        
-    def extract_from_js_variables(self, html_content):
-        """Extract channels from JavaScript variables"""
-        try:
-            import re
-            channels = []
-            
-            # Common JavaScript patterns for channel data
-            js_patterns = [
-                # var channels = [{name: "Channel", url: "stream_url"}]
-                r'var\s+channels\s*=\s*(\[.*?\]);',
-                r'channels\s*=\s*(\[.*?\]);',
-                r'channelList\s*=\s*(\[.*?\]);',
-                r'streams\s*=\s*(\[.*?\]);',
-                r'playlist\s*=\s*(\[.*?\]);',
-                
-                # window.channels = [...]
-                r'window\.channels\s*=\s*(\[.*?\]);',
-                r'window\.streams\s*=\s*(\[.*?\]);',
-                
-                # this.channels = [...]
-                r'this\.channels\s*=\s*(\[.*?\]);',
-                
-                # JSON.parse("...")
-                r'JSON\.parse\(["\'](\[.*?\])["\']\)',
-            ]
-            
-            for pattern in js_patterns:
-                matches = re.findall(pattern, html_content, re.DOTALL | re.IGNORECASE)
-                for match in matches:
-                    try:
-                        # Try to parse as JSON
-                        import json
-                        data = json.loads(match)
-                        channels.extend(self.process_js_channel_data(data))
-                    except:
-                        continue
-            
-            return channels
+        except Exception as e:
+            print(f"❌ HTML structure extraction error: {e}")
+            return []
+        
+        
+        
+    def extract_from_js_variables(self, html_content):
+        """Extract channels from JavaScript variables"""
+        try:
+            # var channels = [...], window.streams = [...], this.channels = [...], JSON.parse("...")
+            return self.channels_from_objects(self.parse_pool.run(
+                scan_channel_objects, html_content, {"channels", "channellist", "streams", "playlist"}))
             
         except Exception as e:
             print(f"❌ JS variable extraction error: {e}")
@@ -3493,24 +6710,44 @@ class WindowsIPTVPlayer:
     def save_html_for_analysis(self, html_content, original_url):
         """Save HTML content for manual analysis"""
         try:
-            import os
-            analysis_dir = os.path.join(CACHE_DIR, "html_analysis")
-            os.makedirs(analysis_dir, exist_ok=True)
-            
             timestamp = int(time.time())
-            filename = f"html_response_{timestamp}.html"
-            filepath = os.path.join(analysis_dir, filename)
-            
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(f"<!-- Original URL: {original_url} -->\n")
-                f.write(f"<!-- Timestamp: {timestamp} -->\n")
-                f.write(html_content)
+            header = (f"<!-- Original URL: {original_url} -->\n"
+                      f"<!-- Timestamp: {timestamp} -->\n")
+            filepath = self.write_analysis_file("html_response", html_content, header)
             
             print(f"💾 Saved HTML response for analysis: {filepath}")
             print(f"📄 You can examine this file to see the exact HTML structure your server returns")
             
         except Exception as e:
             print(f"❌ Error saving HTML for analysis: {e}")
+
+    def write_analysis_file(self, prefix, html_content, header=""):
+        """Write an analysis file named by content hash - the same page is stored once"""
+        analysis_dir = os.path.join(CACHE_DIR, "html_analysis")
+        os.makedirs(analysis_dir, exist_ok=True)
+        
+        digest = hashlib.sha256(html_content.encode("utf-8", errors="replace")).hexdigest()[:16]
+        filepath = os.path.join(analysis_dir, f"{prefix}_{digest}.html")
+        if os.path.exists(filepath):
+            os.utime(filepath)  # Mark as the latest copy
+        else:
+            with open(filepath, 'w', encoding='utf-8') as f:
+                f.write(header)
+                f.write(html_content)
+        
+        # Keep only the most recent analysis files
+        files = sorted((os.path.join(analysis_dir, name) for name in os.listdir(analysis_dir)),
+                       key=os.path.getmtime, reverse=True)
+        for old_file in files[MAX_ANALYSIS_FILES:]:
+            try:
+                os.remove(old_file)
+            except OSError:
+                pass
+        return filepath
+
+    def fetch_for_analysis(self, url, timeout=(5, 10)):
+        """GET for provider analysis - repeated discovery on the same portal is served from disk"""
+        return self.response_cache.get(self.requests, url, "module", timeout)
     
         
         
@@ -3541,7 +6778,7 @@ class WindowsIPTVPlayer:
             for alt_url in alternative_urls:
                 try:
                     print(f"🔍 Trying alternative endpoint: {alt_url}")
-                    response = self.requests.session.get(alt_url, timeout=(5, 10))
+                    response = self.fetch_for_analysis(alt_url)
                     
                     if response.status_code == 200:
                         content = response.text.strip()
@@ -3593,7 +6830,7 @@ class WindowsIPTVPlayer:
             
             # First, get the main STB page to extract necessary parameters
             stb_url = f"{self.portal_url}c/"
-            response = self.requests.session.get(stb_url, timeout=(15, 30))
+            response = self.fetch_for_analysis(stb_url, (15, 30))
             
             if response.status_code != 200:
                 print(f"❌ STB interface not accessible: {response.status_code}")
@@ -3653,7 +6890,7 @@ class WindowsIPTVPlayer:
             ]:
                 try:
                     print(f"🔐 Trying auth: {auth_url}")
-                    auth_response = self.requests.session.get(auth_url, timeout=(10, 20))
+                    auth_response = self.requests.timed_get(auth_url, "handshake", (10, 20))
                     if auth_response.status_code == 200:
                         print(f"✅ Auth successful: {auth_url}")
                         auth_success = True
@@ -3677,7 +6914,7 @@ class WindowsIPTVPlayer:
             for endpoint in mag_endpoints:
                 try:
                     print(f"🔍 Trying MAG endpoint: {endpoint}")
-                    response = self.requests.session.get(endpoint, timeout=(15, 30))
+                    response = self.fetch_for_analysis(endpoint, (15, 30))
                     
                     if response.status_code == 200:
                         content = response.text.strip()
@@ -3730,71 +6967,9 @@ class WindowsIPTVPlayer:
         
     def try_mag_stb_api_endpoints(self):
         """Try to access the actual MAG STB API endpoints that the interface uses"""
-        try:
-            print("🔍 Attempting direct MAG STB API access...")
-            
-            # These are the actual endpoints the STB interface uses for data
-            api_endpoints = [
-                # ITv module endpoints
-                f"{self.portal_url}c/server/api/ext_module.php?name=itv&mac={self.mac_address}",
-                f"{self.portal_url}c/server/api/ext_module.php?name=tv&mac={self.mac_address}",
-                f"{self.portal_url}c/server/api/ext_module.php?name=live&mac={self.mac_address}",
-                f"{self.portal_url}c/server/api/ext_module.php?name=channels&mac={self.mac_address}",
-                
-                # Direct server endpoints that might bypass the web interface
-                f"{self.portal_url}server/load.php?type=itv&action=get_all_channels&mac={self.mac_address}&JsHttpRequest=1-xml",
-                f"{self.portal_url}server/load.php?type=itv&action=get_ordered_list&mac={self.mac_address}&JsHttpRequest=1-xml",
-                
-                # Alternative server paths
-                f"{self.portal_url}c/server/load.php?type=itv&action=get_all_channels&mac={self.mac_address}&JsHttpRequest=1-xml",
-                f"{self.portal_url}c/server/load.php?type=itv&action=get_ordered_list&mac={self.mac_address}&JsHttpRequest=1-xml",
-                
-                # Portal endpoints
-                f"{self.portal_url}portal.php?type=itv&action=get_all_channels&mac={self.mac_address}",
-                f"{self.portal_url}c/portal.php?type=itv&action=get_all_channels&mac={self.mac_address}",
-            ]
-            
-            for endpoint in api_endpoints:
-                try:
-                    print(f"🔍 Trying MAG API endpoint: {endpoint}")
-                    response = self.requests.session.get(endpoint, timeout=15)
-                    
-                    if response.status_code == 200:
-                        content = response.text.strip()
-                        
-                        # Check if this is actual data (not HTML)
-                        if not content.startswith('<!DOCTYPE') and not content.startswith('<html'):
-                            print(f"✅ Got non-HTML response from: {endpoint}")
-                            print(f"📄 Response preview: {content[:200]}...")
-                            
-                            # Try to parse as JSON
-                            if content.startswith('{') or content.startswith('['):
-                                try:
-                                    data = response.json()
-                                    channels = self.extract_channels_from_json_data(data)
-                                    if channels:
-                                        print(f"✅ Found {len(channels)} channels from MAG API")
-                                        return channels
-                                except:
-                                    pass
-                            
-                            # Try as other formats
-                            channels = self.extract_from_complex_content(content)
-                            if channels:
-                                print(f"✅ Found {len(channels)} channels from MAG API content")
-                                return channels
-                        else:
-                            print(f"❌ Endpoint returned HTML interface: {endpoint}")
-                    
-                except Exception as e:
-                    print(f"❌ MAG API endpoint failed: {e}")
-                    continue
-            
-            return []
-            
-        except Exception as e:
-            print(f"❌ MAG STB API access error: {e}")
-            return []
+        print("🔍 Attempting direct MAG STB API access...")
+        return self.probe_mag_endpoints(self.mac_address, modules=True, channel_lists=True)
+
 
     def process_mag_channel_data(self, data):
         """Process MAG-style channel data with proper URL cleaning for 4K-CDN"""
@@ -3845,90 +7020,28 @@ class WindowsIPTVPlayer:
 
     def try_mag_module_approach(self, mac_address):
         """Try to load channels using MAG module system"""
-        try:
-            print("🔍 Trying MAG module approach...")
-            
-            # Common MAG modules that might contain channel data
-            modules_to_try = [
-                'tv',
-                'live',
-                'channels', 
-                'itv',
-                'player',
-                'main',
-                'stb'
-            ]
-            
-            for module in modules_to_try:
-                try:
-                    # Try module API endpoint
-                    module_url = f"{self.portal_url}server/api/ext_module.php?name={module}&mac={mac_address}"
-                    print(f"🔍 Trying module: {module_url}")
-                    
-                    response = self.requests.session.get(module_url, timeout=(10, 20))
-                    
-                    if response.status_code == 200:
-                        content = response.text.strip()
-                        
-                        if content and len(content) > 100:  # Reasonable content length
-                            print(f"✅ Got response from module '{module}': {len(content)} chars")
-                            
-                            # Try to extract channel data from module response
-                            channels = self.extract_channels_from_module_response(content, module)
-                            if channels:
-                                return channels
-                    
-                except Exception as e:
-                    print(f"❌ Module '{module}' failed: {e}")
-                    continue
-            
-            return []
-            
-        except Exception as e:
-            print(f"❌ MAG module approach error: {e}")
-            return []
+        print("🔍 Trying MAG module approach...")
+        return self.probe_mag_endpoints(mac_address, modules=True, channel_lists=False)
+
 
     def extract_channels_from_mag_html(self, html_content, source_url):
         """Extract channels from MAG HTML interface"""
         try:
             print("🔍 Extracting channels from MAG HTML...")
             
-            # Look for common MAG JavaScript patterns
-            import re
-            
-            # Patterns for MAG channel data
-            patterns = [
-                # Channel arrays in JavaScript
-                r'channels\s*=\s*(\[.*?\]);',
-                r'playlist\s*=\s*(\[.*?\]);',
-                r'items\s*=\s*(\[.*?\]);',
-                
-                # MAG-specific patterns
-                r'stb\.player\.channels\s*=\s*(\[.*?\]);',
-                r'module\.tv\.channels\s*=\s*(\[.*?\]);',
-                
-                # JSON data embedded in HTML
-                r'<script[^>]*>\s*var\s+data\s*=\s*(\{.*?\});',
-                r'<script[^>]*>\s*window\.channels\s*=\s*(\[.*?\]);',
-            ]
+            # channels = [...], stb.player.channels = [...], var data = {...}, window.channels = [...]
+            channels = self.channels_from_objects(self.parse_pool.run(
+                scan_channel_objects, html_content, {"channels", "playlist", "items", "data"}))
             
-            for pattern in patterns:
-                matches = re.findall(pattern, html_content, re.DOTALL | re.IGNORECASE)
-                for match in matches:
-                    try:
-                        import json
-                        data = json.loads(match)
-                        
-                        if isinstance(data, list) and len(data) > 0:
-                            channels = self.process_mag_channel_data(data)
-                            if channels:
-                                print(f"✅ Extracted {len(channels)} channels from MAG HTML")
-                                return channels
-                                
-                    except Exception as e:
-                        continue
+            if not channels:
+                # No usable literal - fall back to the name/url tokenizer
+                items = [{"name": name or self.extract_name_from_url(url.replace("ffmpeg ", "").strip()), "cmd": url}
+                         for name, url in self.parse_pool.run(scan_channel_pairs, html_content)]
+                channels = self.process_mag_channel_data(items) if items else []
             
-            return []
+            if channels:
+                print(f"✅ Extracted {len(channels)} channels from MAG HTML")
+            return channels
             
         except Exception as e:
             print(f"❌ MAG HTML extraction error: {e}")
@@ -3964,27 +7077,11 @@ class WindowsIPTVPlayer:
                 except:
                     pass
             
-            # Try to extract from JavaScript code
-            import re
-            
-            js_patterns = [
-                r'channels\s*:\s*(\[.*?\])',
-                r'items\s*:\s*(\[.*?\])',
-                r'data\s*:\s*(\[.*?\])',
-            ]
-            
-            for pattern in js_patterns:
-                matches = re.findall(pattern, content, re.DOTALL)
-                for match in matches:
-                    try:
-                        import json
-                        data = json.loads(match)
-                        if isinstance(data, list) and len(data) > 0:
-                            channels = self.process_mag_channel_data(data)
-                            if channels:
-                                return channels
-                    except:
-                        continue
+            # Try to extract from JavaScript code (channels: [...], items: [...], data: [...])
+            channels = self.channels_from_objects(self.parse_pool.run(
+                scan_channel_objects, content, {"channels", "items", "data"}))
+            if channels:
+                return channels
             
             return []
             
@@ -4166,23 +7263,7 @@ class WindowsIPTVPlayer:
     def parse_m3u_playlist(self, m3u_content):
         """Parse M3U playlist content into channel list"""
         try:
-            channels = []
-            lines = m3u_content.split('\n')
-            
-            current_name = None
-            for i, line in enumerate(lines):
-                line = line.strip()
-                
-                if line.startswith('#EXTINF:'):
-                    # Extract channel name
-                    if ',' in line:
-                        current_name = line.split(',', 1)[1].strip()
-                    
-                elif line.startswith('http://') or line.startswith('https://'):
-                    if current_name:
-                        channels.append((current_name, line, line))
-                        current_name = None
-            
+            channels = self.parse_pool.run(parse_m3u_text, m3u_content)
             print(f"✅ Parsed {len(channels)} channels from M3U playlist")
             return channels
             
@@ -4194,24 +7275,7 @@ class WindowsIPTVPlayer:
     
     def parse_xtream_channels(self, data):
         """Parse Xtream Codes API response into channel list"""
-        try:
-            channels = []
-            
-            for item in data:
-                name = item.get('name', 'Unknown Channel')
-                stream_id = item.get('stream_id', '')
-                
-                if stream_id:
-                    # Build stream URL
-                    stream_url = f"{self.portal_url}live/{self.mac_address}/{stream_id}.ts"
-                    channels.append((name, stream_url, stream_url))
-            
-            print(f"✅ Parsed {len(channels)} channels from Xtream API")
-            return channels
-            
-        except Exception as e:
-            print(f"❌ Xtream parsing error: {e}")
-            return []
+        return self.engine.portal.parse_xtream_channels(data)
         
         
     def debug_response_content(self, url, content):
@@ -4233,10 +7297,7 @@ class WindowsIPTVPlayer:
             self.channels = channels
             self.filtered_channels = self.channels
             self.update_channel_list()
-            
-            # Save to cache
-            self.cache_manager.save_to_cache(self.portal_url, self.mac_address, channels)
-            
+
             # Close progress window
             if self.loading_progress:
                 self.loading_progress.destroy()
@@ -4277,35 +7338,15 @@ class WindowsIPTVPlayer:
             self.status_var.set(f"Showing all {len(self.channels)} channels")
             return
         
-        # Check cache first
-        if search_term in self.search_cache:
-            self.filtered_channels = self.search_cache[search_term]
-            self.update_channel_list()
-            self.status_var.set(f"Found {len(self.filtered_channels)} channels (cached)")
-            return
-        
-        # Perform search
         start_time = time.time()
-        filtered = []
-        
-        for channel in self.channels:
-            if search_term in channel[0].lower():
-                filtered.append(channel)
-        
-        # Cache result
-        self.search_cache[search_term] = filtered
-        
-        # Limit cache size
-        if len(self.search_cache) > 100:
-            oldest_keys = list(self.search_cache.keys())[:50]
-            for key in oldest_keys:
-                del self.search_cache[key]
-        
-        self.filtered_channels = filtered
+        self.filtered_channels, cached = self.engine.search(search_term)
         self.update_channel_list()
         
-        search_time = time.time() - start_time
-        self.status_var.set(f"Found {len(filtered)} channels in {search_time:.3f}s")
+        if cached:
+            self.status_var.set(f"Found {len(self.filtered_channels)} channels (cached)")
+        else:
+            search_time = time.time() - start_time
+            self.status_var.set(f"Found {len(self.filtered_channels)} channels in {search_time:.3f}s")
 
     def open_export_window(self):
         """Open the M3U export options window"""
@@ -4315,6 +7356,37 @@ class WindowsIPTVPlayer:
         
         M3UExportWindow(self, self.channels, self.mac_address)
 
+    def toggle_playlist_server(self):
+        """Start/stop the local playlist server and copy its URL to the clipboard"""
+        if self.playlist_server and self.playlist_server.running:
+            self.playlist_server.stop()
+            self.playlist_server_button.config(text="📡 Playlist Server")
+            self.status_var.set("Playlist server stopped")
+            return
+
+        if not self.channels:
+            messagebox.showwarning("Warning", "Please fetch channels first before sharing a playlist.")
+            return
+
+        try:
+            self.playlist_server = PlaylistProxyServer(self.engine, timeshift=True)
+            playlist_url = self.playlist_server.start()
+        except OSError as e:
+            messagebox.showerror("Playlist Server", f"Could not start the playlist server:\n{e}")
+            return
+
+        self.root.clipboard_clear()
+        self.root.clipboard_append(playlist_url)
+        self.playlist_server_button.config(text="⏹️ Stop Server")
+        self.status_var.set(f"📡 Playlist server running: {playlist_url} (copied to clipboard)")
+
+    def toggle_worker_parsing(self):
+        """Turn worker-process parsing of large payloads on/off (saved in config.json)"""
+        enabled = self.worker_parse_var.get()
+        self.parse_pool.set_enabled(enabled)
+        save_config(parse_in_worker_process=enabled)
+        self.status_var.set(f"Worker-process parsing {'enabled' if enabled else 'disabled'}")
+
     def clear_cache(self):
         """Clear temporary cache files but keep permanent channel cache"""
         try:
@@ -4327,6 +7399,10 @@ class WindowsIPTVPlayer:
                 if filename.startswith("channels_") and filename.endswith(".pkl"):
                     print(f"🔒 Keeping permanent channel cache: {filename}")
                     continue
+
+                # ✅ SKIP learned per-profile state (latency history etc.)
+                if filename.startswith("profile_") and filename.endswith(".json"):
+                    continue
                 
                 # Clear other cache files
                 if filename.endswith(('.pkl', '.json', '.ts', '.tmp')):
@@ -4337,8 +7413,11 @@ class WindowsIPTVPlayer:
                     except:
                         pass
             
+            # Cached provider analysis downloads (cache/responses)
+            cleared_files += self.response_cache.clear()
+            
             # Clear search cache in memory
-            self.search_cache.clear()
+            self.engine.search_index.cache.clear()
             
             if cleared_files > 0:
                 messagebox.showinfo("Success", 
@@ -4361,6 +7440,10 @@ class WindowsIPTVPlayer:
 
     def go_back(self):
         """Go back to user selection"""
+        self.cancel_probe = True
+        if self.playlist_server:
+            self.playlist_server.stop()
+        self.engine.close()
         self.root.destroy()
         theme = load_theme()
         if theme == "default":
@@ -4373,150 +7456,107 @@ class WindowsIPTVPlayer:
 
     def get_stream_link(self, cmd):
         """Get stream link with provider-specific handling"""
-        clean_cmd = cmd.replace("ffmpeg ", "").strip()
-        print(f"🔗 Getting stream link for: {clean_cmd}")
-        
-        # Check if this is delta8k provider
-        provider_type = self.detect_provider_type(self.portal_url)
-        
-        if provider_type == "delta8k":
-            # For delta8k, URLs are already playable - return as is
-            print(f"✅ Delta8k provider - using direct URL: {clean_cmd}")
-            return clean_cmd
-        
-        # For other providers, use the create_link endpoint
-        # Extract stream ID from the original command
-        import re
-        stream_id = None
-        match = re.search(r'stream=(\d+)', clean_cmd)
-        if match:
-            stream_id = match.group(1)
-
-        # Build create_link_url as before
-        create_link_url = f"{self.portal_url}server/load.php?type=itv&action=create_link&mac={self.mac_address}&cmd={urllib.parse.quote(clean_cmd)}&JsHttpRequest=1-xml"
-        
-        # Helper to fix URLs
-        def fix_url(url_to_fix):
-            if "localhost" in url_to_fix:
-                from urllib.parse import urlparse
-                parsed_portal = urlparse(self.portal_url)
-                return url_to_fix.replace("localhost", parsed_portal.netloc)
-            elif url_to_fix.startswith("/"):
-                from urllib.parse import urlparse
-                parsed_portal = urlparse(self.portal_url)
-                return f"{parsed_portal.scheme}://{parsed_portal.netloc}{url_to_fix}"
-            return url_to_fix
-
-        try:
-            import random
-            timestamp = int(time.time() * 1000)
-            random_val = random.randint(1000, 9999)
-            create_link_url += f"&_t={timestamp}&_r={random_val}"
-
-            # Use specific headers to avoid 10054
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Connection": "close"
-            }
-
-            response = self.requests.get(create_link_url, headers=headers, timeout=5)
-            if response.status_code == 200:
-                try:
-                    data = response.json().get('js', {})
-                except:
-                    data = {}
-                
-                real_cmd = data.get('cmd', '')
-                if real_cmd:
-                    final_url = real_cmd.replace("ffmpeg ", "").strip()
-
-                    # Restore stream ID if missing
-                    if stream_id:
-                        final_url = re.sub(r'stream=(?:&)?', f'stream={stream_id}&', final_url)
-                        # If still missing, append it
-                        if f'stream={stream_id}' not in final_url:
-                            if "stream=" in final_url:
-                                final_url = re.sub(r'stream=[^&]*', f'stream={stream_id}', final_url)
-                            else:
-                                # Add stream param before extension
-                                ext_match = re.search(r'extension=\w+', final_url)
-                                if ext_match:
-                                    ext_pos = ext_match.start()
-                                    final_url = final_url[:ext_pos] + f'stream={stream_id}&' + final_url[ext_pos:]
-
-                    # Fix localhost/relative URLs
-                    final_url = fix_url(final_url)
-
-                    print(f"✅ Got clean stream URL: {final_url}")
-                    return final_url
-                else:
-                    print(f"⚠️ No real_cmd in response: {data}")
-            else:
-                print(f"❌ HTTP {response.status_code}: {response.text[:100]}")
-        except Exception as e:
-            print(f"❌ Stream link error: {e}")
-
-        # ✅ FALLBACK: Return direct URL instead of None to avoid popup
-        print("⚠️ Failed to get stream link - falling back to direct URL")
-        return fix_url(clean_cmd)
-    
+        return self.engine.get_stream_link(cmd)
     
     
     
-    def refresh_session_and_retry(self, original_cmd):
-        """Refresh session and get new token"""
-        try:
-            print("🔄 Refreshing session due to token expiry...")
-            
-            # Clear token cache
-            self.token_cache.clear()
-            
-            # Perform new handshake
-            auth_url = f"{self.portal_url}server/load.php?type=stb&action=handshake&mac={self.mac_address}&_t={int(time.time())}"
-            
-            headers = {
-                "Referer": self.portal_url + "index.html",
-                "Origin": self.portal_url.rstrip('/'),
-            }
-            
-            auth_response = self.requests.get(auth_url, headers=headers, timeout=10)
-            
-            if auth_response.status_code == 200:
-                print("✅ Session refreshed successfully")
-                # Now try to get the stream link again
-                return self.get_stream_link(original_cmd)
-            else:
-                print(f"❌ Session refresh failed: {auth_response.status_code}")
-                return None
-                
-        except Exception as e:
-            print(f"❌ Session refresh error: {e}")
-            return None
+    
+    def refresh_session_and_retry(self, original_cmd):
+        """Refresh session and get new token"""
+        return self.engine.portal.refresh_session_and_retry(original_cmd)
     
     
     
 
     def update_channel_list(self):
         """Optimized channel list update with batch insertion"""
+        # A new search/favorites/all list becomes the view source; toggling the health options reuses it
+        if self.filtered_channels is not getattr(self, "health_view", None):
+            self.view_source = self.filtered_channels
+        self.filtered_channels = self.health_view = self.apply_health_view(self.view_source)
+
         self.channel_list.delete(0, tk.END)
         
         # Use batch insert for better performance
         channel_names = [channel[0] for channel in self.filtered_channels]
+        store = self.engine.store
+        dead = [store.health_for(channel).get("up") is False for channel in self.filtered_channels] \
+            if store.health else None
         
         # Insert in batches to prevent GUI freezing
         batch_size = 100
-        self._insert_channels_batch(channel_names, 0, batch_size)
+        self._insert_channels_batch(channel_names, 0, batch_size, dead)
 
-    def _insert_channels_batch(self, channel_names, start_idx, batch_size):
+    def _insert_channels_batch(self, channel_names, start_idx, batch_size, dead=None):
         """Insert channels in batches to prevent GUI freezing"""
         end_idx = min(start_idx + batch_size, len(channel_names))
         
         for i in range(start_idx, end_idx):
             self.channel_list.insert(tk.END, channel_names[i])
+            if dead and dead[i]:
+                self.channel_list.itemconfig(tk.END, fg="#9E9E9E")  # Last probe found no stream
         
         # Schedule next batch if there are more channels
         if end_idx < len(channel_names):
-            self.root.after(1, lambda: self._insert_channels_batch(channel_names, end_idx, batch_size))
+            self.root.after(1, lambda: self._insert_channels_batch(channel_names, end_idx, batch_size, dead))
+
+    def apply_health_view(self, channels):
+        """Hide dead channels and/or sort by probe results (up by TTFB, unprobed, dead)"""
+        hide_dead = self.hide_dead_var.get()
+        sort_by_health = self.sort_health_var.get()
+        if not hide_dead and not sort_by_health:
+            return channels
+        store = self.engine.store
+        if hide_dead:
+            channels = [channel for channel in channels if store.health_for(channel).get("up") is not False]
+        if sort_by_health:
+            def rank(channel):
+                health = store.health_for(channel)
+                if not health:
+                    return (1, 0)
+                return (0, health.get("ttfb_ms") or 0) if health.get("up") else (2, 0)
+            channels = sorted(channels, key=rank)
+        return channels
+
+    def toggle_stream_probe(self):
+        """Start/stop the background availability probe over the channels in view"""
+        if self.probe_running:
+            self.cancel_probe = True
+            self.probe_button.config(text="🩺 Stopping...")
+            return
+        channels = list(getattr(self, "view_source", None) or self.channels)
+        if not channels:
+            messagebox.showinfo("Probe Streams", "Load channels first.")
+            return
+
+        self.probe_running = True
+        self.cancel_probe = False
+        self.probe_button.config(text="⏹ Stop Probe")
+        counts = {"up": 0, "down": 0}
+
+        def on_result(channel, result, done, total):
+            counts["up" if result["up"] else "down"] += 1
+            if done % 10 == 0 or done == total:
+                message = f"🩺 Probed {done}/{total} - {counts['up']} up, {counts['down']} down"
+                self.root.after(0, lambda: self.status_var.set(message))
+
+        def run():
+            try:
+                StreamProber(self.engine).run(channels, on_result=on_result, cancelled=lambda: self.cancel_probe)
+            except Exception as e:
+                print(f"❌ Stream probe error: {e}")
+
+            def finish():
+                self.probe_running = False
+                self.probe_button.config(text="🩺 Probe Streams")
+                self.status_var.set(f"🩺 Stream probe done - {counts['up']} up, {counts['down']} down")
+                self.update_channel_list()
+            try:
+                self.root.after(0, finish)
+            except (tk.TclError, RuntimeError):
+                pass
+
+        threading.Thread(target=run, daemon=True).start()
             
             
             
@@ -4538,6 +7578,17 @@ class WindowsIPTVPlayer:
             
             self.status_var.set(f"Connecting to {channel_name}...")
             print(f"Attempting to play: {channel_name}")
+
+            # Playlist server running - join its shared upstream instead of opening a second one
+            if self.playlist_server and self.playlist_server.running and self.playlist_server.mode == "proxy":
+                try:
+                    process, _ = self.engine.launcher.launch(
+                        self.playlist_server.channel_url(self.filtered_channels[selected_index[0]]),
+                        self.portal_url + "index.html")
+                    self.status_var.set(f"Playing: {channel_name} via playlist server (PID: {process.pid})")
+                    return
+                except EngineError:
+                    pass
             
             # Check provider type
             provider_type = self.detect_provider_type(self.portal_url)
@@ -4549,13 +7600,20 @@ class WindowsIPTVPlayer:
                 self.play_direct(stream_url)
             else:
                 # For other providers, use enhanced connection manager with retry logic
-                final_url = self.connection_manager.get_stream_with_retry(original_cmd, max_retries=3)
+                channel = (channel_name, stream_url, original_cmd)
+                has_alternates = len(self.engine.failover_groups.members(channel)) > 1
+                # With alternate feeds to switch to, only a real create_link answer counts as success
+                final_url = self.engine.resolve(channel, max_retries=3, strict=has_alternates)
                 
                 if final_url:
                     # Successfully got a working stream URL
                     self.status_var.set(f"Playing: {channel_name}")
                     print(f"Final playable URL: {final_url}")
                     self.play_direct(final_url)
+                elif has_alternates:
+                    # Same channel is listed under other stream ids - switch to one of those
+                    print(f"🔀 {channel_name} failed - trying its alternate feeds")
+                    self.play_with_failover(channel, skip={get_channel_id(channel)})
                 else:
                     # All retry attempts failed
                     self.status_var.set("Connection failed")
@@ -4586,6 +7644,12 @@ class WindowsIPTVPlayer:
             
     def try_direct_play(self, stream_url, user_agent, referer):
         """Try direct playback first - returns True if successful"""
+        original_cmd = self.extract_original_command(stream_url.replace("ffmpeg ", "").strip())
+        if original_cmd and self.engine.stream_params.get(StreamParamCache.channel_key(original_cmd)):
+            # Played before - the cached parameters replace the ffprobe round trip
+            print("⚡ Known channel - skipping stream test")
+            self.play_direct(stream_url)
+            return True
         try:
             # Quick test - try to open the stream briefly
             test_command = [
@@ -4768,6 +7832,7 @@ class WindowsIPTVPlayer:
             
             ffmpeg_command = [
                 "ffmpeg", "-y",
+                "-progress", "pipe:1", "-nostats",  # Machine-readable progress for FFmpegMonitor
                 "-user_agent", user_agent,
                 "-headers", f"Referer: {referer}",
                 "-probesize", "32M",
@@ -4795,8 +7860,14 @@ class WindowsIPTVPlayer:
                 text=True
             )
             
+            PROCESS_REGISTRY.register(self.download_process, "downloader", stream_url)
             print(f"📡 Download process started (PID: {self.download_process.pid})")
-            self.manage_continuous_cache_rotation(cache_file)
+            self.download_monitor = FFmpegMonitor(
+                self.download_process,
+                on_progress=lambda stats: self.update_cache_status(
+                    f"Building buffer... {stats['bytes'] / (1024 * 1024):.1f}MB "
+                    f"({stats['bitrate_kbps']:.0f} kbit/s, {stats['speed']:.1f}x)",
+                    min(100, stats["out_time"] / 15 * 100)))
             
             # Monitor with standard timeouts
             self.monitor_standard_cache(cache_file, stream_url)
@@ -4806,83 +7877,54 @@ class WindowsIPTVPlayer:
             self.update_cache_status(f"Error: {str(e)}", 0)
             self.root.after(500, lambda: self.play_direct(stream_url))
 
-    def monitor_standard_cache(self, cache_file, stream_url):
-        """Monitor standard cache download"""
-        start_time = time.time()
+    def get_download_monitor(self):
+        """FFmpegMonitor for the current download process (attached on first use)"""
+        monitor = getattr(self, "download_monitor", None)
+        if monitor is None or monitor.process is not self.download_process:
+            monitor = self.download_monitor = FFmpegMonitor(self.download_process)
+        return monitor
+
+    def handle_download_error(self, monitor, original_cmd, cache_file):
+        """Route an HTTP error reported by the download monitor to its handler (main thread)"""
+        code, error_line = monitor.http_error, monitor.error_line or ""
+        if code == 404:
+            handler = lambda: self.handle_channel_not_found(cache_file)
+        elif code == 456:
+            handler = lambda: self.handle_subscription_error(original_cmd, cache_file, error_line)
+        elif code == 503:
+            handler = lambda: self.handle_server_unavailable(original_cmd, cache_file)
+        elif code >= 500:
+            handler = lambda: self.handle_server_error(original_cmd, cache_file, error_line)
+        else:
+            handler = lambda: self.handle_token_expired(original_cmd, cache_file)
+        self.root.after(0, handler)
+
+    def monitor_standard_cache(self, cache_file, stream_url=None):
+        """Monitor standard cache download - woken by ffmpeg progress/error events, no stat polling"""
         buffer_target = 15  # 15 seconds buffer
-        last_size = 0
-        stall_count = 0
-        
-        while True:
-            if self.cache_cancelled:
-                if hasattr(self, 'download_process') and self.download_process.poll() is None:
-                    self.download_process.terminate()
-                return
-            
-            # Check if process ended
-            if self.download_process.poll() is not None:
-                stdout, stderr = self.download_process.communicate()
-                return_code = self.download_process.returncode
-                
-                if stderr and "401 Unauthorized" in stderr:
-                    print("🔑 Token expired during download")
-                    self.handle_token_expired(None, cache_file)
-                    return
-                elif stderr and "404 Not Found" in stderr:
-                    print("🚫 Channel not found (404)")
-                    self.handle_channel_not_found(cache_file)
-                    return
-                elif stderr and "503 Service Unavailable" in stderr:
-                    print("🚫 Server unavailable (503)")
-                    self.handle_server_unavailable(None, cache_file)
-                    return
-                elif os.path.exists(cache_file) and os.path.getsize(cache_file) > 1000000:
-                    print("⚠️ Download ended but we have cache")
-                    self.root.after(500, lambda: self.play_with_continuous_cache(cache_file))
-                    return
-                else:
-                    print("❌ Download failed")
-                    self.root.after(500, lambda: self.play_direct(stream_url))
-                    return
-            
-            elapsed = time.time() - start_time
-            
-            if os.path.exists(cache_file):
-                file_size = os.path.getsize(cache_file)
-                size_mb = file_size / (1024 * 1024)
-                
-                # Check for stalls
-                if file_size == last_size:
-                    stall_count += 1
-                    if stall_count > 10 and file_size > 2000000:
-                        print("✅ Enough cache despite stall")
-                        self.root.after(500, lambda: self.play_with_continuous_cache(cache_file))
-                        return
-                else:
-                    stall_count = 0
-                    last_size = file_size
-                
-                # Calculate progress
-                estimated_seconds = (file_size / 1024 / 1024) * 2
-                progress = min(100, (estimated_seconds / buffer_target) * 100)
-                
-                self.update_cache_status(f"Building buffer... {size_mb:.1f}MB ({elapsed:.1f}s)", progress)
-                
-                # Check if ready
-                if elapsed >= buffer_target or size_mb >= 30 or progress >= 100:
-                    print(f"✅ Buffer ready with {size_mb:.1f}MB")
-                    self.root.after(500, lambda: self.play_with_continuous_cache(cache_file))
-                    return
-            else:
-                progress = min(100, (elapsed / buffer_target) * 100)
-                self.update_cache_status(f"Connecting... ({elapsed:.1f}s)", progress)
-                
-                if elapsed >= 30:
-                    print("❌ Cache timeout")
-                    self.root.after(500, lambda: self.play_direct(stream_url))
-                    return
-            
-            time.sleep(0.5)
+        monitor = self.get_download_monitor()
+
+        outcome = monitor.wait_until(
+            lambda stats: stats["out_time"] >= buffer_target or stats["bytes"] >= 30 * 1024 * 1024,
+            timeout=30, cancelled=lambda: getattr(self, "cache_cancelled", False), stall_timeout=5)
+        size_mb = monitor.stats["bytes"] / (1024 * 1024)
+
+        if outcome == "cancelled":
+            monitor.terminate()
+            return
+        if outcome == "error":
+            self.handle_download_error(monitor, None, cache_file)
+            return
+        if outcome == "ready" or monitor.stats["bytes"] > 1000000:
+            # Full buffer, or ffmpeg stalled/ended/timed out with usable data
+            print(f"✅ Buffer ready with {size_mb:.1f}MB ({outcome})")
+            self.root.after(500, lambda: self.play_with_continuous_cache(cache_file))
+            return
+
+        print(f"❌ Cache {outcome} with {size_mb:.1f}MB")
+        monitor.terminate()
+        if stream_url:
+            self.root.after(500, lambda: self.play_direct(stream_url))
 
     
 
@@ -4937,119 +7979,25 @@ class WindowsIPTVPlayer:
         
         
         
-    def monitor_standard_cache(self, cache_file):
-        """Monitor standard cache download"""
-        start_time = time.time()
-        buffer_target = 15
-        last_size = 0
-        stall_count = 0
-        
-        while True:
-            if self.cache_cancelled:
-                if hasattr(self, 'download_process') and self.download_process.poll() is None:
-                    self.download_process.terminate()
-                return
-            
-            # Check if process ended
-            if self.download_process.poll() is not None:
-                stdout, stderr = self.download_process.communicate()
-                return_code = self.download_process.returncode
-                
-                if stderr and "401 Unauthorized" in stderr:
-                    print("🔑 Token expired during download")
-                    self.root.after(500, lambda: self.play_direct(stream_url))
-                    return
-                elif os.path.exists(cache_file) and os.path.getsize(cache_file) > 1000000:
-                    print("⚠️ Download ended but we have cache")
-                    self.root.after(500, lambda: self.play_with_continuous_cache(cache_file))
-                    return
-                else:
-                    print("❌ Download failed")
-                    self.root.after(500, lambda: self.play_direct(stream_url))
-                    return
-            
-            elapsed = time.time() - start_time
-            
-            if os.path.exists(cache_file):
-                file_size = os.path.getsize(cache_file)
-                size_mb = file_size / (1024 * 1024)
-                
-                # Check for stalls
-                if file_size == last_size:
-                    stall_count += 1
-                    if stall_count > 10 and file_size > 2000000:
-                        print("✅ Enough cache despite stall")
-                        self.root.after(500, lambda: self.play_with_continuous_cache(cache_file))
-                        return
-                else:
-                    stall_count = 0
-                    last_size = file_size
-                
-                # Calculate progress
-                estimated_seconds = (file_size / 1024 / 1024) * 2
-                progress = min(100, (estimated_seconds / buffer_target) * 100)
-                
-                self.update_cache_status(f"Building buffer... {size_mb:.1f}MB ({elapsed:.1f}s)", progress)
-                
-                # Check if ready
-                if elapsed >= buffer_target or size_mb >= 30 or progress >= 100:
-                    print(f"✅ Buffer ready with {size_mb:.1f}MB")
-                    self.root.after(500, lambda: self.play_with_continuous_cache(cache_file))
-                    return
-            else:
-                progress = min(100, (elapsed / buffer_target) * 100)
-                self.update_cache_status(f"Connecting... ({elapsed:.1f}s)", progress)
-                
-                if elapsed >= 30:
-                    print("❌ Cache timeout")
-                    self.root.after(500, lambda: self.play_direct(stream_url))
-                    return
-            
-            time.sleep(0.5)
-
     def monitor_aggressive_attempt(self, cache_file, attempt_num):
         """Monitor one aggressive attempt"""
         start_time = time.time()
-        
-        while time.time() - start_time < 8:  # 8 second timeout
-            if self.cache_cancelled:
-                if hasattr(self, 'download_process') and self.download_process.poll() is None:
-                    self.download_process.terminate()
-                return False
-            
-            if self.download_process.poll() is not None:
-                stdout, stderr = self.download_process.communicate()
-                
-                if stderr and "401 Unauthorized" in stderr:
-                    elapsed = time.time() - start_time
-                    print(f"⏰ Token expired after {elapsed:.2f}s")
-                    return False
-                elif os.path.exists(cache_file):
-                    file_size = os.path.getsize(cache_file)
-                    if file_size > 500000:
-                        print(f"✅ Success! Got {file_size/1024/1024:.1f}MB")
-                        self.manage_continuous_cache_rotation(cache_file)
-                        self.root.after(500, lambda: self.play_with_continuous_cache(cache_file))
-                        return True
-            
-            elapsed = time.time() - start_time
-            if os.path.exists(cache_file):
-                file_size = os.path.getsize(cache_file)
-                size_mb = file_size / (1024 * 1024)
-                progress = min(100, (elapsed / 8) * 100)
-                self.update_cache_status(f"Attempt {attempt_num + 1}: {size_mb:.1f}MB ({elapsed:.1f}s)", progress)
-                
-                if file_size > 1500000 and elapsed >= 3:
-                    print(f"✅ Sufficient cache after {elapsed:.1f}s")
-                    self.manage_continuous_cache_rotation(cache_file)
-                    self.root.after(500, lambda: self.play_with_continuous_cache(cache_file))
-                    return True
-            
-            time.sleep(0.2)
-        
-        # Timeout
-        if hasattr(self, 'download_process') and self.download_process.poll() is None:
-            self.download_process.terminate()
+        monitor = self.get_download_monitor()
+
+        # 1.5MB after 3 seconds is enough to start
+        outcome = monitor.wait_until(
+            lambda stats: stats["bytes"] > 1500000 and time.time() - start_time >= 3,
+            timeout=8, cancelled=lambda: getattr(self, "cache_cancelled", False))
+        elapsed = time.time() - start_time
+
+        if outcome == "error":
+            print(f"⏰ HTTP {monitor.http_error} after {elapsed:.2f}s")
+        elif outcome == "ready" or (outcome == "exited" and monitor.stats["bytes"] > 500000):
+            print(f"✅ Success! Got {monitor.stats['bytes'] / 1024 / 1024:.1f}MB after {elapsed:.1f}s")
+            self.root.after(500, lambda: self.play_with_continuous_cache(cache_file))
+            return True
+
+        monitor.terminate()
         return False
 
     def handle_aggressive_cache_failure(self, cache_file):
@@ -5076,59 +8024,31 @@ class WindowsIPTVPlayer:
     def monitor_ultra_fast_attempt(self, cache_file, attempt_num):
         """Monitor one ultra-fast attempt for 10 seconds"""
         start_time = time.time()
-        
-        while time.time() - start_time < 10:  # 10 second timeout per attempt
-            if self.cache_cancelled:
-                if hasattr(self, 'download_process') and self.download_process.poll() is None:
-                    self.download_process.terminate()
-                return False
-            
-            if self.download_process.poll() is not None:
-                stdout, stderr = self.download_process.communicate()
-                return_code = self.download_process.returncode
-                
-                if stderr and "401 Unauthorized" in stderr:
-                    elapsed = time.time() - start_time
-                    print(f"⏰ Token expired after {elapsed:.2f}s on attempt {attempt_num + 1}")
-                    return False  # Try next attempt
-                elif stderr:
-                    print(f"❌ Other error on attempt {attempt_num + 1}: {stderr[:200]}...")
-                    return False
-                else:
-                    # Process ended without error - check what we got
-                    if os.path.exists(cache_file):
-                        file_size = os.path.getsize(cache_file)
-                        if file_size > 500000:  # 500KB threshold
-                            print(f"✅ Success! Got {file_size/1024/1024:.1f}MB")
-                            self.continue_successful_cache(cache_file)
-                            return True
-            
-            # Check cache progress
-            elapsed = time.time() - start_time
-            if os.path.exists(cache_file):
-                file_size = os.path.getsize(cache_file)
-                size_mb = file_size / (1024 * 1024)
-                progress = min(100, (elapsed / 10) * 100)
-                self.update_cache_status(f"Attempt {attempt_num + 1}: {size_mb:.1f}MB ({elapsed:.1f}s)", progress)
-                
-                # Check if we have enough to start
-                if file_size > 2000000 and elapsed >= 5:  # 2MB after 5 seconds
-                    print(f"✅ Enough cache after {elapsed:.1f}s on attempt {attempt_num + 1}")
-                    self.continue_successful_cache(cache_file)
-                    return True
-            
-            time.sleep(0.2)  # Quick checks
-        
-        # Timeout on this attempt
-        print(f"⏰ Attempt {attempt_num + 1} timed out after 10s")
-        if hasattr(self, 'download_process') and self.download_process.poll() is None:
-            self.download_process.terminate()
+        monitor = self.get_download_monitor()
+
+        # 2MB after 5 seconds is enough to start
+        outcome = monitor.wait_until(
+            lambda stats: stats["bytes"] > 2000000 and time.time() - start_time >= 5,
+            timeout=10, cancelled=lambda: getattr(self, "cache_cancelled", False))
+        elapsed = time.time() - start_time
+
+        if outcome == "error":
+            print(f"⏰ HTTP {monitor.http_error} after {elapsed:.2f}s on attempt {attempt_num + 1}")
+        elif outcome == "ready" or (outcome == "exited" and monitor.stats["bytes"] > 500000):
+            print(f"✅ Enough cache after {elapsed:.1f}s on attempt {attempt_num + 1}")
+            self.continue_successful_cache(cache_file)
+            return True
+        elif outcome == "exited":
+            print(f"❌ Other error on attempt {attempt_num + 1}: {' | '.join(monitor.stderr_tail[-3:])[:200]}...")
+        elif outcome == "timeout":
+            print(f"⏰ Attempt {attempt_num + 1} timed out after 10s")
+
+        monitor.terminate()
         return False
 
     def continue_successful_cache(self, cache_file):
         """Continue with successful cache - start playback and manage rotation"""
         print("🎬 Starting playback with successful cache...")
-        self.manage_continuous_cache_rotation(cache_file)
         self.root.after(500, lambda: self.play_with_continuous_cache(cache_file))
 
     def handle_token_system_failure(self, original_cmd, cache_file):
@@ -5300,28 +8220,13 @@ class WindowsIPTVPlayer:
             
             
     def monitor_continuous_download(self, cache_file, initial_size_mb):
-        """Monitor continuous download after playback starts"""
-        def monitor_loop():
-            try:
-                while (hasattr(self, 'download_process') and 
-                    self.download_process.poll() is None and 
-                    self.cache_window and 
-                    self.cache_window.winfo_exists()):
-                    
-                    if os.path.exists(cache_file):
-                        current_size = os.path.getsize(cache_file) / (1024 * 1024)
-                        
-                        # Show download progress without percentage
-                        self.update_cache_status(f"Downloading... {current_size:.1f}MB", 100)
-                    
-                    time.sleep(2)
-                    
-            except Exception as e:
-                print(f"Monitor error: {e}")
-        
-        # Start monitoring in background
-        monitor_thread = threading.Thread(target=monitor_loop, daemon=True)
-        monitor_thread.start()
+        """Monitor continuous download after playback starts - follows ffmpeg progress events"""
+        def show_progress(stats):
+            # Show download progress without percentage
+            if self.cache_window:
+                self.update_cache_status(f"Downloading... {stats['bytes'] / (1024 * 1024):.1f}MB", 100)
+
+        self.get_download_monitor().on_progress = show_progress
             
             
             
@@ -5330,29 +8235,26 @@ class WindowsIPTVPlayer:
             
             
     def check_ffmpeg_installation(self):
-        """Check if FFmpeg is properly installed"""
+        """Check if FFmpeg is properly installed (runs in the background, result cached per machine)"""
         try:
-            result = subprocess.run(["ffmpeg", "-version"], 
-                                capture_output=True, text=True, timeout=5)
-            if result.returncode == 0:
-                print("✅ FFmpeg is installed and working")
-                return True
-            else:
-                print("❌ FFmpeg command failed")
-                return False
-        except FileNotFoundError:
-            print("❌ FFmpeg not found in PATH")
-            messagebox.showerror("FFmpeg Missing", 
+            tools = probe_tools()
+        except Exception as e:
+            print(f"❌ Error checking FFmpeg: {e}")
+            return False
+        self.tools = tools
+        if tools["ffplay"]["path"] and tools["ffmpeg"]["path"]:
+            print(f"✅ FFmpeg is installed and working ({tools['ffmpeg']['version'] or 'unknown version'})")
+            return True
+
+        print("❌ FFmpeg not found in PATH")
+        self.root.after(0, lambda: messagebox.showerror("FFmpeg Missing", 
                             "FFmpeg is not installed or not in your system PATH.\n\n"
                             "Please:\n"
                             "1. Download FFmpeg from https://ffmpeg.org/download.html\n"
                             "2. Extract it to a folder\n"
                             "3. Add the bin folder to your system PATH\n"
-                            "4. Restart this application")
-            return False
-        except Exception as e:
-            print(f"❌ Error checking FFmpeg: {e}")
-            return False
+                            "4. Restart this application"))
+        return False
                 
             
             
@@ -5364,9 +8266,6 @@ class WindowsIPTVPlayer:
             
     def play_direct(self, stream_url):
         """Enhanced direct playback with proper URL handling for 4K-CDN"""
-        user_agent = "Mozilla/5.0 (QtEmbedded; U; Linux; C)"
-        referer = self.portal_url + "index.html"
-        
         print("🚀 Enhanced direct playback...")
         
         # Clean the stream URL first
@@ -5396,53 +8295,14 @@ class WindowsIPTVPlayer:
                 clean_stream_url = fresh_stream
 
         try:
-            print(f"🎬 Playing: {clean_stream_url}")
-            
-            ffplay_command = [
-                "ffplay", "-x", "800", "-y", "600",
-                "-user_agent", user_agent,
-                "-headers", f"Referer: {referer}",
-                "-seek_interval", "3",
-                
-                # Network optimizations for 4K-CDN
-                "-reconnect", "1",
-                "-reconnect_streamed", "1", 
-                "-reconnect_delay_max", "3",
-                "-timeout", "15000000",  # 15s timeout
-                
-                # Performance optimizations
-                "-sync", "video",
-                "-framedrop", 
-                "-probesize", "3000000",
-                "-analyzeduration", "3000000",
-                
-                # Error handling
-                "-fflags", "+discardcorrupt",
-                "-err_detect", "ignore_err",
-                
-                "-i", clean_stream_url
-            ]
-            
-            process = subprocess.Popen(ffplay_command)
-            self.status_var.set(f"Playing stream (PID: {process.pid})")
-            print("🚀 Enhanced direct playback launched successfully!")
-            return
-            
-        except Exception as e:
-            print(f"Enhanced direct play failed: {e}")
-        
-        # Fallback with minimal command
-        print("🔄 Trying minimal fallback...")
-        try:
-            process = subprocess.Popen([
-                "ffplay", "-seek_interval", "3", "-i", clean_stream_url
-            ])
-            self.status_var.set(f"Playing minimal stream (PID: {process.pid})")
-            print("🔄 Minimal fallback launched!")
+            process, mode = self.engine.play(clean_stream_url, original_cmd)
+            if mode == "minimal":
+                self.status_var.set(f"Playing minimal stream (PID: {process.pid})")
+            else:
+                self.status_var.set(f"Playing stream (PID: {process.pid})")
             return
-            
-        except Exception as e:
-            print(f"All playback attempts failed: {e}")
+        except EngineError:
+            pass
         
         # Show error message
         self.status_var.set("Playback failed")
@@ -5523,7 +8383,7 @@ class WindowsIPTVPlayer:
                 start_time = time.time()
                 test_url = f"{self.portal_url}server/load.php?type=stb&action=handshake&mac={self.mac_address}"
                 
-                response = self.requests.get(test_url, timeout=10)
+                response = self.requests.timed_get(test_url, "handshake", 10)
                 end_time = time.time()
                 
                 response_time = (end_time - start_time) * 1000  # Convert to ms
@@ -5551,65 +8411,58 @@ class WindowsIPTVPlayer:
             
             
     def play_stream_with_multi_server_retry(self):
-        """Enhanced direct play with multiple server attempts"""
+        """Event mode play - hedged failover across the channel's alternate feeds"""
         selected_index = self.channel_list.curselection()
         if not selected_index:
             messagebox.showwarning("Warning", "Please select a channel to play.")
             return
+        self.play_with_failover(self.filtered_channels[selected_index[0]])
+
+    def play_with_failover(self, channel, skip=()):
+        """Resolve through the failover group and play the first feed that opens; a feed the player
+        can't start (mpv end-file error, ffplay exiting) is skipped and the rest of the group tried.
+        Resolving and the start check run on a worker thread; Tk is only touched through root.after."""
+        tried = set(skip)
+        self.status_var.set(f"Connecting to {channel[0]}...")
+
+        def on_attempt(member):
+            self.root.after(0, lambda: self.status_var.set(f"Trying {member[0]}..."))
+
+        def worker():
+            while True:
+                member, stream_url = self.engine.failover.resolve(channel, skip=tried, on_attempt=on_attempt)
+                if not member:
+                    break
+                tried.add(get_channel_id(member))
+                if self.try_direct_play_fast(stream_url, member[0]):
+                    return
+                print(f"❌ Player could not open {member[0]} - trying next feed")
+                self.root.after(0, lambda name=member[0]: self.status_var.set(f"{name} failed - trying next feed..."))
+            self.root.after(0, lambda: self.status_var.set("Connection failed"))
+            if len(channel) > 2:
+                self.root.after(0, lambda: self.show_high_load_options(channel[0], channel[2]))
 
-        channel_name, stream_url, original_cmd = self.filtered_channels[selected_index[0]]
-        
-        # Try multiple servers/endpoints
-        server_attempts = [
-            {"priority": 1, "delay": 0},     # Primary server
-            {"priority": 2, "delay": 2},     # Backup server after 2s delay
-            {"priority": 3, "delay": 5},     # Third server after 5s delay
-        ]
-        
-        for attempt in server_attempts:
-            try:
-                print(f"🎯 Trying server priority {attempt['priority']}...")
-                
-                if attempt['delay'] > 0:
-                    print(f"⏳ Waiting {attempt['delay']}s before retry...")
-                    time.sleep(attempt['delay'])
-                
-                # Get fresh token for this attempt
-                fresh_url = self.get_stream_link_with_retry(original_cmd, max_retries=2)
-                if fresh_url:
-                    if self.try_direct_play_fast(fresh_url, channel_name):
-                        return  # Success!
-                
-            except Exception as e:
-                print(f"❌ Server attempt {attempt['priority']} failed: {e}")
-                continue
-        
-        # All servers failed
-        self.show_high_load_options(channel_name, original_cmd)
+        threading.Thread(target=worker, daemon=True).start()
         
         
     def get_stream_link_with_retry(self, cmd, max_retries=3):
         """Get stream with ultra-fast retry for high-load situations"""
         for attempt in range(max_retries):
             try:
-                # Add random delay to spread load
-                random_delay = random.uniform(0.1, 0.5)
-                time.sleep(random_delay)
-                
                 # Ultra-fast request with load balancing
                 timestamp = int(time.time() * 1000)
                 random_id = random.randint(10000, 99999)
                 
                 create_link_url = (
-                    f"{self.portal_url}server/load.php?"
+                    f"{self.portal_url}{self.engine.portal.get_mag_api_base()}?"
                     f"type=itv&action=create_link&mac={self.mac_address}&"
                     f"cmd={urllib.parse.quote(cmd)}&"
                     f"JsHttpRequest=1-xml&_t={timestamp}&_r={random_id}&"
                     f"retry={attempt}"  # Help server track retries
                 )
                 
-                # Shorter timeout for high-load situations
-                response = self.requests.get(create_link_url, timeout=2)
+                # Shorter timeout for high-load situations - a slow answer is hedged, not waited out
+                response = self.requests.hedged_get(create_link_url, "create_link", 2)
                 
                 if response.status_code == 200:
                     data = response.json().get('js', {})
@@ -5619,7 +8472,7 @@ class WindowsIPTVPlayer:
                         return real_cmd.replace("ffmpeg ", "").strip()
                 
                 elif response.status_code == 503:  # Server overloaded
-                    backoff_delay = (attempt + 1) * 2  # 2, 4, 6 seconds
+                    backoff_delay = (attempt + 1) * 2 * random.uniform(0.75, 1.25)  # 2, 4, 6 seconds ±25% to spread load
                     print(f"🚦 Server overloaded, backing off {backoff_delay}s...")
                     time.sleep(backoff_delay)
                     continue
@@ -5635,7 +8488,8 @@ class WindowsIPTVPlayer:
     
     
     def try_direct_play_fast(self, stream_url, channel_name):
-        """Fast direct play optimized for high-load servers"""
+        """Fast direct play optimized for high-load servers - blocks until the player confirms,
+        so it is called from worker threads and only touches Tk through root.after"""
         try:
             print(f"⚡ Fast direct play: {channel_name}")
             
@@ -5661,14 +8515,14 @@ class WindowsIPTVPlayer:
                 "-i", stream_url
             ]
             
-            process = subprocess.Popen(ffplay_command, 
-                                    stdout=subprocess.DEVNULL, 
-                                    stderr=subprocess.PIPE)
+            self.engine.player.play(stream_url, self.portal_url + "index.html",
+                                    user_agent="VLC/3.0.0 LibVLC/3.0.0", command=ffplay_command,
+                                    title=channel_name, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL)
             
-            # Quick success check
-            time.sleep(1.5)
-            if process.poll() is None:
-                self.status_var.set(f"Playing {channel_name} (High-Load Mode)")
+            # Success only once the player reports the stream open (mpv) or is still up (ffplay)
+            if self.engine.player.wait_started():
+                self.root.after(0, lambda: self.status_var.set(f"Playing {channel_name} (High-Load Mode)"))
                 print(f"✅ Fast play successful: {channel_name}")
                 return True
             else:
@@ -5683,7 +8537,7 @@ class WindowsIPTVPlayer:
         """Show options when servers are overloaded"""
         options_window = tb.Toplevel(self.root)
         options_window.title("Server High Load Detected")
-        options_window.geometry("450x300")
+        options_window.geometry("450x250")
         options_window.grab_set()
         
         tk.Label(options_window, 
@@ -5705,17 +8559,7 @@ class WindowsIPTVPlayer:
                 bg="#2196F3", fg="white", font=("Arial", 11, "bold"),
                 width=30, height=2).pack(pady=5)
         
-        # Option 2: Try Alternative Quality
-        def try_alternative():
-            options_window.destroy()
-            self.find_alternative_stream(channel_name)
-        
-        tk.Button(options_window, text="📺 Find Alternative Stream", 
-                command=try_alternative,
-                bg="#FF9800", fg="white", font=("Arial", 11, "bold"),
-                width=30, height=2).pack(pady=5)
-        
-        # Option 3: Wait and Retry
+        # Option 2: Wait and Retry
         def wait_and_retry():
             options_window.destroy()
             self.scheduled_retry(channel_name, original_cmd, delay=60)
@@ -5803,62 +8647,6 @@ class WindowsIPTVPlayer:
         
         
         
-    def find_alternative_stream(self, channel_name):
-        """Find alternative streams of the same channel"""
-        alternatives = []
-        search_terms = channel_name.lower().split()
-        
-        # Look for similar channels
-        for channel in self.channels:
-            alt_name = channel[0].lower()
-            
-            # Check if it's a similar channel
-            matches = sum(1 for term in search_terms if term in alt_name)
-            if matches >= len(search_terms) // 2 and channel[0] != channel_name:
-                alternatives.append(channel)
-        
-        if alternatives:
-            self.show_alternatives_window(channel_name, alternatives)
-        else:
-            messagebox.showinfo("No Alternatives", 
-                            f"No alternative streams found for '{channel_name}'.\n"
-                            "Try waiting for server load to decrease.")
-
-    def show_alternatives_window(self, original_name, alternatives):
-        """Show alternative streams window"""
-        alt_window = tb.Toplevel(self.root)
-        alt_window.title("Alternative Streams")
-        alt_window.geometry("500x400")
-        alt_window.grab_set()
-        
-        tk.Label(alt_window, 
-                text=f"Alternative streams for '{original_name}':", 
-                font=("Arial", 12, "bold")).pack(pady=10)
-        
-        # List of alternatives
-        alt_listbox = Listbox(alt_window, font=("Arial", 10), height=10)
-        alt_listbox.pack(fill=tk.BOTH, expand=True, padx=20, pady=10)
-        
-        for alt in alternatives:
-            alt_listbox.insert(tk.END, alt[0])
-        
-        def play_alternative():
-            selection = alt_listbox.curselection()
-            if selection:
-                alt_channel = alternatives[selection[0]]
-                alt_window.destroy()
-                # Try to play the alternative
-                fresh_url = self.get_stream_link_with_retry(alt_channel[2])
-                if fresh_url:
-                    self.try_direct_play_fast(fresh_url, alt_channel[0])
-        
-        tk.Button(alt_window, text="▶️ Play Selected", 
-                command=play_alternative,
-                bg="#4CAF50", fg="white", font=("Arial", 11, "bold")).pack(pady=10)
-        
-        
-        
-
     def try_immediate_play(self, stream_url, user_agent, referer):
         """INSTANT play attempt - no delays, no checks, just GO!"""
         try:
@@ -5871,7 +8659,7 @@ class WindowsIPTVPlayer:
             ]
             
             # ✅ START IMMEDIATELY - no pipes, no checks, just launch!
-            process = subprocess.Popen(ffplay_command)
+            process, _ = self.engine.player.play(stream_url, referer, user_agent=user_agent, command=ffplay_command)
             
             self.status_var.set(f"Playing direct stream (PID: {process.pid})")
             print("⚡ INSTANT play launched!")
@@ -5887,11 +8675,11 @@ class WindowsIPTVPlayer:
         print(f"🚀 INSTANT token request for: {cmd}")
         
         # ✅ INSTANT request - no timestamps, no random, just GO!
-        create_link_url = f"{self.portal_url}server/load.php?type=itv&action=create_link&mac={self.mac_address}&cmd={urllib.parse.quote(cmd)}&JsHttpRequest=1-xml"
+        create_link_url = f"{self.portal_url}{self.engine.portal.get_mag_api_base()}?type=itv&action=create_link&mac={self.mac_address}&cmd={urllib.parse.quote(cmd)}&JsHttpRequest=1-xml"
         
         try:
             # ✅ SHORTEST POSSIBLE timeout
-            response = self.requests.get(create_link_url, timeout=1)
+            response = self.requests.hedged_get(create_link_url, "create_link", 1)
             if response.status_code == 200:
                 data = response.json().get('js', {})
                 real_cmd = data.get('cmd', '')
@@ -5950,99 +8738,15 @@ class WindowsIPTVPlayer:
             
    
         
-    def trim_active_cache_file(self, file_info):
-        """Trim the beginning of an active cache file to reduce size"""
-        try:
-            file_path = file_info['path']
-            current_size = file_info['size']
-            
-            # Keep only the last 200MB of the file (about 100 seconds of HD video)
-            target_size = 200 * 1024 * 1024  # 200MB
-            
-            if current_size <= target_size:
-                return  # File is already small enough
-            
-            print(f"✂️ Trimming cache file: {file_info['name']} ({current_size/1024/1024:.1f}MB)")
-            
-            # Create temporary file
-            temp_path = file_path + ".tmp"
-            bytes_to_skip = current_size - target_size
-            
-            # Copy the last part of the file
-            with open(file_path, 'rb') as src:
-                src.seek(bytes_to_skip)  # Skip the beginning
-                with open(temp_path, 'wb') as dst:
-                    # Copy in chunks
-                    chunk_size = 1024 * 1024  # 1MB chunks
-                    while True:
-                        chunk = src.read(chunk_size)
-                        if not chunk:
-                            break
-                        dst.write(chunk)
-            
-            # Replace original with trimmed version
-            os.replace(temp_path, file_path)
-            
-            new_size = os.path.getsize(file_path)
-            saved_mb = (current_size - new_size) / (1024 * 1024)
-            print(f"✅ Trimmed {saved_mb:.1f}MB from active cache file")
-            
-        except Exception as e:
-            print(f"Error trimming cache file: {e}")
-            # Clean up temp file if it exists
-            temp_path = file_info['path'] + ".tmp"
-            if os.path.exists(temp_path):
-                try:
-                    os.remove(temp_path)
-                except:
-                    pass
-                
-                
-                
-                
-   
-   
-
-
-            
     def cleanup_orphaned_processes(self):
-        """Clean up any orphaned FFmpeg/FFplay processes"""
+        """Clean up FFmpeg/FFplay processes left behind by a previous run"""
         try:
-            import psutil
-            
-            current_pid = os.getpid()
-            orphaned_count = 0
-            
-            for proc in psutil.process_iter(['pid', 'name', 'ppid', 'create_time']):
-                try:
-                    # Check for FFmpeg/FFplay processes
-                    if proc.info['name'] and proc.info['name'].lower() in ['ffmpeg.exe', 'ffplay.exe']:
-                        # Check if process is old (more than 2 hours)
-                        process_age = time.time() - proc.info['create_time']
-                        
-                        if process_age > 7200:  # 2 hours
-                            proc.terminate()
-                            orphaned_count += 1
-                            print(f"🔪 Terminated old process: {proc.info['name']} (PID: {proc.info['pid']})")
-                            
-                except (psutil.NoSuchProcess, psutil.AccessDenied):
-                    continue
-                    
+            orphaned_count = PROCESS_REGISTRY.cleanup_orphans()
             if orphaned_count > 0:
                 print(f"🧹 Cleaned {orphaned_count} orphaned processes")
-                
-        except ImportError:
-            # psutil not available, skip process cleanup
-            pass
         except Exception as e:
             print(f"Error in process cleanup: {e}")
-            
-            
-            
-   
 
-            
-           
     def cleanup_after_playback(self, process, download_file):
         """Clean up downloaded file after playback ends"""
         try:
@@ -6087,6 +8791,7 @@ class WindowsIPTVPlayer:
             print("🎬 Playing downloaded stream with 15-second delay...")
             
             process = subprocess.Popen(ffplay_command)
+            PROCESS_REGISTRY.register(process, "player", download_file)
             self.status_var.set(f"Playing downloaded stream (PID: {process.pid})")
             
             # Clean up file after playback (optional)
@@ -6350,7 +9055,8 @@ class WindowsIPTVPlayer:
                 "-i", stream_url
             ]
             
-            process = subprocess.Popen(ffplay_command)
+            process, _ = self.engine.player.play(stream_url, referer, user_agent=user_agent,
+                                                 command=ffplay_command, title=content_name)
             self.status_var.set(f"Playing VOD: {content_name} (PID: {process.pid})")
             print(f"🎬 Playing VOD: {content_name}")
             
@@ -6364,53 +9070,225 @@ class WindowsIPTVPlayer:
         
     def diagnose_server_response(self, response_text, portal_url, mac_address):
         """Diagnose why server returned empty channels"""
-        diagnosis = {
-            "response_valid": False,
-            "has_js_key": False,
-            "is_empty": False,
-            "likely_cause": "Unknown"
-        }
-        
-        try:
-            # Check JSON validity
-            data = json.loads(response_text)
-            diagnosis["response_valid"] = True
-            
-            # Check structure
-            if isinstance(data, dict) and "js" in data:
-                diagnosis["has_js_key"] = True
-                js_content = data.get("js")
-                
-                if isinstance(js_content, list) and len(js_content) == 0:
-                    diagnosis["is_empty"] = True
-                    diagnosis["likely_cause"] = "Subscription inactive or expired"
-                elif isinstance(js_content, dict):
-                    data_content = js_content.get("data", [])
-                    if len(data_content) == 0:
-                        diagnosis["is_empty"] = True
-                        diagnosis["likely_cause"] = "No channels assigned to this MAC"
-            
-            # Additional checks
-            if "error" in str(data).lower():
-                diagnosis["likely_cause"] = "Server returned error"
-            
-            print(f"📊 Server Diagnosis: {diagnosis}")
-            return diagnosis
-            
-        except json.JSONDecodeError:
-            diagnosis["likely_cause"] = "Invalid JSON response"
-            return diagnosis
-        
+        return diagnose_server_response(response_text)
     
     
     
+# ==========================================================
+#   Command-line mode - python player.py --cli <command>
+#   Runs without Tk; one JSON result per profile on stdout.
+# ==========================================================
+
+CLI_COMMANDS = ["fetch", "refresh", "search", "resolve", "export-m3u", "probe", "serve"]
+
+
+def find_channel(channels, name):
+    """Exact (case-insensitive) name match first, then the first substring match"""
+    name_lower = name.lower().strip()
+    for channel in channels:
+        if channel[0].lower() == name_lower:
+            return channel
+    for channel in channels:
+        if name_lower in channel[0].lower():
+            return channel
+    return None
+
+
+def cli_profiles(args):
+    """[(name, user_data)] selected by --portal/--mac, --profile or (default) all saved profiles"""
+    if args.portal:
+        if not args.mac:
+            raise EngineError("--portal needs --mac")
+        portal_url = args.portal if args.portal.endswith('/') else args.portal + '/'
+        return [("adhoc", {"portal_url": portal_url, "mac_address": args.mac})]
+
+    profiles = load_profiles(args.credentials)
+    if args.profile:
+        missing = [name for name in args.profile if name not in profiles]
+        if missing:
+            raise EngineError(f"Unknown profile(s): {', '.join(missing)}")
+        return [(name, profiles[name]) for name in args.profile]
+    return sorted(profiles.items())
+
+
+def cli_run_profile(args, name, user_data):
+    """Run one CLI command for one profile - returns a JSON-ready dict"""
+    start_time = time.time()
+    result = {"profile": name, "portal_url": user_data.get("portal_url"),
+              "mac_address": user_data.get("mac_address"), "command": args.command, "ok": False}
+    engine = IPTVEngine(user_data["portal_url"], user_data["mac_address"], cache_dir=args.cache_dir)
+    try:
+        if args.command == "probe":
+            result.update(engine.portal.probe())
+            result["ok"] = result["status"] == 200
+            return result
+
+        # Every other command needs a channel list - cache unless refreshing
+        channels = None if args.command == "refresh" else engine.load_cached_channels()
+        source = "cache" if channels else "portal"
+        if not channels:
+            channels = engine.fetch_channels()
+        # Only set once the list is in hand - run_cli records portal counts from these two keys
+        result["source"] = source
+        result["channels"] = len(channels)
+
+        if args.command == "search":
+            matches, _ = engine.search(args.term)
+            result["results"] = [{"name": ch[0], "url": ch[1]} for ch in matches[:args.limit]]
+            result["matches"] = len(matches)
+        elif args.command == "resolve":
+            channel = find_channel(channels, args.name)
+            if not channel:
+                raise EngineError(f"No channel matching '{args.name}'")
+            result["name"] = channel[0]
+            result["url"] = engine.resolve(channel)
+            if not result["url"]:
+                raise EngineError(f"Could not resolve '{channel[0]}'")
+        elif args.command == "export-m3u":
+            if args.keywords:
+                keywords = [kw.strip().lower() for kw in args.keywords.split(',') if kw.strip()]
+                channels = [ch for ch in channels if any(kw in ch[0].lower() for kw in keywords)]
+            if args.real_urls:
+                entries = [(ch[0], engine.real_stream_url(ch)) for ch in channels]
+            else:
+                entries = [(ch[0], ch[1]) for ch in channels]
+
+            mac_clean = user_data["mac_address"].replace(':', '').lower()
+            suffix = "real" if args.real_urls else "basic"
+            file_path = os.path.join(args.output, f"exported_playlist_{name}_{suffix}_{mac_clean}.m3u")
+            os.makedirs(args.output, exist_ok=True)
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write(build_m3u(entries))
+            result["exported"] = len(entries)
+            result["file"] = os.path.abspath(file_path)
+
+        result["ok"] = True
+    except EngineError as e:
+        result["error"] = str(e)
+    except Exception as e:
+        result["error"] = f"Error: {str(e)}"
+    finally:
+        result["elapsed_ms"] = round((time.time() - start_time) * 1000)
+        engine.close()
+    return result
+
+
+def cli_serve(args, profiles, out):
+    """Serve one profile's live playlist until interrupted"""
+    if len(profiles) != 1:
+        out.write(json.dumps({"ok": False, "error": "serve needs exactly one --profile"}) + "\n")
+        return 2
+    name, user_data = profiles[0]
+    engine = IPTVEngine(user_data["portal_url"], user_data["mac_address"], cache_dir=args.cache_dir)
+    server = None
+    try:
+        channels = engine.load_cached_channels() or engine.fetch_channels()
+        server = PlaylistProxyServer(engine, host=args.bind, port=args.port, mode=args.mode,
+                                     timeshift=args.timeshift)
+        playlist_url = server.start()
+        out.write(json.dumps({"profile": name, "command": "serve", "ok": True,
+                              "channels": len(channels), "playlist_url": playlist_url}) + "\n")
+        out.flush()
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        return 0
+    except (EngineError, OSError) as e:
+        out.write(json.dumps({"profile": name, "command": "serve", "ok": False, "error": str(e)}) + "\n")
+        return 1
+    finally:
+        if server:
+            server.stop()
+        engine.close()
+
+
+def run_cli(argv):
+    """Entry point for --cli - returns the process exit code (0 only if every profile succeeded)"""
+    import argparse
+    import contextlib
+
+    parser = argparse.ArgumentParser(prog="player.py --cli",
+                                     description="Headless IPTV operations on saved profiles")
+    parser.add_argument("command", choices=CLI_COMMANDS)
+    parser.add_argument("term", nargs="?", help="search term (search) or channel name (resolve)")
+    parser.add_argument("--profile", action="append", help="saved profile name (repeatable, default: all)")
+    parser.add_argument("--portal", help="portal URL for a one-off profile")
+    parser.add_argument("--mac", help="MAC address for --portal")
+    parser.add_argument("--credentials", default=CREDENTIALS_DIR, help="profiles directory")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=4, help="profiles processed in parallel")
+    parser.add_argument("--limit", type=int, default=50, help="max search results per profile")
+    parser.add_argument("--output", default=".", help="export-m3u output directory")
+    parser.add_argument("--keywords", help="export-m3u: comma-separated name filter")
+    parser.add_argument("--real-urls", action="store_true", help="export-m3u: resolve create_link URLs")
+    parser.add_argument("--bind", default="127.0.0.1", help="serve: listen address")
+    parser.add_argument("--port", type=int, default=8765, help="serve: listen port")
+    parser.add_argument("--mode", choices=["proxy", "redirect"], default="proxy",
+                        help="serve: pipe streams through the server or redirect to the fresh URL")
+    parser.add_argument("--timeshift", action="store_true",
+                        help="serve: keep ~200MB per watched channel on disk for ?back=<seconds>")
+    parser.add_argument("--verbose", action="store_true", help="keep engine logging on stderr")
+    args = parser.parse_args(argv)
+
+    if args.command in ("search", "resolve") and not args.term:
+        parser.error(f"{args.command} needs a search term / channel name")
+    args.name = args.term
+
+    out = sys.stdout
+    log = sys.stderr if args.verbose else open(os.devnull, "w", encoding="utf-8")
+    failures = 0
+    try:
+        # Engine diagnostics go to stderr (or nowhere) so stdout stays one JSON object per line
+        with contextlib.redirect_stdout(log):
+            try:
+                profiles = cli_profiles(args)
+            except EngineError as e:
+                out.write(json.dumps({"ok": False, "error": str(e)}) + "\n")
+                return 2
+            if not profiles:
+                out.write(json.dumps({"ok": False, "error": "No saved profiles"}) + "\n")
+                return 2
+            if args.command == "serve":
+                return cli_serve(args, profiles, out)
+
+            store = ProfileStore(args.credentials)
+            with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+                futures = [executor.submit(cli_run_profile, args, name, user_data)
+                           for name, user_data in profiles]
+                for future in as_completed(futures):
+                    result = future.result()
+                    failures += not result["ok"]
+                    if (result.get("source") == "portal" and "channels" in result
+                            and result["profile"] in store.profiles):
+                        store.update(result["profile"], channel_count=result["channels"],
+                                     channels_updated=time.time())
+                    out.write(json.dumps(result) + "\n")
+                    out.flush()
+    finally:
+        if log is not sys.stderr:
+            log.close()
+    return 1 if failures else 0
+
+
 # Start Application
 if __name__ == "__main__":
+    # Parse worker processes re-enter here in frozen (PyInstaller) builds
+    import multiprocessing
+    multiprocessing.freeze_support()
+    if "--cli" in sys.argv[1:]:
+        cli_argv = [arg for arg in sys.argv[1:] if arg not in ("--cli", "--profile-startup")]
+        exit_code = run_cli(cli_argv)
+        report_startup_profile()
+        sys.exit(exit_code)
     theme = load_theme()
+    startup_phase("config loaded")
     if theme == "default":
         root = tk.Tk()
     else:
         root = tb.Window(themename=theme)
+    startup_phase("main window created")
     center_window(root, 400, 250)
     IPTVUserSelection(root)
+    startup_phase("user selection built")
+    root.after_idle(report_startup_profile)  # Runs once the first frame has been drawn
     root.mainloop()
\ No newline at end of file
@@ -8,7 +8,7 @@ a = Analysis(
         ('credentials', 'credentials'),
         ('ffmpeg', 'ffmpeg'),  
     ],
-    hiddenimports=['sys'],
+    hiddenimports=['sys', 'ttkbootstrap', 'requests', 'pickle'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],